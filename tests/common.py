@@ -0,0 +1,116 @@
+"""Helpers shared by the tests, which run the drivers against sim:// chips."""
+import itertools
+import os
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from z2mflasher.cclib.ccdebugger import openCCDebugger
+from z2mflasher.cclib.ccsim import CC2530Sim, SimTransport, registerSimulator
+
+_names = itertools.count()
+
+
+def open_sim(sim=None):
+    """Register a new simulated chip and open a driver on it."""
+    sim = sim or CC2530Sim()
+    name = 'test%i' % next(_names)
+    registerSimulator(name, sim)
+    return sim, openCCDebugger('sim://' + name)
+
+
+def random_image(size, seed=0, padding=False):
+    """Pseudo-random image, alternating with runs of zeros if padding."""
+    rnd = random.Random(seed)
+    data = bytearray(rnd.randint(0, 255) for i in range(size))
+    if padding:
+        for i in range(0, size, 1024):
+            data[i:i + 512] = bytearray(len(data[i:i + 512]))
+    return bytes(data)
+
+
+def stick_bits(sim, addr, mask, times=None):
+    """Make the bits of mask read as 0 at a flash address after every flash
+    word write, or only for the given number of writes of that word.
+    """
+    write = sim.writeFWDATA
+    left = [times]
+
+    def faulty(v):
+        before = sim.flash[addr]
+        write(v)
+        if sim.flash[addr] != before and left[0] != 0:
+            sim.flash[addr] &= ~mask & 0xFF
+            if left[0] is not None:
+                left[0] -= 1
+    sim.writeFWDATA = faulty
+
+
+class SimBridge(object):
+    """Serves a simulated chip on a loopback TCP port, like the serial-to-TCP
+    bridge of the z2m module.
+    """
+
+    def __init__(self, sim, banner=b""):
+        self.sim = sim
+        self.banner = banner
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'socket://127.0.0.1:%i' % self.port
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            with conn:
+                self.relay(conn)
+
+    def relay(self, conn):
+        transport = SimTransport(self.sim, timeout=0)
+        conn.sendall(self.banner)
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                return
+            transport.write(data)
+            ans = transport.read(len(transport.rx))
+            if ans:
+                conn.sendall(ans)
+
+    def close(self):
+        # Wakes up accept() in serve()
+        self.server.shutdown(socket.SHUT_RDWR)
+        self.server.close()
+        self.thread.join(5)
+
+
+class SimTestCase(unittest.TestCase):
+    """Keeps the CCLib caches (inventory, ports) in a temporary directory."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self._cache = os.environ.get('CC_CACHE_DIR')
+        os.environ['CC_CACHE_DIR'] = os.path.join(self.tmp, 'cache')
+
+    def tearDown(self):
+        if self._cache is None:
+            del os.environ['CC_CACHE_DIR']
+        else:
+            os.environ['CC_CACHE_DIR'] = self._cache
+        shutil.rmtree(self.tmp)
+
+    def path(self, name):
+        return os.path.join(self.tmp, name)
@@ -0,0 +1,122 @@
+"""The asyncio drivers against simulated chips."""
+import asyncio
+
+from z2mflasher.cclib.ccasync import AsyncSocketTransport, openCCDebuggerAsync
+from z2mflasher.cclib.ccsim import CC2510Sim, CC2530Sim, registerSimulator
+from z2mflasher.cclib.chip import CCVerifyError
+
+from tests.common import SimBridge, SimTestCase, open_sim, random_image, stick_bits
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def write(port, *args, **kwargs):
+    async def flash():
+        dbg = await openCCDebuggerAsync(port)
+        try:
+            await dbg.pauseDMA(False)
+            await dbg.writeCODE(*args, **kwargs)
+        finally:
+            dbg.close()
+    run(flash())
+
+
+class AsyncWriteTest(SimTestCase):
+
+    def test_cc2530(self):
+        sim = registerSimulator('async2530', CC2530Sim())
+        data = random_image(0x1000, seed=60)
+        write('sim://async2530', 0x800, data, verify=True)
+        self.assertEqual(bytes(sim.flash[0x800:0x1800]), data)
+
+    def test_cc2530_verify_error(self):
+        sim = registerSimulator('async2530b', CC2530Sim())
+        data = random_image(0x1000, seed=63)
+        bad = next(i for i in range(0x900, 0x1000) if data[i] != 0x00)
+        stick_bits(sim, bad, data[bad])
+        with self.assertRaises(CCVerifyError) as cm:
+            write('sim://async2530b', 0, data, verify='crc')
+        self.assertEqual(cm.exception.offset, bad)
+
+    def test_cc2530_unverified(self):
+        sim = registerSimulator('async2530c', CC2530Sim())
+        data = random_image(0x1000, seed=64)
+        bad = next(i for i in range(0x900, 0x1000) if data[i] != 0x00)
+        stick_bits(sim, bad, data[bad])
+        write('sim://async2530c', 0, data, verify='off')
+        self.assertNotEqual(sim.flash[bad], data[bad])
+
+    def test_shadow(self):
+        sim = registerSimulator('async2530d', CC2530Sim())
+
+        async def flash():
+            dbg = await openCCDebuggerAsync('sim://async2530d')
+            await dbg.pauseDMA(False)
+            await dbg.writeCODE(0, random_image(0x1000, seed=65))
+            shadow = dict(dbg.shadow)
+            await dbg.writeCODE(0x1000, random_image(0x1000, seed=66))
+            self.assertEqual(dbg.shadow, shadow)
+            await dbg.resume()
+            self.assertEqual(dbg.shadow, {})
+            dbg.close()
+            return shadow
+
+        shadow = run(flash())
+        self.assertIn(('DMA', 0x1000), shadow)
+        for key, value in shadow.items():
+            if isinstance(key, tuple) and key[0] == 'DMA':
+                self.assertEqual([sim.readX(key[1] + i) for i in range(8)], list(value))
+
+    def test_cc2510(self):
+        sim = registerSimulator('async2510', CC2510Sim())
+        sim.flash[0:0x400] = b"\x55" * 0x400
+        data = random_image(0x900, seed=61)
+        write('sim://async2510', 0x100, data, erase=True, verify='full')
+        self.assertEqual(bytes(sim.flash[0x100:0xA00]), data)
+        self.assertEqual(bytes(sim.flash[:0x100]), b"\x55" * 0x100)
+        self.assertEqual(bytes(sim.flash[0xA00:0xC00]), b"\xff" * 0x200)
+
+    def test_cc2510_verify_error(self):
+        sim = registerSimulator('async2510b', CC2510Sim())
+        data = random_image(0x800, seed=62)
+        bad = next(i for i in range(0x400, 0x800) if data[i] != 0x00)
+        stick_bits(sim, bad, data[bad])
+        with self.assertRaises(CCVerifyError) as cm:
+            write('sim://async2510b', 0, data, verify='crc')
+        self.assertEqual(cm.exception.offset, bad)
+
+
+class AsyncSocketTest(SimTestCase):
+
+    def setUp(self):
+        SimTestCase.setUp(self)
+        self.sim, _ = open_sim()
+        self.bridge = None
+
+    def tearDown(self):
+        if self.bridge:
+            self.bridge.close()
+        SimTestCase.tearDown(self)
+
+    def test_write(self):
+        self.bridge = SimBridge(self.sim)
+        data = random_image(0x800, seed=67)
+        write(self.bridge.url, 0x800, data, verify='full')
+        self.assertEqual(bytes(self.sim.flash[0x800:0x1000]), data)
+
+    def test_flush_input(self):
+        self.bridge = SimBridge(self.sim, banner=b"\x00stale")
+
+        async def flush():
+            transport = await AsyncSocketTransport.open(self.bridge.url, timeout=0.5)
+            await asyncio.sleep(0.1)
+            transport.flushInput()
+            try:
+                with self.assertRaises(IOError):
+                    await transport.read(1)
+            finally:
+                transport.close()
+
+        run(flush())
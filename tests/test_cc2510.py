@@ -0,0 +1,33 @@
+"""CC251x flash programming against a simulated chip."""
+from z2mflasher.cclib.ccsim import CC2510Sim
+
+from tests.common import SimTestCase, open_sim, random_image, stick_bits
+
+
+class CC2510WriteTest(SimTestCase):
+
+    def setUp(self):
+        SimTestCase.setUp(self)
+        self.sim, self.dbg = open_sim(CC2510Sim())
+
+    def test_write(self):
+        self.dbg.chipErase()
+        data = random_image(0x1000, seed=30)
+        self.dbg.writeCODE(0, data, verify='full')
+        self.assertEqual(bytes(self.sim.flash[:0x1000]), data)
+
+    def test_partial_erase(self):
+        self.sim.flash[0:0x800] = bytes(range(256)) * 8
+        # The two pages are programmed whole
+        self.assertEqual(self.dbg.writeCODE(0x100, b"\x11" * 0x500, erase=True, verify='crc'), 0x800)
+        expected = bytearray(bytes(range(256)) * 8)
+        expected[0x100:0x600] = b"\x11" * 0x500
+        self.assertEqual(bytes(self.sim.flash[0:0x800]), bytes(expected))
+
+    def test_fault(self):
+        self.dbg.chipErase()
+        data = random_image(0x800, seed=31)
+        bad = next(i for i in range(0x400, 0x800) if data[i] != 0x00)
+        stick_bits(self.sim, bad, data[bad], times=1)
+        self.dbg.writeCODE(0, data, verify='full', retries=1)
+        self.assertEqual(bytes(self.sim.flash[:0x800]), data)
@@ -0,0 +1,86 @@
+"""Dumping the flash to Intel HEX and binary files."""
+import os
+
+from z2mflasher.cclib.cchex import CCHEXFile, CCHEXWriter
+
+from tests.common import SimTestCase, open_sim, random_image
+
+
+class DumpTest(SimTestCase):
+
+    def setUp(self):
+        SimTestCase.setUp(self)
+        self.sim, self.dbg = open_sim()
+        self.sim.flash[0:0x800] = random_image(0x800, seed=40)
+        self.sim.flash[0x8800:0x9000] = random_image(0x800, seed=41)
+
+    def load(self, filename):
+        hexFile = CCHEXFile(filename)
+        hexFile.load()
+        image = bytearray(b"\xff" * 0x9000)
+        for mb in hexFile.memBlocks:
+            image[mb.addr:mb.addr + mb.size] = mb.bytes
+        return bytes(image)
+
+    def test_dump(self):
+        self.assertEqual(self.dbg.dumpCODE(self.path('d.hex')), 0x1000)
+        self.assertEqual(self.load(self.path('d.hex')), bytes(self.sim.flash[:0x9000]))
+
+    def test_resume(self):
+        readCODE = self.dbg.readCODE
+        reads = []
+        failures = [1]
+
+        def failing(offset, size):
+            reads.append(offset)
+            if offset >= 0x8000 and failures[0]:
+                failures[0] -= 1
+                raise IOError("link lost")
+            return readCODE(offset, size)
+
+        self.dbg.readCODE = failing
+        with self.assertRaises(IOError):
+            self.dbg.dumpCODE(self.path('d.bin'))
+        self.assertTrue(os.path.isfile(self.path('d.bin.resume')))
+
+        del reads[:]
+        self.assertEqual(self.dbg.dumpCODE(self.path('d.bin')), 0x800)
+        self.assertTrue(all(offset >= 0x8000 for offset in reads))
+        self.assertFalse(os.path.isfile(self.path('d.bin.resume')))
+        with open(self.path('d.bin'), 'rb') as f:
+            self.assertEqual(f.read(), bytes(self.sim.flash[:0x9000]))
+
+
+class HEXWriterTest(SimTestCase):
+
+    def test_hex_round_trip(self):
+        data = random_image(0x300, seed=3)
+        writer = CCHEXWriter(self.path('a.hex'))
+        writer.write(0xFF80, data[:0x100])
+        writer.write(0x20000, data[0x100:])
+        writer.close()
+
+        hexFile = CCHEXFile(self.path('a.hex'))
+        hexFile.load()
+        image = {}
+        for mb in hexFile.memBlocks:
+            for i, b in enumerate(mb.bytes):
+                image[mb.addr + i] = b
+        self.assertEqual(bytes(image[0xFF80 + i] for i in range(0x100)), data[:0x100])
+        self.assertEqual(bytes(image[0x20000 + i] for i in range(0x200)), data[0x100:])
+
+    def test_resume(self):
+        data = random_image(0x200, seed=4)
+        writer = CCHEXWriter(self.path('b.bin'))
+        writer.write(0, data[:0x100])
+        writer.flush()
+        kept = writer.tell()
+        writer.write(0x100, b"\x00" * 0x80)   # lost when resuming
+        writer.close()
+
+        writer = CCHEXWriter(self.path('b.bin'), resumeAt=kept)
+        writer.write(0x100, data[0x100:])
+        writer.close()
+        with open(self.path('b.bin'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(os.path.getsize(self.path('b.bin')), 0x200)
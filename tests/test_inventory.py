@@ -0,0 +1,30 @@
+"""The inventory of flashed devices."""
+import threading
+
+from z2mflasher.cclib.cccache import loadCache
+from z2mflasher.cclib.ccinventory import INVENTORY_CACHE, getDevice, recordDevice
+
+from tests.common import SimTestCase
+
+
+class InventoryTest(SimTestCase):
+
+    def test_record(self):
+        recordDevice('00124b0001', chipID=0xA524, imageHash='a')
+        recordDevice('00124b0001', imageHash='b')
+        entry = getDevice('00124b0001')
+        self.assertEqual((entry['chipID'], entry['imageHash']), (0xA524, 'b'))
+        self.assertIn('updated', entry)
+        self.assertIsNone(getDevice('00124b0002'))
+
+    def test_concurrent(self):
+        # Batches updating the inventory at the same time lose no entries
+        def batch(n):
+            for i in range(10):
+                recordDevice('%02x%02x' % (n, i), batch=n)
+        threads = [threading.Thread(target=batch, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(loadCache(INVENTORY_CACHE)), 80)
@@ -0,0 +1,120 @@
+"""Flashing Zigbee chips through the z2mflasher entry points."""
+import json
+import os
+
+from z2mflasher import progress
+from z2mflasher.__main__ import run_esphomeflasher, zigbee_flash
+from z2mflasher.cclib.cccache import loadCache
+from z2mflasher.cclib.cchex import CCHEXWriter
+from z2mflasher.cclib.ccinventory import INVENTORY_CACHE
+from z2mflasher.cclib.ccproxy import CMD_CHPERASE
+from z2mflasher.cclib.ccsim import CC2510Sim, CC2530Sim, registerSimulator
+from z2mflasher.cclib.chip import CCVerifyError
+from z2mflasher.common import EsphomeflasherError
+
+from tests.common import SimTestCase, random_image, stick_bits
+
+
+class FirmwareTestCase(SimTestCase):
+
+    def write_hex(self, name, addr, data, *blocks):
+        writer = CCHEXWriter(self.path(name))
+        writer.write(addr, data)
+        for addr, data in blocks:
+            writer.write(addr, data)
+        writer.close()
+        return self.path(name)
+
+
+class ZigbeeFlashTest(FirmwareTestCase):
+
+    def test_cc2510(self):
+        data = random_image(0x900, seed=50)
+        firmware = self.write_hex('fw.hex', 0, data)
+        sim = CC2510Sim()
+        registerSimulator('main2510', sim)
+        zigbee_flash('sim://main2510', firmware)
+        self.assertEqual(bytes(sim.flash[:len(data)]), data)
+
+    def test_cc2510_rejects_cc254x_modes(self):
+        firmware = self.write_hex('fw.hex', 0, random_image(0x100, seed=51))
+        sim = CC2510Sim()
+        registerSimulator('main2510b', sim)
+        with self.assertRaises(EsphomeflasherError):
+            zigbee_flash('sim://main2510b', firmware, loader=True)
+        self.assertEqual(bytes(sim.flash[:0x100]), b"\xff" * 0x100)
+
+    def test_cc2510_rejects_page_erase(self):
+        firmware = self.write_hex('fw.hex', 0, random_image(0x100, seed=54))
+        registerSimulator('main2510c', CC2510Sim())
+        with self.assertRaises(EsphomeflasherError):
+            zigbee_flash('sim://main2510c', firmware, page_erase=True, dump=self.path('d.hex'))
+        self.assertFalse(os.path.exists(self.path('d.hex')))
+
+    def test_page_erase_skips_flashed(self):
+        sim = CC2530Sim()
+        registerSimulator('main2530b', sim)
+        ieee = sim.flashSize - 0x18
+        data = random_image(0x1000, seed=55)
+        firmware = self.write_hex('fw.hex', 0, data, (ieee, b"\x11" * 8))
+        zigbee_flash('sim://main2530b', firmware, page_erase=True, preserve=('ieee', 'lock'))
+        self.assertEqual(bytes(sim.flash[:0x1000]), data)
+        self.assertEqual(bytes(sim.flash[ieee:ieee + 8]), b"\xff" * 8)
+
+        # The preserved IEEE address does not match the image, but it is not
+        # part of what was flashed
+        device, = [entry for entry in loadCache(INVENTORY_CACHE).values()]
+        self.assertNotIn('checkTime', device)
+        zigbee_flash('sim://main2530b', firmware, page_erase=True, preserve=('ieee', 'lock'))
+        device, = [entry for entry in loadCache(INVENTORY_CACHE).values()]
+        self.assertIn('checkTime', device)
+
+    def test_inventory_times(self):
+        firmware = self.write_hex('fw.hex', 0, random_image(0x1000, seed=56))
+        registerSimulator('main2530c', CC2530Sim())
+        zigbee_flash('sim://main2530c', firmware, verify='full')
+        device, = [entry for entry in loadCache(INVENTORY_CACHE).values()]
+        self.assertEqual(device['verify'], 'full')
+        self.assertGreater(device['verifyTime'], 0)
+        self.assertGreater(device['flashTime'], 0)
+
+    def test_verify_error_not_retried(self):
+        data = random_image(0x1000, seed=53)
+        firmware = self.write_hex('fw.hex', 0, data)
+        sim = CC2530Sim()
+        registerSimulator('main2530', sim)
+        stick_bits(sim, 0x900, 0xFF)
+        with self.assertRaises(CCVerifyError):
+            zigbee_flash('sim://main2530', firmware, verify='full', retries=0)
+        self.assertEqual(sim.frames[CMD_CHPERASE], 1)
+
+
+class CommandLineTest(FirmwareTestCase):
+
+    def test_cc2510(self):
+        data = random_image(0x1100, seed=52)
+        firmware = self.write_hex('fw.hex', 0x200, data)
+        sim = CC2510Sim()
+        registerSimulator('cli2510', sim)
+        run_esphomeflasher(['z2mflasher', '--cc253x', '-p', 'sim://cli2510', '--binary', firmware])
+        self.assertEqual(bytes(sim.flash[0x200:0x200 + len(data)]), data)
+        self.assertEqual(bytes(sim.flash[:0x200]), b"\xff" * 0x200)
+
+    def test_progress_log(self):
+        data = random_image(0x800, seed=57)
+        firmware = self.write_hex('fw.hex', 0, data)
+        registerSimulator('cli2530', CC2530Sim())
+        listeners = list(progress._listeners)
+        run_esphomeflasher(['z2mflasher', '--cc253x', '-p', 'sim://cli2530', '--binary', firmware,
+                            '--progress-log', self.path('progress.log')])
+        self.assertEqual(progress._listeners, listeners)
+        with open(self.path('progress.log')) as f:
+            events = [json.loads(line) for line in f]
+        self.assertIn(('write', True), [(e['phase'], e['final']) for e in events])
+        self.assertTrue(all(e['source'] == 'sim://cli2530' for e in events))
+
+    def test_progress_log_error(self):
+        firmware = self.write_hex('fw.hex', 0, random_image(0x100, seed=58))
+        with self.assertRaises(EsphomeflasherError):
+            run_esphomeflasher(['z2mflasher', '--cc253x', '-p', 'sim://cli2530b', '--binary', firmware,
+                                '--progress-log', self.path('missing/progress.log')])
@@ -0,0 +1,46 @@
+"""Page erase: preserved regions and the image ranges left to write."""
+import unittest
+
+from z2mflasher.__main__ import parse_args
+from z2mflasher.cclib.cchex import CCMemBlock, stripRanges
+from z2mflasher.cclib.chip.cc254x import parsePreserve
+
+from tests.common import SimTestCase, open_sim
+
+
+def block(addr, data):
+    mb = CCMemBlock(addr)
+    mb.stack(bytearray(data))
+    return mb
+
+
+class StripRangesTest(unittest.TestCase):
+
+    def test_split(self):
+        blocks = stripRanges([block(0x100, range(0x100))], [(0x140, 0x150), (0x1F0, 0x300)])
+        self.assertEqual([(mb.addr, mb.size) for mb in blocks], [(0x100, 0x40), (0x150, 0xA0)])
+        self.assertEqual(bytes(blocks[1].bytes), bytes(range(0x50, 0xF0)))
+
+    def test_drop_covered(self):
+        blocks = stripRanges([block(0x10, b"\x01" * 16), block(0x40, b"\x02" * 16)], [(0, 0x30)])
+        self.assertEqual([(mb.addr, mb.size) for mb in blocks], [(0x40, 16)])
+
+
+class PreserveTest(SimTestCase):
+
+    def test_ranges(self):
+        sim, dbg = open_sim()
+        self.assertEqual(dbg.preservedRanges(['ieee', 'lock', '100-200']),
+                         [(sim.flashSize - 0x18, sim.flashSize - 0x10),
+                          (sim.flashSize - 0x10, sim.flashSize), (0x100, 0x200)])
+
+    def test_invalid(self):
+        for spec in ('iee', '100', '200-100', 'x-200', '-'):
+            with self.assertRaises(ValueError):
+                parsePreserve([spec])
+
+    def test_cli(self):
+        self.assertEqual(parse_args(['z2mflasher', '-p', 'sim://']).cc_preserve, ['nv', 'ieee', 'lock'])
+        self.assertEqual(parse_args(['z2mflasher', '-p', 'sim://', '--cc-preserve', 'lock,']).cc_preserve, ['lock'])
+        with self.assertRaises(SystemExit):
+            parse_args(['z2mflasher', '-p', 'sim://', '--cc-preserve', 'nv,iee'])
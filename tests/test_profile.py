@@ -0,0 +1,19 @@
+"""PC sampling of the simulated firmware."""
+from z2mflasher.cclib.ccprofile import CCProfiler
+
+from tests.common import SimTestCase, open_sim
+
+
+class ProfilerTest(SimTestCase):
+
+    def test_sample(self):
+        sim, dbg = open_sim()
+        dbg.getCODEChecksums([(0, 0x100)])
+        profiler = CCProfiler(dbg)
+        self.assertEqual(profiler.sample(count=5, interval=0.001), 5)
+        self.assertEqual(sum(profiler.samples.values()), 5)
+        self.assertFalse(sim.cpu.halted)
+
+        # The firmware ran between the samples
+        self.assertEqual(dbg.shadow, {})
+        self.assertEqual(dbg.routines, {})
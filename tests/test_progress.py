@@ -0,0 +1,119 @@
+"""Progress events and their listeners."""
+import contextlib
+import io
+import json
+import unittest
+
+from z2mflasher.common import FlashProgress
+from z2mflasher.progress import ProgressTracker, add_listener, json_listener, remove_listener
+
+
+class ListenerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        add_listener(self.events.append)
+        self.addCleanup(remove_listener, self.events.append)
+
+
+class ProgressTrackerTest(ListenerTestCase):
+
+    def test_events(self):
+        tracker = ProgressTracker('write', 100, source='sim://a')
+        tracker.update(10)               # rate-limited
+        tracker.interval = 0
+        tracker.advance(40)
+        tracker.finish("done")
+        self.assertEqual([(e.done, e.final) for e in self.events], [(0, False), (50, False), (100, True)])
+        first, middle, last = self.events
+        self.assertEqual((first.phase, first.total, first.source), ('write', 100, 'sim://a'))
+        self.assertEqual(middle.percent, 50.0)
+        self.assertIsNotNone(middle.eta)
+        self.assertEqual((last.percent, last.message), (100.0, "done"))
+
+    def test_nested(self):
+        tracker = ProgressTracker('write', 100, show=None)
+        tracker.advance(100)
+        tracker.finish()
+        self.assertEqual(self.events, [])
+
+    def test_no_total(self):
+        tracker = ProgressTracker('erase', 0)
+        tracker.finish()
+        self.assertEqual([e.percent for e in self.events], [0.0, 100.0])
+
+    def test_show(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            tracker = ProgressTracker('write', 100, show=True)
+            tracker.finish("3 pages")
+        self.assertIn("Progress 100%", out.getvalue())
+        self.assertIn("OK (3 pages)", out.getvalue())
+
+    def test_remove_listener(self):
+        remove_listener(self.events.append)
+        ProgressTracker('write', 100).finish()
+        self.assertEqual(self.events, [])
+
+    def test_json_listener(self):
+        out = io.StringIO()
+        listener = add_listener(json_listener(out))
+        try:
+            ProgressTracker('dump', 10, source='sim://b').finish()
+        finally:
+            remove_listener(listener)
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([(d['phase'], d['done'], d['final']) for d in lines],
+                         [('dump', 0, False), ('dump', 10, True)])
+        self.assertEqual(lines[-1]['source'], 'sim://b')
+
+
+class FakeChip(object):
+    """The flash commands of an esptool stub chip."""
+
+    def __init__(self):
+        self.blocks = []
+
+    def flash_begin(self, size, offset):
+        pass
+
+    def flash_block(self, data, seq):
+        self.blocks.append(data)
+
+    def flash_defl_begin(self, size, compsize, offset):
+        pass
+
+    def flash_defl_block(self, data, seq):
+        self.blocks.append(data)
+
+
+class FlashProgressTest(ListenerTestCase):
+
+    def test_write(self):
+        chip = FakeChip()
+        with FlashProgress(chip, 'spiffs', source='/dev/ttyUSB0'):
+            chip.flash_begin(8, 0)
+            chip.flash_block(b"\x00" * 4, 0)
+            chip.flash_block(b"\x00" * 4, 1)
+            # Compressed: the sizes are the ones sent over the port
+            chip.flash_defl_begin(100, 6, 0x1000)
+            chip.flash_defl_block(b"\x00" * 6, 0)
+        self.assertEqual(len(chip.blocks), 3)
+        finals = [(e.phase, e.total, e.done) for e in self.events if e.final]
+        self.assertEqual(finals, [('spiffs', 8, 8), ('spiffs', 6, 6)])
+        self.assertEqual(set(e.source for e in self.events), set(['/dev/ttyUSB0']))
+
+        # The chip is left as it was
+        self.assertNotIn('flash_block', chip.__dict__)
+        chip.flash_begin(4, 0)
+        chip.flash_block(b"\x00" * 4, 0)
+        self.assertEqual(len([e for e in self.events if e.final]), 2)
+
+    def test_error(self):
+        chip = FakeChip()
+        with self.assertRaises(IOError):
+            with FlashProgress(chip):
+                chip.flash_begin(8, 0)
+                chip.flash_block(b"\x00" * 4, 0)
+                raise IOError("write failed")
+        self.assertFalse(any(e.final for e in self.events))
@@ -0,0 +1,67 @@
+"""CCLib_proxy port auto-detection and the port cache."""
+from unittest import mock
+
+from z2mflasher.cclib import ccproxy
+from z2mflasher.cclib.cccache import loadCache, saveCache
+from z2mflasher.cclib.ccproxy import PORT_CACHE, CCLibProxy, portCacheKey
+
+from tests.common import SimTestCase
+
+# A serial port that cannot be opened
+DEAD = '/dev/cclib-test-missing'
+
+
+class FakePort(tuple):
+    """What serial.tools.list_ports.comports() lists: (device, desc, hwid)."""
+
+    def __new__(cls, device, serial_number=None, location=None):
+        port = tuple.__new__(cls, (device, 'test port', 'n/a'))
+        port.serial_number = serial_number
+        port.location = location
+        return port
+
+
+class PortCacheKeyTest(SimTestCase):
+
+    def test_keys(self):
+        self.assertEqual(portCacheKey(FakePort('/dev/ttyACM0', 'A1', '1-1.2')), 'usb:A1')
+        self.assertEqual(portCacheKey(FakePort('/dev/ttyACM0', location='1-1.2')), 'loc:1-1.2')
+        self.assertEqual(portCacheKey(FakePort('/dev/ttyACM0')), 'dev:/dev/ttyACM0')
+
+
+class DetectPortTest(SimTestCase):
+
+    def detect(self, *ports):
+        """Auto-detect the proxy among the given ports, returning the
+        detected port and the ports probed, in order.
+        """
+        probe = mock.Mock(wraps=ccproxy.probePort)
+        with mock.patch('serial.tools.list_ports.comports', return_value=list(ports)), \
+                mock.patch.object(ccproxy, 'probePort', probe):
+            proxy = CCLibProxy('auto')
+        proxy.close()
+        return proxy.port, [call[0][0] for call in probe.call_args_list]
+
+    def test_cache_miss(self):
+        port, probed = self.detect(FakePort(DEAD, 'D'), FakePort('sim://detect-a', 'A'))
+        self.assertEqual(port, 'sim://detect-a')
+        self.assertEqual(sorted(probed), sorted([DEAD, 'sim://detect-a']))
+        self.assertEqual(loadCache(PORT_CACHE), {'usb:A': 'sim://detect-a'})
+
+    def test_cache_hit(self):
+        saveCache(PORT_CACHE, {'usb:B': 'sim://detect-b'})
+        port, probed = self.detect(FakePort('sim://detect-a', 'A'), FakePort('sim://detect-b', 'B'))
+        self.assertEqual(port, 'sim://detect-b')
+        self.assertEqual(probed, ['sim://detect-b'])
+
+    def test_stale_entry(self):
+        saveCache(PORT_CACHE, {'usb:D': DEAD})
+        port, probed = self.detect(FakePort(DEAD, 'D'), FakePort('sim://detect-a', 'A'))
+        self.assertEqual(port, 'sim://detect-a')
+        self.assertEqual(probed, [DEAD, 'sim://detect-a'])
+        self.assertEqual(loadCache(PORT_CACHE), {'usb:A': 'sim://detect-a'})
+
+    def test_not_found(self):
+        with self.assertRaises(IOError):
+            self.detect(FakePort(DEAD, 'D'))
+        self.assertEqual(loadCache(PORT_CACHE), {})
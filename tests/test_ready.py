@@ -0,0 +1,104 @@
+"""Waiting for the CCLib_proxy to answer after opening its port."""
+import asyncio
+import time
+from unittest import mock
+
+from z2mflasher.cclib import ccasync, ccproxy
+from z2mflasher.cclib.ccasync import openCCDebuggerAsync
+from z2mflasher.cclib.ccdebugger import openCCDebugger
+from z2mflasher.cclib.ccproxy import CMD_PING, READY_PINGS, waitReady
+from z2mflasher.cclib.ccsim import CC2530Sim, SimTransport, registerSimulator
+from z2mflasher.cclib.cctransport import openSerial
+
+from tests.common import SimTestCase
+
+
+class BootingTransport(SimTransport):
+    """Loses the answers to the given writes (counted from 0), like an
+    arduino still rebooting after the port was opened.
+    """
+
+    def __init__(self, sim, lost=(), **kwargs):
+        SimTransport.__init__(self, sim, **kwargs)
+        self.lost = lost
+        self.writes = 0
+
+    def write(self, data):
+        ans = SimTransport.write(self, data)
+        if self.writes in self.lost:
+            self.rx.clear()
+        self.writes += 1
+        return ans
+
+
+class WaitReadyTest(SimTestCase):
+
+    def test_ready(self):
+        sim = CC2530Sim()
+        ser = SimTransport(sim, timeout=3.0)
+        self.assertTrue(waitReady(ser))
+        self.assertEqual(sim.frames[CMD_PING], READY_PINGS)
+        self.assertEqual(ser.timeout, 3.0)
+
+    def test_booting(self):
+        sim = CC2530Sim()
+        ser = BootingTransport(sim, lost=range(5))
+        self.assertTrue(waitReady(ser))
+        self.assertEqual(sim.frames[CMD_PING], 5 + READY_PINGS)
+
+    def test_consecutive(self):
+        # A single answer between lost ones is not enough
+        sim = CC2530Sim()
+        ser = BootingTransport(sim, lost=(0, 2))
+        self.assertTrue(waitReady(ser))
+        self.assertEqual(sim.frames[CMD_PING], 3 + READY_PINGS)
+
+    def test_timeout(self):
+        sim = CC2530Sim()
+        ser = BootingTransport(sim, lost=range(10 ** 9), timeout=3.0)
+        start = time.time()
+        self.assertFalse(waitReady(ser, timeout=0.3))
+        self.assertLess(time.time() - start, 2.0)
+        self.assertEqual(ser.timeout, 3.0)
+
+    def test_async(self):
+        async def connect():
+            dbg = await openCCDebuggerAsync('sim://ready-async')
+            dbg.close()
+        sim = registerSimulator('ready-async', CC2530Sim())
+        asyncio.get_event_loop().run_until_complete(connect())
+        self.assertEqual(sim.frames[CMD_PING], READY_PINGS)
+
+
+class NoResetTest(SimTestCase):
+
+    def test_serial_lines(self):
+        # DTR and RTS must be low before the port is opened
+        with mock.patch('serial.Serial') as Serial:
+            ser = Serial.return_value
+            ser.open.side_effect = lambda: self.assertEqual((ser.dtr, ser.rts), (False, False))
+            openSerial('/dev/ttyUSB0', noReset=True, baudrate=115200)
+            ser.open.assert_called_once_with()
+            self.assertEqual(ser.port, '/dev/ttyUSB0')
+
+    def test_reset(self):
+        with mock.patch('serial.Serial') as Serial:
+            ser = Serial.return_value
+            ser.dtr = ser.rts = None
+            openSerial('/dev/ttyUSB0', baudrate=115200)
+            self.assertEqual((ser.dtr, ser.rts), (None, None))
+
+    def test_proxy(self):
+        openTransport = mock.Mock(wraps=ccproxy.openTransport)
+        with mock.patch.object(ccproxy, 'openTransport', openTransport):
+            openCCDebugger('sim://ready-noreset', noReset=True).close()
+        self.assertTrue(openTransport.call_args[1]['noReset'])
+
+    def test_async(self):
+        async def connect():
+            dbg = await openCCDebuggerAsync('sim://ready-noreset', noReset=True)
+            dbg.close()
+        openAsyncTransport = mock.Mock(wraps=ccasync.openAsyncTransport)
+        with mock.patch.object(ccasync, 'openAsyncTransport', openAsyncTransport):
+            asyncio.get_event_loop().run_until_complete(connect())
+        self.assertTrue(openAsyncTransport.call_args[1]['noReset'])
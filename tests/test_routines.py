@@ -0,0 +1,58 @@
+"""Host side of the on-chip routines."""
+import binascii
+import unittest
+
+from z2mflasher.cclib.ccroutines import crc16, loopCounter, packBits
+
+from tests.common import random_image
+
+
+def unpack_bits(stream):
+    """Reference PackBits decoder (what packBitsRoutine does on the chip)."""
+    out = bytearray()
+    i = 0
+    while stream[i] != 0x80:
+        n = stream[i]
+        if n < 0x80:
+            out += stream[i + 1:i + 2 + n]
+            i += n + 2
+        else:
+            out += bytearray([stream[i + 1]]) * (257 - n)
+            i += 2
+    assert i == len(stream) - 1
+    return bytes(out)
+
+
+class ChecksumTest(unittest.TestCase):
+
+    def test_crc16_ccitt(self):
+        self.assertEqual(crc16(b"123456789"), 0x29B1)
+        self.assertEqual(crc16(b"abc"), binascii.crc_hqx(b"abc", 0xFFFF))
+
+    def test_loop_counter(self):
+        self.assertEqual(loopCounter(0x100), (1, 0))
+        self.assertEqual(loopCounter(0x101), (2, 1))
+        self.assertEqual(loopCounter(5), (1, 5))
+
+
+class PackBitsTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        samples = [
+            b"",
+            b"\x00",
+            b"\x01\x02",
+            b"\xAA" * 3,
+            b"\xAA" * 128,
+            b"\xAA" * 129,
+            b"\x00" * 2048,
+            bytes(range(256)) * 2,
+            random_image(2048, seed=1),
+            random_image(2048, seed=2, padding=True),
+            b"\x01\x01\x02\x02\x02\x03" * 100,
+        ]
+        for data in samples:
+            self.assertEqual(unpack_bits(packBits(data)), data)
+
+    def test_runs_shrink(self):
+        self.assertLess(len(packBits(b"\xFF" * 2048)), 40)
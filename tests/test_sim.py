@@ -0,0 +1,73 @@
+"""The simulated chips and the sim:// transport."""
+from z2mflasher.cclib.ccdebugger import openCCDebugger
+from z2mflasher.cclib.ccsim import CC2510Sim, CC2530Sim, registerSimulator
+
+from tests.common import SimTestCase, open_sim, random_image
+
+
+class CC2530SimTest(SimTestCase):
+
+    def setUp(self):
+        SimTestCase.setUp(self)
+        self.sim, self.dbg = open_sim()
+
+    def test_identify(self):
+        self.assertEqual(self.dbg.chipID, 0xA524)
+        self.assertEqual(self.dbg.flashSize, 256 * 1024)
+        self.assertEqual(self.dbg.getSerial(), "060504030201")
+
+    def test_xdata(self):
+        data = random_image(0x40, seed=1)
+        self.dbg.writeXDATA(0x0100, data)
+        self.assertEqual(bytes(self.dbg.readXDATA(0x0100, 0x40)), data)
+        self.assertEqual(bytes(self.sim.readX(0x0100 + i) for i in range(0x40)), data)
+
+    def test_read_code(self):
+        self.sim.flash[0x8010:0x8030] = random_image(0x20, seed=2)
+        self.assertEqual(bytes(self.dbg.readCODE(0x8010, 0x20)), bytes(self.sim.flash[0x8010:0x8030]))
+
+    def test_chip_erase(self):
+        self.sim.flash[0:0x10] = b"\x00" * 0x10
+        self.dbg.chipErase()
+        self.assertEqual(bytes(self.sim.flash[0:0x10]), b"\xff" * 0x10)
+
+    def test_write(self):
+        self.dbg.chipErase()
+        self.dbg.pauseDMA(False)
+        data = random_image(0x1000, seed=10)
+        self.dbg.writeCODE(0x800, data, verify='full')
+        self.assertEqual(bytes(self.sim.flash[0x800:0x1800]), data)
+        self.assertEqual(bytes(self.sim.flash[:0x800]), b"\xff" * 0x800)
+
+    def test_write_unaligned(self):
+        self.dbg.chipErase()
+        self.dbg.pauseDMA(False)
+        data = random_image(0x403, seed=11)
+        self.dbg.writeCODE(0x101, data, verify='crc')
+        self.assertEqual(bytes(self.sim.flash[0x101:0x504]), data)
+        self.assertEqual(self.sim.flash[0x100], 0xFF)
+        self.assertEqual(self.sim.flash[0x504], 0xFF)
+
+    def test_virtual_time(self):
+        start = self.sim.now
+        self.dbg.readXDATA(0, 0x100)
+        self.assertGreater(self.sim.now, start)
+
+
+class SimTransportTest(SimTestCase):
+
+    def test_unknown_name(self):
+        dbg = openCCDebugger('sim://unregistered-sim-test')
+        self.assertEqual(dbg.chipID, 0xA524)
+
+    def test_cc2510(self):
+        sim = registerSimulator('sim2510', CC2510Sim())
+        dbg = openCCDebugger('sim://sim2510')
+        self.assertEqual(dbg.chipName(), "CC251x")
+        sim.flash[0:4] = b"\x01\x02\x03\x04"
+        self.assertEqual(bytes(dbg.readCODE(0, 4)), b"\x01\x02\x03\x04")
+
+    def test_registered(self):
+        sim = registerSimulator('simreg', CC2530Sim(chipID=0xA524))
+        sim.flash[0] = 0x42
+        self.assertEqual(openCCDebugger('sim://simreg').readCODE(0, 1)[0], 0x42)
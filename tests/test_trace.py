@@ -0,0 +1,102 @@
+"""Frame-level tracing of the proxy (CC_TRACE)."""
+import io
+import json
+import os
+from unittest import mock
+
+from z2mflasher.cclib import cctrace
+from z2mflasher.cclib.ccproxy import CMD_PING
+from z2mflasher.cclib.cctrace import LATENCY_BUCKETS, CCTracer, commandName, getTracer
+
+from tests.common import SimTestCase, open_sim, random_image
+
+
+class CCTracerTest(SimTestCase):
+
+    def test_histogram(self):
+        tracer = CCTracer()
+        for elapsed in (0.0001, LATENCY_BUCKETS[0], 0.0003, 0.003, 1.0):
+            tracer.roundTrip([CMD_PING], 4, 3, elapsed)
+        self.assertEqual(tracer.histogram[:5], [2, 1, 0, 0, 1])
+        self.assertEqual(tracer.histogram[-1], 1)
+        self.assertEqual(sum(tracer.histogram), tracer.roundTrips)
+
+    def test_commands(self):
+        tracer = CCTracer()
+        tracer.roundTrip([CMD_PING, CMD_PING], 8, 6, 0.002)
+        tracer.roundTrip([CMD_PING], 100, 0, 0.001, payload=True)
+        tracer.sleep(0.01)
+        d = tracer.toDict()
+        self.assertEqual(d['roundTrips'], 2)
+        self.assertEqual(d['frames'], 2)
+        self.assertEqual((d['bytesOut'], d['bytesIn']), (108, 6))
+        self.assertEqual((d['sleeps'], d['sleepTime']), (1, 0.01))
+        self.assertEqual(d['commands']['PING'], {'frames': 2, 'payloadBytes': 100, 'time': 0.003})
+
+        tracer.save(self.path('trace.json'))
+        with open(self.path('trace.json')) as f:
+            self.assertEqual(json.load(f)['frames'], 2)
+        out = io.StringIO()
+        tracer.summary(out)
+        self.assertIn("2 round trips", out.getvalue())
+
+    def test_sim_write(self):
+        tracer = CCTracer()
+        with mock.patch.object(cctrace, 'TRACER', tracer):
+            sim, dbg = open_sim()
+            dbg.chipErase()
+            dbg.pauseDMA(False)
+            dbg.writeCODE(0, random_image(0x1000, seed=70), verify='crc')
+
+        # Every frame the chip received after the readiness pings was counted
+        frames = dict((commandName(cmd), count) for cmd, count in sim.frames.items() if cmd != CMD_PING)
+        self.assertEqual(dict((name, st['frames']) for name, st in tracer.commands.items()), frames)
+        self.assertGreater(tracer.roundTrips, 0)
+        self.assertLess(tracer.roundTrips, sum(frames.values()))
+
+
+class TraceSwitchTest(SimTestCase):
+
+    def setUp(self):
+        SimTestCase.setUp(self)
+        self.patches = [
+            mock.patch.object(cctrace, 'TRACER', None),
+            mock.patch.dict(os.environ),
+            mock.patch('atexit.register'),
+        ]
+        self.atexit = [patch.start() for patch in self.patches][-1]
+
+    def tearDown(self):
+        for patch in reversed(self.patches):
+            patch.stop()
+        SimTestCase.tearDown(self)
+
+    def test_disabled(self):
+        os.environ.pop('CC_TRACE', None)
+        self.assertIsNone(getTracer())
+        os.environ['CC_TRACE'] = '0'
+        self.assertIsNone(getTracer())
+        _, dbg = open_sim()
+        self.assertIsNone(dbg.tracer)
+        self.assertFalse(self.atexit.called)
+
+    def test_summary(self):
+        os.environ['CC_TRACE'] = '1'
+        tracer = getTracer()
+        self.assertIsInstance(tracer, CCTracer)
+        self.assertIs(getTracer(), tracer)
+        self.assertEqual(self.atexit.call_count, 1)
+
+    def test_file(self):
+        os.environ['CC_TRACE'] = self.path('trace.json')
+        _, dbg = open_sim()
+        self.assertIs(dbg.tracer, cctrace.TRACER)
+        dbg.getStatus()
+
+        # Saved at exit
+        onExit, = self.atexit.call_args[0]
+        with mock.patch.object(CCTracer, 'summary'):
+            onExit()
+        with open(self.path('trace.json')) as f:
+            trace = json.load(f)
+        self.assertGreater(trace['commands']['STATUS']['frames'], 0)
@@ -0,0 +1,55 @@
+"""The socket:// transport, against a TCP bridge to a simulated chip."""
+import time
+
+from z2mflasher.cclib.ccdebugger import openCCDebugger
+from z2mflasher.cclib.cctransport import SocketTransport, openTransport
+
+from tests.common import SimBridge, SimTestCase, open_sim, random_image
+
+
+class SocketTransportTest(SimTestCase):
+
+    def setUp(self):
+        SimTestCase.setUp(self)
+        self.sim, _ = open_sim()
+        self.bridge = SimBridge(self.sim)
+
+    def tearDown(self):
+        self.bridge.close()
+        SimTestCase.tearDown(self)
+
+    def test_open(self):
+        transport = openTransport(self.bridge.url, timeout=0.5)
+        self.assertIsInstance(transport, SocketTransport)
+        self.assertEqual(transport.read(1), b"")
+        transport.close()
+
+    def test_flash(self):
+        dbg = openCCDebugger(self.bridge.url)
+        self.assertEqual(dbg.chipID, 0xA524)
+        self.assertEqual(dbg.getSerial(), "060504030201")
+
+        dbg.chipErase()
+        dbg.pauseDMA(False)
+        data = random_image(0x800, seed=60)
+        dbg.writeCODE(0x400, data, verify='crc')
+        self.assertEqual(bytes(self.sim.flash[0x400:0xC00]), data)
+        self.assertEqual(bytes(dbg.readCODE(0x400, 0x800)), data)
+        dbg.close()
+
+    def test_flush_input(self):
+        self.bridge.close()
+        self.bridge = SimBridge(self.sim, banner=b"\x00stale")
+        transport = openTransport(self.bridge.url, timeout=0.5)
+        time.sleep(0.1)
+        transport.flushInput()
+        self.assertEqual(transport.read(1), b"")
+        transport.close()
+
+
+class InvalidURLTest(SimTestCase):
+
+    def test_invalid(self):
+        for url in ('socket://127.0.0.1', 'socket://127.0.0.1:port'):
+            with self.assertRaises(IOError):
+                SocketTransport(url)
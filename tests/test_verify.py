@@ -0,0 +1,62 @@
+"""Flash verification policies."""
+import unittest
+
+from z2mflasher.__main__ import parse_args
+from z2mflasher.cclib.chip import CCVerifyError, parseVerify
+
+from tests.common import SimTestCase, open_sim, random_image, stick_bits
+
+
+class VerifyPolicyTest(unittest.TestCase):
+
+    def test_policies(self):
+        self.assertEqual(parseVerify(None), ('off', 0))
+        self.assertEqual(parseVerify(True), ('full', 0))
+        self.assertEqual(parseVerify('crc')[0], 'crc')
+        self.assertEqual(parseVerify('sample:7'), ('sample', 7))
+        self.assertEqual(parseVerify('deferred')[0], 'deferred')
+
+    def test_invalid(self):
+        for value in ('fast', 'crc:3', 'sample:x'):
+            with self.assertRaises(ValueError):
+                parseVerify(value)
+
+    def test_cli_default(self):
+        self.assertEqual(parse_args(['z2mflasher', '-p', 'sim://']).cc_verify, 'full')
+        self.assertEqual(parse_args(['z2mflasher', '-p', 'sim://', '--cc-verify', 'crc']).cc_verify, 'crc')
+
+
+class CC2530VerifyTest(SimTestCase):
+
+    def setUp(self):
+        SimTestCase.setUp(self)
+        self.sim, self.dbg = open_sim()
+        self.dbg.chipErase()
+        self.dbg.pauseDMA(False)
+        self.data = random_image(0x1000, seed=20)
+        # A byte of the second page with bits that should stay set
+        self.bad = 0x0900 + next(i for i in range(0x100) if self.data[0x900 + i] != 0x00)
+
+    def test_policies(self):
+        for verify in ('crc', 'full', 'sample:2', 'deferred'):
+            self.sim.flash[:0x1000] = b"\xff" * 0x1000
+            self.dbg.writeCODE(0, self.data, verify=verify)
+            self.assertEqual(bytes(self.sim.flash[:0x1000]), self.data)
+
+    def test_unverified(self):
+        stick_bits(self.sim, self.bad, self.data[self.bad])
+        self.dbg.writeCODE(0, self.data, verify='off')
+        self.assertNotEqual(self.sim.flash[self.bad], self.data[self.bad])
+
+    def test_transient_fault_repaired(self):
+        for verify in ('crc', 'full', 'deferred'):
+            self.sim.flash[:0x1000] = b"\xff" * 0x1000
+            stick_bits(self.sim, self.bad, self.data[self.bad], times=1)
+            self.dbg.writeCODE(0, self.data, verify=verify, retries=1)
+            self.assertEqual(bytes(self.sim.flash[:0x1000]), self.data)
+
+    def test_persistent_fault(self):
+        stick_bits(self.sim, self.bad, self.data[self.bad])
+        with self.assertRaises(CCVerifyError) as cm:
+            self.dbg.writeCODE(0, self.data, verify='full', retries=2)
+        self.assertEqual(cm.exception.offset, self.bad)
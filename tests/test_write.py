@@ -0,0 +1,106 @@
+"""CC253x/CC254x flash programming modes against a simulated chip."""
+from z2mflasher.cclib.cchex import CCMemBlock
+from z2mflasher.cclib.ccroutines import crc16
+from z2mflasher.cclib.cctrace import CCTracer
+
+from tests.common import SimTestCase, open_sim, random_image
+
+
+class CC2530WriteTest(SimTestCase):
+
+    def setUp(self):
+        SimTestCase.setUp(self)
+        self.sim, self.dbg = open_sim()
+        self.dbg.chipErase()
+        self.dbg.pauseDMA(False)
+
+    def check(self, offset, data):
+        self.assertEqual(bytes(self.sim.flash[offset:offset + len(data)]), data)
+
+    def test_checksums(self):
+        data = random_image(0x1000, seed=18)
+        self.sim.flash[0x8000:0x9000] = data
+        ranges = [(0x8000, 0x800), (0x8800, 0x123), (0x8923, 0x6DD)]
+        crcs = self.dbg.getCODEChecksums(ranges)
+        self.assertEqual(crcs, [crc16(data[o - 0x8000:o - 0x8000 + n]) for o, n in ranges])
+        self.assertEqual(self.dbg.isCODEBlank([(0x8000, 0x800), (0x9000, 0x800)]), [False, True])
+
+    def test_incremental(self):
+        old = bytearray(random_image(0x2000, seed=15))
+        self.dbg.writeCODE(0, bytes(old), verify='off')
+        new = bytearray(old)
+        new[0x0803] &= 0x0F                 # only clears bits
+        new[0x1001] = ~old[0x1001] & 0xFF    # needs an erase
+
+        plan = self.dbg.planCODE(0, bytes(new))
+        actions = dict((fAddr, action) for fAddr, iLen, action, current in plan)
+        self.assertEqual(actions, {0: 'unchanged', 0x800: 'program', 0x1000: 'erase', 0x1800: 'unchanged'})
+
+        # Without a base the contents of the programmed page are not known,
+        # so both changed pages are programmed whole
+        self.assertEqual(self.dbg.writeCODE(0, bytes(new), verify='crc', incremental=True), 0x1000)
+        self.check(0, bytes(new))
+
+    def test_double_buffer(self):
+        data = random_image(0x1800, seed=12)
+        self.assertEqual(self.dbg.writeCODE(0, data, verify='crc', doubleBuffer=True), len(data))
+        self.check(0, data)
+
+    def test_blank_chunks(self):
+        # Blank chunks are not programmed, in every mode
+        data = random_image(0x800, seed=19) + b"\xff" * 0x800 + random_image(0x7FF, seed=19)
+        for offset, kwargs in ((0, {}), (0x2000, {'loader': True}), (0x4000, {'compress': True})):
+            self.assertEqual(self.dbg.writeCODE(offset, data, verify='crc', **kwargs), 0x1000)
+            self.check(offset, data)
+
+    def test_shadow(self):
+        self.dbg.writeCODE(0, random_image(0x1000, seed=17), doubleBuffer=True)
+        self.dbg.selectXDATABank(1)
+        shadow = self.dbg.shadow
+        for key, value in shadow.items():
+            if isinstance(key, tuple) and key[0] == 'DMA':
+                self.assertEqual([self.sim.readX(key[1] + i) for i in range(8)], list(value))
+        self.assertEqual(shadow['MEMCTR'], self.sim.sfr[0xC7 - 0x80])
+        for name, lo, hi in (('DMA0CFG', 0xD4, 0xD5), ('DMA1CFG', 0xD2, 0xD3)):
+            if name in shadow:
+                self.assertEqual(shadow[name], self.sim.sfr[hi - 0x80] << 8 | self.sim.sfr[lo - 0x80])
+
+    def test_caches(self):
+        self.dbg.getCODEChecksums([(0, 0x100)])
+        self.assertTrue(self.dbg.routines)
+        self.assertTrue(self.dbg.erasedPages)
+        self.dbg.getCODEChecksums([(0, 0x100)])
+        self.assertTrue(self.dbg.routines)
+        self.assertTrue(self.dbg.erasedPages)
+
+        # Running the firmware can change anything
+        self.dbg.resume()
+        self.dbg.halt()
+        self.assertEqual(self.dbg.routines, {})
+        self.assertEqual(self.dbg.erasedPages, set())
+        self.assertEqual(self.dbg.shadow, {})
+
+    def test_loader(self):
+        data = random_image(0x1800, seed=13)
+        self.dbg.writeCODE(0x8000, data, verify='crc', loader=True)
+        self.check(0x8000, data)
+
+    def test_compress(self):
+        data = random_image(0x2000, seed=14, padding=True)
+        self.dbg.tracer = CCTracer()
+        self.assertEqual(self.dbg.writeCODE(0, data, verify='deferred', compress=True), len(data))
+        self.check(0, data)
+        self.assertLess(self.dbg.tracer.commands['BRUSTWR']['payloadBytes'], len(data))
+
+    def test_incremental_base(self):
+        old = random_image(0x1000, seed=16)
+        self.dbg.writeCODE(0, old, verify='off')
+        base = CCMemBlock(0)
+        base.stack(bytearray(old))
+        new = bytearray(old)
+        new[0x10] &= 0xF0
+        plan = self.dbg.planCODE(0, bytes(new), [base])
+        self.assertEqual(plan[0][2], 'program')
+        self.assertIsNotNone(plan[0][3])
+        self.assertEqual(self.dbg.writeCODE(0, bytes(new), verify='crc', incremental=True, base=[base]), 4)
+        self.check(0, bytes(new))
@@ -9,11 +9,12 @@ import esptool
 import serial
 
 from z2mflasher import const
-from z2mflasher.common import ESP32ChipInfo, EsphomeflasherError, chip_run_stub, \
-    configure_write_flash_args, detect_chip, detect_flash_size, read_chip_info
+from z2mflasher.common import ESP32ChipInfo, EsphomeflasherError, FlashProgress, \
+    chip_run_stub, configure_write_flash_args, detect_chip, detect_flash_size, read_chip_info
 from z2mflasher.const import ESP32_DEFAULT_BOOTLOADER_FORMAT, ESP32_DEFAULT_OTA_DATA, \
     ESP32_DEFAULT_PARTITIONS
 from z2mflasher.helpers import list_serial_ports
+from z2mflasher.progress import ProgressTracker, add_listener, json_listener, remove_listener
 
 PLATFORMIO_INI = """
 [env:esp_wroom_02]
@@ -23,10 +24,30 @@ framework = arduino
 board_build.ldscript = eagle.flash.2m128.ld
 """
 
+def cc_verify_policy(value):
+    from z2mflasher.cclib.chip import parseVerify
+    try:
+        parseVerify(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+
+def cc_preserve_regions(value):
+    from z2mflasher.cclib.chip.cc254x import parsePreserve
+    regions = [r for r in value.split(',') if r]
+    try:
+        parsePreserve(regions)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return regions
+
+
 def parse_args(argv):
     parser = argparse.ArgumentParser(prog='z2mflasher {}'.format(const.__version__))
     parser.add_argument('-p', '--port',
-                        help="Select the USB/COM port for uploading.")
+                        help="Select the USB/COM port for uploading. With --cc253x this "
+                             "can also be a socket://host:port URL.")
     group = parser.add_mutually_exclusive_group(required=False)
     group.add_argument('--esp8266', action='store_true')
     group.add_argument('--esp32', action='store_true')
@@ -50,6 +71,58 @@ def parse_args(argv):
     parser.add_argument('--cc253x',
                         help="Flash zigbee CC2530 module though cclib.",
                         action='store_true')
+    parser.add_argument('--cc-no-reset',
+                        help="Do not reset the CCLib_proxy arduino when opening the port "
+                             "(for adapters that don't reboot on DTR).",
+                        action='store_true')
+    parser.add_argument('--cc-incremental',
+                        help="Do not erase the CC253x chip, only rewrite the flash pages "
+                             "that differ from the HEX file (erasing them only if needed).",
+                        action='store_true')
+    parser.add_argument('--cc-page-erase',
+                        help="Instead of erasing the whole CC253x chip, erase only the flash "
+                             "pages the HEX file occupies, keeping the --cc-preserve regions.",
+                        action='store_true')
+    parser.add_argument('--cc-preserve', metavar='REGIONS', type=cc_preserve_regions,
+                        default='nv,ieee,lock',
+                        help="Comma-separated CC253x flash regions that --cc-page-erase keeps: "
+                             "nv (Z-Stack NV pages), ieee (secondary IEEE address), lock "
+                             "(lock bits) or START-END hex address ranges "
+                             "(default nv,ieee,lock).")
+    parser.add_argument('--cc-base', metavar='FILE',
+                        help="A previous dump of the CC253x flash (.hex or .bin), used by "
+                             "--cc-incremental to plan the writes (--cc-dump is used if "
+                             "not given).")
+    parser.add_argument('--cc-verify', metavar='POLICY', type=cc_verify_policy, default='full',
+                        help="How to verify the CC253x flash: off, crc (checksum of every "
+                             "chunk), sample[:N] (read back N random pages), full (read back "
+                             "everything, the default) or deferred (check the whole image "
+                             "once at the end).")
+    parser.add_argument('--cc-loader',
+                        help="Program the CC253x flash with a loader running on the chip, "
+                             "which needs fewer debugger commands per page.",
+                        action='store_true')
+    parser.add_argument('--cc-compress',
+                        help="Send the CC253x flash pages compressed and expand them on the "
+                             "chip (implies --cc-loader).",
+                        action='store_true')
+    parser.add_argument('--cc-retries', metavar='N', type=int, default=3,
+                        help="Number of CC253x flash pages that may be erased and programmed "
+                             "again when their verification fails (default 3).")
+    parser.add_argument('--cc-dump', metavar='FILE',
+                        help="Back up the CC253x flash to FILE (.hex or .bin) before flashing. "
+                             "Without --binary only the backup is made. An interrupted backup "
+                             "is resumed when run again.")
+    parser.add_argument('--cc-force',
+                        help="Flash the CC253x chip even if the device inventory says it "
+                             "already has the same firmware.",
+                        action='store_true')
+    parser.add_argument('--cc-trace', metavar='FILE',
+                        help="Trace the CCLib frame layer, print a summary at exit and "
+                             "save the trace as JSON in FILE ('-' for the summary only).")
+    parser.add_argument('--progress-log', metavar='FILE',
+                        help="Append the progress events of the flashing operations to FILE "
+                             "as JSON lines ('-' for stderr).")
     parser.add_argument('--ssid',
                         help="Fix to connect to AP's ssid.")
     parser.add_argument('--password',
@@ -99,31 +172,46 @@ def show_logs(serial_port):
                 print(message.encode('ascii', 'backslashreplace'))
 
 
-def zigbee_flash(serial_port, firmware):
+def zigbee_flash(serial_port, firmware, no_reset=False, incremental=False, dump=None,
+                 verify='full', force=False, retries=None, loader=False, compress=False,
+                 base=None, page_erase=False, preserve=()):
     from z2mflasher.cclib import (CCHEXFile, renderDebugStatus,
-        renderDebugConfig, openCCDebugger)
+        renderDebugConfig, CCDebuggerSession, stripRanges)
+    from z2mflasher.cclib.chip.cc254x import CC254X
+    from z2mflasher.cclib.ccinventory import imageHash, isImageFlashed, recordDevice
 
-    def read_info():
+    def read_info(dbg):
         # Read zigbee info
         print("Read zigbee info.")
-        dbg = openCCDebugger(serial_port, enterDebug=False)
         print("\nDevice information:")
         print(" IEEE Address : %s" % dbg.getSerial())
         print("           PC : %04x" % dbg.getPC())
         print("\nDebug status:")
-        renderDebugStatus(dbg.debugStatus)
+        renderDebugStatus(dbg.getStatus())
         print("\nDebug config:")
-        renderDebugConfig(dbg.debugConfig)
+        renderDebugConfig(dbg.readConfig())
         print("")
-        dbg.close()
 
-    def flash_firmware():
-        dbg = openCCDebugger(serial_port, enterDebug=False)
+    def dump_firmware(dbg):
+        print("\nBacking up flash to %s:" % dump)
+        dbg.dumpCODE(dump, showProgress=True)
+
+    def write_options(dbg):
+        # The incremental, double-buffered, loader and page erase modes are
+        # CC253x/CC254x only, the other drivers take the plain writeCODE arguments
+        if isinstance(dbg, CC254X):
+            return dict(incremental=incremental or page_erase, doubleBuffer=True,
+                        loader=loader, compress=compress, base=baseBlocks)
+        if incremental or loader or compress or page_erase:
+            raise EsphomeflasherError("--cc-incremental, --cc-loader, --cc-compress and "
+                                      "--cc-page-erase are not supported on %s chips."
+                                      % dbg.chipName())
+        return {}
+
+    def flash_firmware(dbg, hexFile):
+        options = write_options(dbg)
         # Get bluegiga-specific info
         # serial = dbg.getSerial()
-        # Parse the HEX file
-        hexFile = CCHEXFile(firmware)
-        hexFile.load()
         # Display sections & calculate max memory usage
         maxMem = 0
         print("Sections in %s:\n" % firmware)
@@ -141,40 +229,82 @@ def zigbee_flash(serial_port, firmware):
         if maxMem > (dbg.chipInfo['flash'] * 1024):
             print("ERROR: Data too bit to fit in chip's memory!")
             print("max mem %x, flash size %x" % (maxMem, dbg.chipInfo['flash'] * 1024))
+        # The preserved regions are not written, so they are left out of the
+        # image that is checked, written and recorded
+        memBlocks = hexFile.memBlocks
+        if page_erase:
+            preserved = dbg.preservedRanges(preserve)
+            memBlocks = stripRanges(memBlocks, preserved)
+        # Skip the devices that already have this firmware
+        ieee = dbg.getSerial()
+        if not force:
+            t0 = time.time()
+            if isImageFlashed(dbg, ieee, memBlocks):
+                print("Device %s already has this firmware, skipping (use --cc-force "
+                      "to flash anyway)." % ieee)
+                recordDevice(ieee, checkTime=time.time() - t0)
+                return
         # Flashing messages
         print("\nFlashing:")
-        # Send chip erase
-        if True:
+        t0 = time.time()
+        dbg.verifyTime = 0.0
+        # Erase only the pages of the image, without touching the preserved
+        # regions (the pages shared with them are written incrementally), or
+        # the whole chip
+        if page_erase:
+            pages = dbg.imagePages(memBlocks, keep=preserved)
+            print(" - Erasing %i pages..." % len(pages))
+            dbg.erasePages(pages, showProgress=True)
+        elif not incremental:
             print(" - Chip erase...")
             dbg.chipErase()
         # Flash memory
         dbg.pauseDMA(False)
-        print(" - Flashing %i memory blocks..." % len(hexFile.memBlocks))
-        for mb in hexFile.memBlocks:
+        print(" - Flashing %i memory blocks..." % len(memBlocks))
+        for mb in memBlocks:
             # Flash memory block
             print(" -> 0x%04x : %i bytes " % (mb.addr, mb.size))
-            dbg.writeCODE( mb.addr, mb.bytes, verify=True, showProgress=True )
-        # Done
-        dbg.close()
+            dbg.writeCODE( mb.addr, mb.bytes, verify=verify, showProgress=True,
+                retries=retries, **options )
+        # writeCODE raises if the verification fails, so only good flashes are
+        # recorded. The verification (see verifyCODE) is timed apart.
+        recordDevice(ieee, chipID="%04x" % dbg.chipID, imageHash=imageHash(memBlocks),
+            flashTime=time.time() - t0 - dbg.verifyTime, verifyTime=dbg.verifyTime,
+            verify=verify)
+
+    # Parse the HEX file
+    if firmware:
+        hexFile = CCHEXFile(firmware)
+        hexFile.load()
+
+    # The current flash contents for the incremental write planner: a
+    # previous dump, or the one made in this run once it's complete
+    base = (base or dump) if incremental else None
+    baseBlocks = None
 
-    for i in range(3):
+    # The debugger is opened once and re-opened only if something fails
+    with CCDebuggerSession(serial_port, noReset=no_reset) as session:
         try:
-            read_info()
-            break
-        except Exception as e:
+            session.run(read_info)
+        except IOError as e:
             print("Read zigbee info failed.")
-            if i < 3:
-                print("try again.")
-                pass
-            else:
-                print("Flash failed.")
-                raise EsphomeflasherError("Can not find zigbee module.");
-    flash_firmware()
+            raise EsphomeflasherError("Can not find zigbee module. {}".format(e))
+        # Reject the options the chip doesn't support before touching it
+        if firmware:
+            session.run(write_options)
+        if dump:
+            session.run(dump_firmware)
+        if base:
+            baseFile = CCHEXFile(base)
+            baseFile.load()
+            baseBlocks = baseFile.memBlocks
+        if firmware:
+            session.run(flash_firmware, hexFile)
     print("\nCompleted")
     print("")
 
 
-def esp_flash(args, port):
+def esp_flash(args, port, phase='write'):
     if args.offset:
         print("Firmware start position: {}".format(args.offset))
 
@@ -225,13 +355,16 @@ def esp_flash(args, port):
         raise EsphomeflasherError("Error setting flash parameters: {}".format(err))
 
     if not args.no_erase:
+        progress = ProgressTracker('erase', esptool.flash_size_bytes(flash_size), source=port)
         try:
             esptool.erase_flash(stub_chip, mock_args)
         except esptool.FatalError as err:
             raise EsphomeflasherError("Error while erasing flash: {}".format(err))
+        progress.finish()
 
     try:
-        esptool.write_flash(stub_chip, mock_args)
+        with FlashProgress(stub_chip, phase, source=port):
+            esptool.write_flash(stub_chip, mock_args)
     except esptool.FatalError as err:
         raise EsphomeflasherError("Error while writing flash: {}".format(err))
 
@@ -324,22 +457,49 @@ def upload_spiffs(args, port):
     args.offset = 1966080
     args.binary = "spiffs.bin"
     args.no_erase = True
-    esp_flash(args, port)
+    esp_flash(args, port, phase='spiffs')
     return
 
 def run_esphomeflasher(argv):
     args = parse_args(argv)
     port = select_port(args)
 
+    listener = None
+    if args.progress_log:
+        try:
+            log = sys.stderr if args.progress_log == '-' else open(args.progress_log, 'a')
+        except IOError as err:
+            raise EsphomeflasherError("Error opening progress log: {}".format(err))
+        listener = add_listener(json_listener(log))
+
+    try:
+        run_flasher(args, port)
+    finally:
+        if listener is not None:
+            remove_listener(listener)
+            if log is not sys.stderr:
+                log.close()
+
+
+def run_flasher(args, port):
     if args.show_logs:
         serial_port = serial.Serial(port, baudrate=115200)
         show_logs(serial_port)
         return
 
     if args.cc253x:
-        print("Flash zigbee module firmware.")
-        print("ATTENTION: zigbee firmware must be HEX file.")
-        zigbee_flash(port, args.binary)
+        if args.cc_trace:
+            from z2mflasher.cclib.cctrace import enableTracing
+            enableTracing(None if args.cc_trace == '-' else args.cc_trace)
+        if args.binary:
+            print("Flash zigbee module firmware.")
+            print("ATTENTION: zigbee firmware must be HEX file.")
+        zigbee_flash(port, args.binary, no_reset=args.cc_no_reset,
+                     incremental=args.cc_incremental, dump=args.cc_dump,
+                     verify=args.cc_verify, force=args.cc_force, retries=args.cc_retries,
+                     loader=args.cc_loader, compress=args.cc_compress, base=args.cc_base,
+                     page_erase=args.cc_page_erase,
+                     preserve=args.cc_preserve)
         return
 
     if args.esp8266 or args.esp32:
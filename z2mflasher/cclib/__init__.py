@@ -19,6 +19,7 @@
 # Import everything from CCDebugger
 from z2mflasher.cclib.ccdebugger import *
 from z2mflasher.cclib.cchex import *
+from z2mflasher.cclib.ccasync import AsyncCCLibProxy, openCCDebuggerAsync
 
 def getOptions(shortDesc, argHelp="", hexIn=False, hexOut=False, port=True, **kwargs):
 	"""
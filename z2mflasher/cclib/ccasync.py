@@ -0,0 +1,1053 @@
+#
+# CCLib_proxy Interface Library for High-Level operations
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Asyncio variant of the CCLib_proxy interface and chip drivers.
+
+All the I/O is multiplexed on the event loop, so a single thread can drive
+many debuggers at once:
+
+	async def flash(port, hexFile):
+		dbg = await openCCDebuggerAsync(port)
+		await dbg.chipErase()
+		await dbg.pauseDMA(False)
+		for mb in hexFile.memBlocks:
+			await dbg.writeCODE(mb.addr, mb.bytes, verify=True)
+		dbg.close()
+
+	loop.run_until_complete(asyncio.gather(*[flash(p, hexFile) for p in ports]))
+
+Frame encoding and decoding is shared with the synchronous classes.
+"""
+from __future__ import print_function
+import asyncio
+import socket
+import time
+import serial
+
+from z2mflasher.cclib.ccproxy import *
+from z2mflasher.cclib.ccproxy import CCLibProxy
+from z2mflasher.cclib.cctransport import isURL, openSerial, openTransport
+from z2mflasher.cclib.chip import CCFlashLockedError, CCVerifyError, parseVerify
+from z2mflasher.cclib.ccroutines import cc251xFlashRoutine
+from z2mflasher.cclib.chip.cc254x import CC254X
+from z2mflasher.cclib.chip.cc2510 import CC2510
+from z2mflasher.progress import ProgressTracker
+
+###############################################
+# Transports
+###############################################
+
+class AsyncSerialTransport:
+	"""
+	Non-blocking serial port transport. On platforms where the event loop can
+	watch the port file descriptor no polling takes place, otherwise the port
+	is polled every `pollInterval` seconds while waiting for data.
+	"""
+
+	pollInterval = 0.002
+
+	def __init__(self, port, baudrate=115200, timeout=3.0, noReset=False):
+		"""
+		Open the serial port in non-blocking mode
+		"""
+		self.name = port
+		self.timeout = timeout
+		self.buffer = bytearray()
+		self.loop = asyncio.get_event_loop()
+		self.event = asyncio.Event()
+		self.ser = openSerial(port, noReset=noReset, baudrate=baudrate, timeout=0)
+
+		# Get notified when data arrive, if the loop supports it
+		try:
+			self.loop.add_reader(self.ser.fileno(), self.onReadable)
+			self.polling = False
+		except (AttributeError, NotImplementedError, ValueError):
+			self.polling = True
+
+	def onReadable(self):
+		"""
+		Collect incoming data
+		"""
+		data = self.ser.read(4096)
+		if data:
+			self.buffer += data
+			self.event.set()
+
+	async def read(self, size):
+		"""
+		Read exactly size bytes or raise IOError on timeout
+		"""
+		deadline = self.loop.time() + self.timeout
+		while len(self.buffer) < size:
+
+			# Check for timeout
+			left = deadline - self.loop.time()
+			if left <= 0:
+				raise IOError("Could not read from the serial port!")
+
+			# Wait for data
+			if self.polling:
+				data = self.ser.read(self.ser.in_waiting)
+				if data:
+					self.buffer += data
+				else:
+					await asyncio.sleep(min(self.pollInterval, left))
+			else:
+				self.event.clear()
+				try:
+					await asyncio.wait_for(self.event.wait(), left)
+				except asyncio.TimeoutError:
+					pass
+
+		# Consume data
+		ans = bytes(self.buffer[:size])
+		del self.buffer[:size]
+		return ans
+
+	async def write(self, data):
+		self.ser.write(data)
+
+	def flushInput(self):
+		self.ser.flushInput()
+		self.buffer = bytearray()
+
+	def close(self):
+		if not self.polling:
+			self.loop.remove_reader(self.ser.fileno())
+		self.ser.close()
+
+class AsyncSocketTransport(asyncio.Protocol):
+	"""
+	TCP transport for serial-to-TCP bridges (socket://host:port). Incoming
+	data are collected as they arrive, like AsyncSerialTransport does.
+	"""
+
+	def __init__(self, url, timeout=3.0):
+		self.name = url
+		self.timeout = timeout
+		self.buffer = bytearray()
+		self.event = asyncio.Event()
+		self.transport = None
+		self.lost = False
+
+	@classmethod
+	async def open(cls, url, timeout=3.0):
+		"""
+		Connect to the host:port given in the socket:// URL
+		"""
+
+		# Parse URL
+		address = url.split("://", 1)[-1].split("/", 1)[0]
+		host, sep, port = address.rpartition(":")
+		if not sep or not port.isdigit():
+			raise IOError("Invalid socket URL '%s', expected socket://<host>:<port>" % url)
+
+		# Connect
+		loop = asyncio.get_event_loop()
+		_, self = await asyncio.wait_for(
+			loop.create_connection(lambda: cls(url, timeout), host.strip("[]"), int(port)), timeout)
+		sock = self.transport.get_extra_info('socket')
+		if sock is not None:
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		return self
+
+	def connection_made(self, transport):
+		self.transport = transport
+
+	def data_received(self, data):
+		self.buffer += data
+		self.event.set()
+
+	def connection_lost(self, exc):
+		self.lost = True
+		self.event.set()
+
+	async def read(self, size):
+		"""
+		Read exactly size bytes or raise IOError on timeout
+		"""
+		loop = asyncio.get_event_loop()
+		deadline = loop.time() + self.timeout
+		while len(self.buffer) < size:
+
+			# Check for timeout or a closed connection
+			left = deadline - loop.time()
+			if (left <= 0) or self.lost:
+				raise IOError("Could not read from %s!" % self.name)
+
+			# Wait for data
+			self.event.clear()
+			try:
+				await asyncio.wait_for(self.event.wait(), left)
+			except asyncio.TimeoutError:
+				pass
+
+		# Consume data
+		ans = bytes(self.buffer[:size])
+		del self.buffer[:size]
+		return ans
+
+	async def write(self, data):
+		self.transport.write(bytes(data))
+
+	def flushInput(self):
+		"""
+		Discard the data received so far
+		"""
+		self.buffer = bytearray()
+
+	def close(self):
+		self.transport.close()
+
+class AsyncMemoryTransport:
+	"""
+	Wraps an in-memory transport (sim://), whose calls never block
+	"""
+
+	def __init__(self, transport):
+		self.name = transport.name
+		self.transport = transport
+
+	@property
+	def timeout(self):
+		return self.transport.timeout
+
+	@timeout.setter
+	def timeout(self, value):
+		self.transport.timeout = value
+
+	async def read(self, size):
+		"""
+		Read exactly size bytes or raise IOError on timeout
+		"""
+		ans = self.transport.read(size)
+		if len(ans) < size:
+			raise IOError("Could not read from %s!" % self.name)
+		return ans
+
+	async def write(self, data):
+		self.transport.write(data)
+
+	def flushInput(self):
+		self.transport.flushInput()
+
+	def close(self):
+		self.transport.close()
+
+async def openAsyncTransport(port, baudrate=115200, timeout=3.0, noReset=False):
+	"""
+	Open the asyncio transport for the given serial port or socket:// URL
+	"""
+	if port.lower().startswith("socket://"):
+		return await AsyncSocketTransport.open(port, timeout=timeout)
+	elif port.lower().startswith("sim://"):
+		return AsyncMemoryTransport(openTransport(port, timeout=timeout))
+	elif isURL(port):
+		raise IOError("Unsupported URL %s for asyncio transports" % port)
+	return AsyncSerialTransport(port, baudrate=baudrate, timeout=timeout, noReset=noReset)
+
+###############################################
+# Proxy
+###############################################
+
+class AsyncCCLibProxy:
+	"""
+	Asyncio variant of CCLibProxy. Use `await AsyncCCLibProxy.open(port)`
+	to connect, all the debug-level functions are coroutines.
+	"""
+
+	# Number of frames to send before waiting for the responses
+	pipelineDepth = PIPELINE_DEPTH
+
+	# Interval between polls of the chip status
+	pollInterval = 0.01
+
+	# Frame encoding/decoding is shared with the synchronous proxy
+	decodeFrame = CCLibProxy.decodeFrame
+	instrFrame = CCLibProxy.instrFrame
+	instriFrame = CCLibProxy.instriFrame
+
+	def __init__(self, parent=None):
+		"""
+		Initialize the AsyncCCLibProxy class
+		"""
+
+		# If we are subclassing, just adopt properties
+		if not parent is None:
+			self.ser = parent.ser
+			self.port = parent.port
+			self.chipID = parent.chipID
+			self.debugStatus = parent.debugStatus
+			self.debugConfig = parent.debugConfig
+			self.instructionTableVersion = parent.instructionTableVersion
+
+	@classmethod
+	async def open(cls, port, enterDebug=False, noReset=False):
+		"""
+		Connect to the CCLib_proxy on the given port
+		"""
+		self = cls()
+
+		# Open port
+		try:
+			self.ser = await openAsyncTransport(port, noReset=noReset)
+			self.port = port
+			self.ser.flushInput()
+		except (IOError, OSError, asyncio.TimeoutError, serial.SerialException):
+			raise IOError("Could not open port %s" % port)
+
+		# Wait until the proxy answers to pings
+		if not await self.waitReady():
+			self.ser.close()
+			raise IOError("Could not find CCLib_proxy device on port %s" % port)
+
+		# Check if we should enter debug mode
+		if enterDebug:
+			await self.enter()
+
+		# Get instruction table version
+		self.instructionTableVersion = await self.getInstructionTableVersion()
+
+		# Get chip info & ID
+		self.chipID = await self.getChipID()
+		self.debugStatus = await self.getStatus()
+		self.debugConfig = await self.readConfig()
+		return self
+
+	def close(self):
+		self.ser.close()
+
+	###############################################
+	# Low-level functions
+	###############################################
+
+	async def readFrame(self, raiseException=True):
+		"""
+		Read and translate the 3-byte response frame from arduino
+		"""
+		b = await self.ser.read(3)
+		return self.decodeFrame(b[0], b[1], b[2], raiseException)
+
+	async def sendFrame(self, cmd, c1=0, c2=0, c3=0, raiseException=True):
+		"""
+		Send the specified frame and return the response
+		"""
+		await self.ser.write(bytearray([cmd, c1, c2, c3]))
+		return await self.readFrame(raiseException)
+
+	async def sendFrames(self, frames, raiseException=True):
+		"""
+		Send a batch of frames and return the list of their responses
+		"""
+		ans = []
+		frames = list(frames)
+		for i in range(0, len(frames), self.pipelineDepth):
+			window = frames[i:i+self.pipelineDepth]
+
+			# Concatenate the 4-byte command frames
+			packet = bytearray()
+			for f in window:
+				packet.append(f[0])
+				packet += bytearray(f[1:]) + bytearray(4 - len(f))
+			await self.ser.write(packet)
+
+			# Read all the responses before decoding them
+			b = await self.ser.read(3 * len(window))
+			for j in range(0, len(b), 3):
+				ans.append(self.decodeFrame(b[j], b[j+1], b[j+2], raiseException))
+
+		return ans
+
+	###############################################
+	# Debug-level functions
+	###############################################
+
+	async def ping(self):
+		"""
+		Send a PING frame
+		"""
+		await self.sendFrame(CMD_PING)
+		return True
+
+	async def waitReady(self, timeout=READY_TIMEOUT):
+		"""
+		Send short CMD_PING attempts until the proxy answers READY_PINGS
+		times in a row, or the deadline expires
+		"""
+		portTimeout = self.ser.timeout
+		self.ser.timeout = READY_PING_TIMEOUT
+		try:
+			good = 0
+			deadline = time.time() + timeout
+			while time.time() < deadline:
+				self.ser.flushInput()
+				try:
+					await self.ping()
+					good += 1
+					if good >= READY_PINGS:
+						self.ser.flushInput()
+						return True
+				except IOError:
+					good = 0
+			return False
+		finally:
+			self.ser.timeout = portTimeout
+
+	async def enter(self):
+		"""
+		Enter in debug mode
+		"""
+		return await self.sendFrame(CMD_ENTER)
+
+	async def exit(self):
+		"""
+		Exit from debug mode by resuming the CPU
+		"""
+		self.debugStatus = await self.sendFrame(CMD_EXIT)
+		return self.debugStatus
+
+	async def readConfig(self):
+		"""
+		Read debug configuration
+		"""
+		return await self.sendFrame(CMD_RD_CFG)
+
+	async def writeConfig(self, config):
+		"""
+		Write debug configuration
+		"""
+		ans = await self.sendFrame(CMD_WR_CFG, config)
+		self.debugConfig = config
+		self.debugStatus = ans
+		return ans
+
+	async def step(self):
+		"""
+		Step a single instruction
+		"""
+		return await self.sendFrame(CMD_STEP)
+
+	async def resume(self):
+		"""
+		resume program exec
+		"""
+		return await self.sendFrame(CMD_RESUME)
+
+	async def halt(self):
+		"""
+		halt program exec
+		"""
+		return await self.sendFrame(CMD_HALT)
+
+	async def getChipID(self):
+		"""
+		Return the ChipID as read from the chip
+		"""
+		return await self.sendFrame(CMD_CHIP_ID)
+
+	async def getStatus(self):
+		"""
+		Return the debug status
+		"""
+		self.debugStatus = await self.sendFrame(CMD_STATUS)
+		return self.debugStatus
+
+	async def getPC(self):
+		"""
+		Return the program counter position
+		"""
+		return await self.sendFrame(CMD_PC)
+
+	async def instr(self, c1, c2=None, c3=None):
+		"""
+		Execute a debug instruction
+		"""
+		return await self.sendFrame(*self.instrFrame(c1, c2, c3))
+
+	async def instri(self, c1, i1):
+		"""
+		Execute a debug instruction with 16-bit constant
+		"""
+		return await self.sendFrame(*self.instriFrame(c1, i1))
+
+	async def brustWrite(self, data):
+		"""
+		Perform a brust-write operation of up to 2Kb in the DBGDATA register
+		"""
+
+		# Validate length
+		length = len(data)
+		if length > 2048:
+			return False
+
+		# Prepare for BRUST frame transmission
+		ans = await self.sendFrame(CMD_BRUSTWR, (length >> 8) & 0xFF, length & 0xFF)
+		if ans != ANS_READY:
+			raise IOError("Unable to prepare for brust-write! (Unknown response 0x%02x)" % ans)
+
+		# Send data, handle response & update debug status
+		await self.ser.write(data)
+		self.debugStatus = await self.readFrame()
+		return self.debugStatus
+
+	async def chipErase(self):
+		"""
+		Perform a chip erase
+		"""
+
+		# Re-enter debug mode
+		await self.enter()
+
+		# Send chip erase command & update debug status
+		self.debugStatus = await self.sendFrame(CMD_CHPERASE)
+
+		# Wait until CHIP_ERASE_BUSY goes down
+		s = await self.getStatus()
+		while (( s & 0x80 ) != 0):
+			await asyncio.sleep(self.pollInterval)
+			s = await self.getStatus()
+
+		# We are good
+		self.debugStatus = s
+		return self.debugStatus
+
+	async def getInstructionTableVersion(self):
+		"""
+		Get CC.Debugger instruction table version
+		"""
+		return await self.sendFrame(CMD_INSTR_VER)
+
+	async def updateInstructionTable(self, version, instr):
+		"""
+		Update CC.Debugger instruction table
+		"""
+
+		# Check limits
+		if len(instr) > 15:
+			raise IOError("Invalid size of the instruction table! It must be smaller than 16")
+
+		# Insert version and append zeroes
+		table = [version] + list(instr)
+		table += [0] * (16 - len(table))
+
+		# Express our interest to update the instruction table
+		ans = await self.sendFrame(CMD_INSTR_UPD)
+		if ans != ANS_READY:
+			raise IOError("Unable to prepare for instruction table update! (Unknown response 0x%02x)" % ans)
+
+		# Send table and get confirmation
+		await self.ser.write(bytearray([b & 0xFF for b in table]))
+		newVersion = await self.readFrame()
+		if newVersion != version:
+			raise IOError("Unable to update the instruction table! (Unknown response 0x%02x)" % newVersion)
+
+		self.instructionTableVersion = newVersion
+		return newVersion
+
+###############################################
+# Chip drivers
+###############################################
+
+class AsyncChipDriver(AsyncCCLibProxy):
+	"""
+	Base class for the asyncio chip drivers
+	"""
+
+	def __init__(self, proxy):
+		"""
+		Construct a new chip driver
+		"""
+		self._proxy = proxy
+		# Shadow copies of chip registers (see ChipDriver.invalidateShadow)
+		self.shadow = {}
+		AsyncCCLibProxy.__init__(self, parent=proxy)
+
+	def invalidateShadow(self):
+		"""
+		Forget the shadow copies of the chip registers and DMA descriptors,
+		which anything that lets the CPU run makes stale
+		"""
+		self.shadow = {}
+
+	async def enter(self):
+		self.invalidateShadow()
+		return await AsyncCCLibProxy.enter(self)
+
+	async def exit(self):
+		self.invalidateShadow()
+		return await AsyncCCLibProxy.exit(self)
+
+	async def resume(self):
+		self.invalidateShadow()
+		return await AsyncCCLibProxy.resume(self)
+
+	async def step(self):
+		self.invalidateShadow()
+		return await AsyncCCLibProxy.step(self)
+
+	async def chipErase(self):
+		self.invalidateShadow()
+		return await AsyncCCLibProxy.chipErase(self)
+
+	async def writeCODE(self, offset, data, erase=False, verify=False, showProgress=False):
+		"""
+		Fully automated function for writing the Flash memory.
+		"""
+		raise NotImplementedError("This function is not implemented!")
+
+	def close( self ):
+		self._proxy.close()
+
+class AsyncCC254X(AsyncChipDriver):
+	"""
+	Asyncio variant of the CC253X and CC2540/41 chip driver
+	"""
+
+	# Shared with the synchronous driver
+	test = staticmethod(CC254X.test)
+	chipName = CC254X.chipName
+	writeXDATAFrames = CC254X.writeXDATAFrames
+	configDMAChannelFrames = CC254X.configDMAChannelFrames
+
+	async def initialize(self):
+		"""
+		Initialize chip driver
+		"""
+
+		# Make sure the default CC.Debugger instruction table is used
+		if self.instructionTableVersion != 1:
+			await self.updateInstructionTable(1, [
+					0x40, 0x48, 0x20, 0x18, 0x51, 0x52,
+					0x53, 0x68, 0x28, 0x30, 0x58, 0x10,
+				])
+
+		# Get chip info
+		self.chipInfo = await self.getChipInfo()
+
+		# Populate variables
+		self.flashSize = self.chipInfo['flash'] * 1024
+		self.flashPageSize = 0x800
+		self.sramSize = self.chipInfo['sram'] * 1024
+		self.bulkBlockSize = 0x800
+
+	async def getChipInfo(self):
+		"""
+		Analyze chip info registers
+		"""
+		chipInfo = await self.readXDATA(0x6276, 2)
+		return {
+			'flash' : pow(2, 4 + ((chipInfo[0] & 0x70) >> 4)), # in Kb
+			'usb'	: (chipInfo[0] & 0x08) != 0,
+			'sram'	: (chipInfo[1] & 0x07) + 1
+		}
+
+	async def getSerial(self):
+		"""
+		Read the IEEE address from the 0x780E register
+		"""
+		bytes = await self.readXDATA( 0x780E, 6 )
+		return "".join( "%02x" % bytes[i] for i in range(5,-1,-1) )
+
+	async def readXDATA( self, offset, size ):
+		"""
+		Read any size of buffer from the XDATA region
+		"""
+		frames = [ self.instriFrame( 0x90, offset ) ]	# MOV DPTR,#data16
+		for i in range(0, size):
+			frames.append( self.instrFrame( 0xE0 ) )	# MOVX A,@DPTR
+			frames.append( self.instrFrame( 0xA3 ) )	# INC DPTR
+		ans = await self.sendFrames( frames )
+		return bytearray( ans[1::2] )
+
+	async def writeXDATA( self, offset, bytes ):
+		"""
+		Write any size of buffer in the XDATA region
+		"""
+		await self.sendFrames( self.writeXDATAFrames( offset, bytes ) )
+		return len(bytes)
+
+	async def modifyXDATA( self, offset, andMask=0xFF, orMask=0x00 ):
+		"""
+		Read-modify-write a single XDATA byte on the chip, in one batch
+		"""
+		ans = await self.sendFrames([
+				self.instriFrame( 0x90, offset ),	# MOV DPTR,#data16
+				self.instrFrame( 0xE0 ),			# MOVX A,@DPTR
+				self.instrFrame( 0x54, andMask ),	# ANL A,#data
+				self.instrFrame( 0x44, orMask ),	# ORL A,#data
+				self.instrFrame( 0xF0 ),			# MOVX @DPTR,A
+			])
+		return ans[3]
+
+	async def selectXDATABank(self, bank):
+		"""
+		Select XDATA bank from the Memory Arbiter Control register
+		"""
+		return (await self.sendFrames([
+				self.instrFrame( 0x53, 0xC7, 0xF8 ),			# ANL direct,#data @ MEMCTR
+				self.instrFrame( 0x43, 0xC7, bank & 0x07 ),	# ORL direct,#data @ MEMCTR
+			]))[-1]
+
+	async def readCODE( self, offset, size ):
+		"""
+		Read any size of buffer from the XDATA+0x8000 (code-mapped) region
+		"""
+		fBank = int(offset / 0x8000 )
+		await self.selectXDATABank( fBank )
+		offset -= fBank * 0x8000
+		return await self.readXDATA( 0x8000 + offset, size )
+
+	async def pauseDMA(self, pause):
+		"""
+		Pause/Unpause DMA in debug mode
+		"""
+		a = await self.readConfig()
+		if pause:
+			a |= 0x4
+		else:
+			a &= ~0x4
+		await self.writeConfig(a)
+
+	async def configDMAChannel(self, index, srcAddr, dstAddr, trigger, **kwargs):
+		"""
+		Create a DMA buffer and place it in memory, unless the shadow says
+		it's already there
+		"""
+		await self.sendFrames( self.configDMAChannelFrames( index, srcAddr, dstAddr, trigger, **kwargs ) )
+
+	async def armDMAChannel(self, index):
+		"""
+		Arm a DMA channel (index in 0-4)
+		"""
+		await self.instr( 0x43, 0xD6, pow(2, index) ) # ORL direct,#data @ DMAARM
+		await asyncio.sleep(0.01)
+
+	async def disarmDMAChannel(self, index):
+		"""
+		Disarm a DMA channel (index in 0-4)
+		"""
+		await self.instr( 0x53, 0xD6, ~pow(2, index) & 0xFF ) # ANL direct,#data @ DMAARM
+
+	async def isDMAIRQ(self, index):
+		"""
+		Check if DMA IRQ flag is set (index in 0-4)
+		"""
+		a = await self.instr( 0xE5, 0xD1 ) # MOV A,direct @ DMAIRQ
+		return ((a & pow(2, index)) != 0)
+
+	async def clearDMAIRQ(self, index):
+		"""
+		Clear DMA IRQ flag (index in 0-4)
+		"""
+		await self.instr( 0x53, 0xD1, ~pow(2, index) & 0xFF ) # ANL direct,#data @ DMAIRQ
+
+	async def isFlashBusy(self):
+		"""
+		Check if the BUSY bit is set in the flash register
+		"""
+		a = await self.readXDATA(0x6270, 1)
+		return (a[0] & 0x80 != 0)
+
+	async def isFlashAbort(self):
+		"""
+		Check if the ABORT bit is set in the flash register
+		"""
+		a = await self.readXDATA(0x6270, 1)
+		return (a[0] & 0x20 != 0)
+
+	async def writeCODE(self, offset, data, erase=False, verify=False, showProgress=False):
+		"""
+		Fully automated function for writing the Flash memory.
+
+		With any verify policy but 'off' every chunk is read back and
+		compared, raising CCVerifyError on mismatch.
+
+		WARNING: This requires DMA operations to be unpaused ( use: await self.pauseDMA(False) )
+		"""
+		verify = parseVerify(verify)[0] != 'off'
+
+		# Pad data so that the start and end address are on 4-byte boundaries.
+		data = b"\xff" * (offset % 4) + data
+		data = data + b"\xff" * (-len(data) % 4)
+		offset -= offset % 4
+
+		# Prepare DMA-0 for DEBUG -> RAM and DMA-1 for RAM -> FLASH
+		await self.configDMAChannel( 0, 0x6260, 0x0000, 0x1F, tlen=self.bulkBlockSize, srcInc=0, dstInc=1, priority=1, interrupt=True )
+		await self.configDMAChannel( 1, 0x0000, 0x6273, 0x12, tlen=self.bulkBlockSize, srcInc=1, dstInc=0, priority=2, interrupt=True )
+
+		# Reset flags
+		await self.modifyXDATA( 0x6270, andMask=0x1F )
+		await self.clearDMAIRQ(0)
+		await self.clearDMAIRQ(1)
+		await self.disarmDMAChannel(0)
+		await self.disarmDMAChannel(1)
+
+		# Split in 2048-byte chunks
+		progress = ProgressTracker( 'write', len(data), source=self.port )
+		iOfs = 0
+		while (iOfs < len(data)):
+
+			# Check if we should show progress (one line per port, as the
+			# output of several debuggers is interleaved)
+			progress.update( iOfs )
+			if showProgress:
+				print("    %s: Progress %0.0f%%... " % (self.port, iOfs*100/len(data)))
+
+			# Get next page
+			iLen = min( len(data) - iOfs, self.bulkBlockSize )
+
+			# Update DMA configuration if we have less than bulk-block size data
+			if (iLen < self.bulkBlockSize):
+				await self.configDMAChannel( 0, 0x6260, 0x0000, 0x1F, tlen=iLen, srcInc=0, dstInc=1, priority=1, interrupt=True )
+				await self.configDMAChannel( 1, 0x0000, 0x6273, 0x12, tlen=iLen, srcInc=1, dstInc=0, priority=2, interrupt=True )
+
+			# Upload to RAM through DMA-0
+			await self.armDMAChannel(0)
+			await self.brustWrite( data[iOfs:iOfs+iLen] )
+
+			# Wait until DMA-0 raises interrupt
+			while not await self.isDMAIRQ(0):
+				await asyncio.sleep(self.pollInterval)
+			await self.clearDMAIRQ(0)
+
+			# Calculate the page where this data belong to
+			fAddr = offset + iOfs
+			fPage = int( fAddr / self.flashPageSize )
+
+			# Check if we should erase page first
+			if erase:
+				await self.writeXDATA( 0x6271, [0, fPage << 1] )
+				await self.modifyXDATA( 0x6270, orMask=0x01 )
+				while await self.isFlashBusy():
+					await asyncio.sleep(self.pollInterval)
+
+			# Set FLASH word address
+			fWordOffset = int(fAddr / 4)
+			await self.writeXDATA( 0x6271, [fWordOffset & 0xFF, (fWordOffset >> 8) & 0xFF] )
+
+			# Upload to FLASH through DMA-1
+			await self.armDMAChannel(1)
+			await self.modifyXDATA( 0x6270, orMask=0x02 )
+
+			# Wait until DMA-1 raises interrupt
+			while not await self.isDMAIRQ(1):
+				if await self.isFlashAbort():
+					await self.disarmDMAChannel(1)
+					raise CCFlashLockedError(fPage)
+				await asyncio.sleep(self.pollInterval)
+			await self.clearDMAIRQ(1)
+
+			# Check if we should verify
+			if verify:
+				verifyBytes = await self.readCODE(fAddr, iLen)
+				for i in range(0, iLen):
+					if verifyBytes[i] != data[iOfs+i]:
+						raise CCVerifyError(fAddr + i)
+			iOfs += iLen
+
+		progress.finish()
+		if showProgress:
+			print("    %s: Progress 100%%... OK" % self.port)
+
+class AsyncCC2510(AsyncCC254X):
+	"""
+	Asyncio variant of the CC251x chip driver
+	"""
+
+	# Shared with the synchronous driver
+	test = staticmethod(CC2510.test)
+	chipName = CC2510.chipName
+	writeXDATAFrames = CC2510.writeXDATAFrames
+	flashBufferAddr = CC2510.flashBufferAddr
+	flashPageTimeout = CC2510.flashPageTimeout
+
+	async def initialize(self):
+		"""
+		Initialize chip driver
+		"""
+
+		# CC251xx chips use a different instruction table
+		if self.instructionTableVersion != 2:
+			await self.updateInstructionTable(2, [
+					0x44, 0x4C, 0x24, 0x1D, 0x55, 0x56,
+					0x57, 0x68, 0x28, 0x34, 0x5C, 0x14,
+				])
+
+		# Custom chip info for cc2510
+		self.chipInfo = { 'flash' : 16, 'usb' : 0, 'sram' : 2 }
+		self.flashSize = self.chipInfo['flash'] * 1024
+		self.flashPageSize = 0x400
+		self.sramSize = self.chipInfo['sram'] * 1024
+		self.bulkBlockSize = 0x400
+		self.flashWordSize = 2
+
+		# Page buffers that fit in SRAM, keeping 256 bytes for the routine
+		self.flashBatchPages = max(1, int((self.sramSize - 0x100) / self.flashPageSize))
+		self.routineAddr = self.flashBufferAddr + self.flashBatchPages * self.flashPageSize
+
+	async def readCODE( self, offset, size ):
+		"""
+		Read any size of buffer from the CODE region
+		"""
+		fBank = int(offset / 0x8000 )
+		await self.instr(0x75, 0xC7, fBank*16 + 1)		# MOV MEMCTR,#data
+		offset -= fBank * 0x8000
+		frames = [ self.instriFrame( 0x90, offset ) ]	# MOV DPTR,#data16
+		for i in range(0, size):
+			frames.append( self.instrFrame( 0xE4 ) )	# CLR A
+			frames.append( self.instrFrame( 0x93 ) )	# MOVC A,@A+DPTR
+			frames.append( self.instrFrame( 0xA3 ) )	# INC DPTR
+		ans = await self.sendFrames( frames )
+		return bytearray( ans[2::3] )
+
+	async def waitHalted(self, address, deadline):
+		"""
+		Wait until the routine at the given address halts the CPU (status
+		bit 0x20), halting it on timeout
+		"""
+		while (await self.getStatus() & 0x20) == 0:
+			if time.time() > deadline:
+				await self.halt()
+				raise IOError("On-chip routine at 0x%04x timed out!" % address)
+			await asyncio.sleep(self.pollInterval)
+
+	async def writeFlashPages(self, page, data, erase=True):
+		"""
+		Program consecutive flash pages starting at the given page number,
+		with the flash routine uploaded by writeCODE (see
+		CC2510.writeFlashPages)
+		"""
+		count = int(len(data) / self.flashPageSize)
+		if (count == 0) or (count > self.flashBatchPages) or (len(data) % self.flashPageSize):
+			raise IOError("Flash batch must be 1 to %i whole pages!" % self.flashBatchPages)
+
+		# Upload data
+		fHigh = (int(page * self.flashPageSize / self.flashWordSize) >> 8) & 0xFF
+		await self.writeXDATA( self.flashBufferAddr, data )
+
+		# Set the routine parameters, jump to it and run it
+		await self.sendFrames([
+			self.instrFrame( 0x75, 0xD0, 0x00 ),				# MOV PSW,#data
+			self.instrFrame( 0x75, 0xC7, 0x51 ),				# MOV MEMCTR,#data
+			self.instrFrame( 0xC2, 0xAF ),						# CLR EA
+			self.instriFrame( 0x90, self.flashBufferAddr ),	# MOV DPTR,#data16
+			self.instrFrame( 0x7A, fHigh ),					# MOV R2,#data
+			self.instrFrame( 0x7B, count ),					# MOV R3,#data
+			self.instrFrame( 0x7C, 1 if erase else 0 ),		# MOV R4,#data
+			self.instriFrame( 0x02, self.routineAddr ),		# LJMP addr16
+			( CMD_RESUME, ),
+		])
+		await self.waitHalted( self.routineAddr, time.time() + self.flashPageTimeout * count )
+		return count
+
+	async def writeCODE(self, offset, data, erase=False, verify=False, showProgress=False):
+		"""
+		Fully automated function for writing the Flash memory, in batches of
+		whole pages run by the resident flash routine. Partial pages at the
+		edges are completed with their current contents when erasing, or
+		with 0xFF (which leaves the flash untouched) when not.
+
+		With any verify policy but 'off' every batch is read back and
+		compared, raising CCVerifyError on mismatch.
+		"""
+		verify = parseVerify(verify)[0] != 'off'
+
+		# Build a page-aligned image
+		pSize = self.flashPageSize
+		firstPage = int(offset / pSize)
+		lastPage = int((offset + len(data) - 1) / pSize)
+		start = firstPage * pSize
+		end = (lastPage + 1) * pSize
+		image = bytearray(b"\xff" * (end - start))
+		if erase:
+			if offset > start:
+				image[0:offset-start] = await self.readCODE( start, offset - start )
+			if offset + len(data) < end:
+				image[offset+len(data)-start:] = await self.readCODE( offset + len(data), end - offset - len(data) )
+		image[offset-start:offset-start+len(data)] = bytearray(data)
+
+		# The flash routine stays in SRAM for all the batches
+		await self.writeXDATA( self.routineAddr,
+			cc251xFlashRoutine( int(pSize / self.flashWordSize), self.flashWordSize ) )
+
+		# Write in batches of as many pages as the SRAM buffers hold
+		progress = ProgressTracker( 'write', len(image), source=self.port )
+		page = firstPage
+		while page <= lastPage:
+
+			# Check if we should show progress (one line per port, as the
+			# output of several debuggers is interleaved)
+			iOfs = (page - firstPage) * pSize
+			progress.update( iOfs )
+			if showProgress:
+				print("    %s: Progress %0.0f%%... " % (self.port, iOfs*100/len(image)))
+
+			iLen = min( lastPage - page + 1, self.flashBatchPages ) * pSize
+			await self.writeFlashPages( page, image[iOfs:iOfs+iLen], erase=erase )
+
+			# Check if we should verify
+			if verify:
+				lo = max( offset, start + iOfs )
+				hi = min( offset + len(data), start + iOfs + iLen )
+				verifyBytes = await self.readCODE( lo, hi - lo )
+				for i in range(0, hi - lo):
+					if verifyBytes[i] != data[lo-offset+i]:
+						raise CCVerifyError(lo + i)
+
+			page += int(iLen / pSize)
+
+		progress.finish()
+		if showProgress:
+			print("    %s: Progress 100%%... OK" % self.port)
+
+# Chip drivers the asyncio CCDebugger will test for
+ASYNC_CHIP_DRIVERS = [ AsyncCC254X, AsyncCC2510 ]
+
+async def openCCDebuggerAsync( port, driver=None, enterDebug=False, noReset=False ):
+	"""
+	Factory coroutine that instantiates the appropriate asyncio chip driver
+	according to the information obtained from the port
+	"""
+
+	# Create a proxy class (this raises IOError on errors)
+	proxy = await AsyncCCLibProxy.open( port, enterDebug=enterDebug, noReset=noReset )
+
+	# Check if no chip is connected
+	if proxy.chipID == 0x0000:
+		proxy.close()
+		raise IOError("No chip found on %s. Check your connection and/or wiring!" % port)
+	if proxy.chipID == 0xffff:
+		proxy.close()
+		raise IOError("Short-circuit or wrong wiring detected on %s. Check your connection and/or wiring!" % port)
+
+	# Locate the appropriate chip driver to instantiate
+	if driver is None:
+		for d in ASYNC_CHIP_DRIVERS:
+			if d.test( proxy.chipID ):
+				driver = d
+				break
+		if not driver:
+			proxy.close()
+			raise IOError("No driver found for your chip (chipID=0x%04x)!" % proxy.chipID)
+
+	# Initialize
+	inst = driver(proxy=proxy)
+	await inst.initialize()
+
+	# Log message
+	print("INFO: Found a %s chip on %s" % ( inst.chipName(), proxy.port ))
+	return inst
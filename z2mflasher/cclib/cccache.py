@@ -0,0 +1,99 @@
+#
+# CCLib_proxy Interface Library for High-Level operations
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+from __future__ import print_function
+import contextlib
+import json
+import os
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+try:
+	import msvcrt
+except ImportError:
+	msvcrt = None
+
+def getCacheDir():
+	"""
+	Return the directory where CCLib keeps its persistent state. It can be
+	overridden with the CC_CACHE_DIR environment variable.
+	"""
+	return os.environ.get("CC_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cclib"))
+
+def loadCache(name):
+	"""
+	Load the given JSON cache file, returning an empty dict if it's
+	missing or corrupted
+	"""
+	try:
+		with open(os.path.join(getCacheDir(), name), "r") as f:
+			data = json.load(f)
+		return data if isinstance(data, dict) else {}
+	except (IOError, OSError, ValueError):
+		return {}
+
+def saveCache(name, data):
+	"""
+	Save the given dict in a JSON cache file. Failures are not fatal, the
+	cache is just an optimization.
+	"""
+	path = os.path.join(getCacheDir(), name)
+	try:
+		if not os.path.isdir(os.path.dirname(path)):
+			os.makedirs(os.path.dirname(path))
+
+		# Write to a temporary file first, so readers never see half a file
+		with open(path + ".tmp", "w") as f:
+			json.dump(data, f, indent=2, sort_keys=True)
+		os.replace(path + ".tmp", path)
+		return True
+	except (IOError, OSError):
+		return False
+
+@contextlib.contextmanager
+def lockCache(name):
+	"""
+	Hold an exclusive lock on the given cache file while the block runs, so
+	read-modify-write updates from concurrent processes do not overwrite
+	each other. As with saveCache, failures are not fatal and the block
+	then runs unlocked.
+	"""
+	path = os.path.join(getCacheDir(), name + ".lock")
+	f = None
+	try:
+		if not os.path.isdir(os.path.dirname(path)):
+			os.makedirs(os.path.dirname(path))
+		f = open(path, "a")
+		if fcntl is not None:
+			fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+		elif msvcrt is not None:
+			f.seek(0)
+			msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+	except (IOError, OSError):
+		pass
+	try:
+		yield
+	finally:
+		if f is not None:
+			if (fcntl is None) and (msvcrt is not None):
+				try:
+					f.seek(0)
+					msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+				except (IOError, OSError):
+					pass
+			f.close()
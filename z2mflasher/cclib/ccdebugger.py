@@ -23,18 +23,19 @@ import time
 import sys
 
 # Chip drivers the CCDebugger will test for
+from z2mflasher.cclib.chip import CCFlashLockedError, CCVerifyError
 from z2mflasher.cclib.chip.cc254x import CC254X
 from z2mflasher.cclib.chip.cc2510 import CC2510
 CHIP_DRIVERS = [ CC254X, CC2510 ]
 
-def openCCDebugger( port, driver=None, enterDebug=False ):
+def openCCDebugger( port, driver=None, enterDebug=False, noReset=False ):
 	"""
 	Factory function that instantiates the appropriate chip and/or extension
 	classes according to the information obtained from the serial port
 	"""
 
 	# Create a proxy class (this raises IOError on errors)
-	proxy = CCLibProxy( port, enterDebug=enterDebug )
+	proxy = CCLibProxy( port, enterDebug=enterDebug, noReset=noReset )
 
 	# Check if no chip is connected
 	if proxy.chipID == 0x0000:
@@ -76,6 +77,83 @@ def openCCDebugger( port, driver=None, enterDebug=False ):
 	# Return driver
 	return inst
 
+class CCDebuggerSession:
+	"""
+	Keeps a chip driver open across several operations on the same device
+	(identification, erase, programming, verification) and reconnects only
+	when an operation fails with an IOError.
+
+		with CCDebuggerSession(port) as session:
+			session.run(lambda dbg: dbg.getSerial())
+			session.run(lambda dbg: dbg.chipErase())
+	"""
+
+	def __init__(self, port, driver=None, enterDebug=False, noReset=False, retries=3):
+		"""
+		Prepare a session for the given port. The debugger is opened on the
+		first operation.
+		"""
+		self.port = port
+		self.driver = driver
+		self.enterDebug = enterDebug
+		self.noReset = noReset
+		self.retries = retries
+		self.dbg = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def open(self):
+		"""
+		Return the chip driver, opening the debugger if needed
+		"""
+		if self.dbg is None:
+			self.dbg = openCCDebugger( self.port, driver=self.driver,
+				enterDebug=self.enterDebug, noReset=self.noReset )
+		return self.dbg
+
+	def close(self):
+		"""
+		Close the debugger, if open
+		"""
+		if self.dbg is not None:
+			try:
+				self.dbg.close()
+			except Exception:
+				pass
+			self.dbg = None
+
+	def reconnect(self):
+		"""
+		Close and re-open the debugger
+		"""
+		self.close()
+		return self.open()
+
+	def run(self, fn, *args, **kwargs):
+		"""
+		Call fn(dbg, *args, **kwargs) with the open chip driver. If it fails
+		with an IOError the debugger is re-opened and the call repeated, up
+		to `retries` times in total.
+
+		Verification errors and locked pages are raised right away: the
+		driver already rewrote what it could (see ChipDriver.repairCODE), and
+		reconnecting only fixes link failures.
+		"""
+		for i in range(0, self.retries):
+			try:
+				return fn(self.open(), *args, **kwargs)
+			except (CCVerifyError, CCFlashLockedError):
+				raise
+			except IOError as e:
+				self.close()
+				if i + 1 >= self.retries:
+					raise
+				print("WARNING: %s, reconnecting to %s" % (e, self.port))
+
 def renderDebugConfig(cfg):
 	"""
 	Visualize debug config
@@ -16,6 +16,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 from __future__ import print_function
+import os
 
 def toHex(data):
 	"""
@@ -42,6 +43,29 @@ def hexdump(src, length=8):
 		result.append( b"%04X   %-*s   %s" % (i, length*(digits + 1), hexa, text) )
 	return b'\n'.join(result)
 
+def fileFormat(filename, ftype=None):
+	"""
+	Return the format of a firmware file ('hex' or 'bin'), guessing it from
+	the extension if not specified
+	"""
+	if ftype == None:
+		if filename[-4:].lower() == ".hex":
+			ftype = "hex"
+		elif filename[-4:].lower() == ".bin":
+			ftype = "bin"
+		else:
+			raise IOError("Could not detect file format. Please specify!")
+	if ftype not in ("hex", "bin"):
+		raise IOError("Unknown format '%s' specified!" % ftype)
+	return ftype
+
+def hexRecord(addr, cmd, bytes):
+	"""
+	Return an IntelHEX record line
+	"""
+	bytes = bytearray([ len(bytes), (addr >> 8) & 0xFF, addr & 0xFF, cmd ]) + bytearray(bytes)
+	return ":%s%02x\n" % (toHex(bytes), (0x100 - (sum(bytes) & 0xFF)) & 0xFF)
+
 class CCMemBlock:
 	"""
 	In-memory memory block representation.
@@ -94,6 +118,32 @@ class CCMemBlock:
 	def __repr__(self):
 		return "<MemBlock @ 0x%04x (%i Bytes)>" % (self.addr, self.size)
 
+def stripRanges(memBlocks, ranges):
+	"""
+	Return a copy of the memory blocks without the bytes that fall in any
+	of the given (start, end) address ranges (end excluded), splitting the
+	blocks where needed
+	"""
+	ans = []
+	for mb in memBlocks:
+		pieces = [ (mb.addr, mb.addr + mb.size) ]
+		for start, end in ranges:
+			cut = []
+			for lo, hi in pieces:
+				if (end <= lo) or (start >= hi):
+					cut.append( (lo, hi) )
+					continue
+				if lo < start:
+					cut.append( (lo, start) )
+				if end < hi:
+					cut.append( (end, hi) )
+			pieces = cut
+		for lo, hi in pieces:
+			block = CCMemBlock(lo)
+			block.stack( mb.bytes[lo-mb.addr:hi-mb.addr] )
+			ans.append(block)
+	return ans
+
 class CCHEXFile:
 	"""
 	Utility class for reading/writing Intel HEX files
@@ -370,3 +420,78 @@ class CCHEXFile:
 
 			# Stack rest
 			self.memBlocks.append(mb)
+
+class CCHEXWriter:
+	"""
+	Utility class for writing Intel HEX or binary files incrementally,
+	without keeping the whole image in memory
+	"""
+
+	def __init__(self, filename, ftype=None, resumeAt=None):
+		"""
+		Create the file, or continue it from the given size (as returned by
+		tell() after the last write that should be kept)
+		"""
+		self.filename = filename
+		self.ftype = fileFormat(filename, ftype)
+		if resumeAt is None:
+			self.f = open(filename, "wb")
+		else:
+			self.f = open(filename, "r+b")
+			self.f.truncate(resumeAt)
+			self.f.seek(resumeAt)
+
+		# Upper 16 bits of the address of the last HEX record
+		self.upper = None
+
+	def write(self, addr, bytes):
+		"""
+		Write bytes at the given address. Addresses must be increasing. Gaps
+		are left out of HEX files and filled with 0xFF in binary files.
+		"""
+		bytes = bytearray(bytes)
+		if self.ftype == "bin":
+			self.f.seek(0, 2)
+			end = self.f.tell()
+			if addr > end:
+				self.f.write(b"\xff" * (addr - end))
+			self.f.seek(addr)
+			self.f.write(bytes)
+			return
+
+		# Write 0x10-sized records, without crossing 64 KB boundaries
+		iOfs = 0
+		while iOfs < len(bytes):
+			a = addr + iOfs
+			iLen = min(0x10, len(bytes) - iOfs, 0x10000 - (a & 0xFFFF))
+
+			# Specify offset address
+			if (a >> 16) != self.upper:
+				self.upper = a >> 16
+				self.f.write(hexRecord(0x0000, 0x04, [ (self.upper >> 8) & 0xFF, self.upper & 0xFF ]).encode('ascii'))
+
+			# Write data
+			self.f.write(hexRecord(a & 0xFFFF, 0x00, bytes[iOfs:iOfs+iLen]).encode('ascii'))
+			iOfs += iLen
+
+	def tell(self):
+		"""
+		Return the current file size
+		"""
+		self.f.seek(0, 2)
+		return self.f.tell()
+
+	def flush(self):
+		"""
+		Make sure everything written so far is on disk
+		"""
+		self.f.flush()
+		os.fsync(self.f.fileno())
+
+	def close(self):
+		"""
+		Complete and close the file
+		"""
+		if self.ftype == "hex":
+			self.f.write(hexRecord(0x0000, 0x01, []).encode('ascii'))
+		self.f.close()
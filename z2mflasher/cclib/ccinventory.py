@@ -0,0 +1,78 @@
+#
+# CCLib_proxy Interface Library for High-Level operations
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Persistent inventory of the flashed devices, keyed by their IEEE address
+(see getSerial). Each entry records the chip ID, the hash of the image
+last flashed and how long flashing, verifying and checking took, so that a
+batch can be re-run and only touch the modules that still need the image.
+"""
+from __future__ import print_function
+import hashlib
+import struct
+import time
+
+from z2mflasher.cclib.cccache import loadCache, lockCache, saveCache
+from z2mflasher.cclib.ccroutines import crc16
+
+# Cache file with the inventory
+INVENTORY_CACHE = "inventory.json"
+
+def imageHash(memBlocks):
+	"""
+	Return the SHA-256 of a firmware image (list of CCMemBlock)
+	"""
+	h = hashlib.sha256()
+	for mb in memBlocks:
+		h.update(struct.pack(">II", mb.addr, mb.size))
+		h.update(bytes(mb.bytes))
+	return h.hexdigest()
+
+def getDevice(ieee):
+	"""
+	Return the inventory entry of a device, or None if it's unknown
+	"""
+	return loadCache(INVENTORY_CACHE).get(ieee)
+
+def recordDevice(ieee, **info):
+	"""
+	Update the inventory entry of a device with the given fields. The
+	inventory is re-read and saved under a file lock (see lockCache), so
+	concurrent batches do not lose entries.
+	"""
+	with lockCache(INVENTORY_CACHE):
+		inventory = loadCache(INVENTORY_CACHE)
+		entry = inventory.setdefault(ieee, {})
+		entry.update(info)
+		entry['updated'] = time.time()
+		saveCache(INVENTORY_CACHE, inventory)
+	return entry
+
+def isImageFlashed(dbg, ieee, memBlocks):
+	"""
+	Check if the device already holds the given image: the inventory must
+	say it was the last one flashed, and the checksums of its blocks
+	computed on the chip must agree. Drivers that cannot compute checksums
+	on the chip are never considered up to date.
+	"""
+	entry = getDevice(ieee)
+	if (entry is None) or (entry.get('imageHash') != imageHash(memBlocks)):
+		return False
+	try:
+		crcs = dbg.getCODEChecksums([ (mb.addr, mb.size) for mb in memBlocks ])
+	except NotImplementedError:
+		return False
+	return all( crc == crc16(mb.bytes) for crc, mb in zip(crcs, memBlocks) )
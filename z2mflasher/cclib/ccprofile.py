@@ -0,0 +1,221 @@
+#
+# CCLib_proxy Interface Library for High-Level operations
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Statistical PC-sampling profiler for CC253x/CC254x firmware.
+
+Every sample halts the target, reads its program counter (and FMAP, to
+tell the code banks apart) and resumes it, in a single batch of frames,
+so the CPU only stops for the time the CCLib_proxy needs to run them. The
+samples are attributed to the symbols of a linker map file and/or to
+named address ranges, and reported as a flat profile or as folded stacks
+for flame graph tools (flamegraph.pl, speedscope).
+
+Only the PC is sampled, not the call stack: the folded stacks have two
+levels, the address range (or code bank) and the symbol.
+"""
+from __future__ import print_function
+import bisect
+import collections
+import re
+import sys
+import time
+
+from z2mflasher.cclib.ccproxy import CMD_HALT, CMD_PC, CMD_RESUME
+
+# Size of the code banks mapped at 0x8000 by FMAP
+BANK_SIZE = 0x8000
+
+# Symbol lines of the supported map files: SDCC/aslink ('C:' areas), IAR
+# XLINK entry lists ('name  address') and plain '0xaddress name' listings
+MAP_PATTERNS = [
+	( re.compile(r"^\s*C:\s+([0-9A-Fa-f]{4,8})\s+([A-Za-z_?$][\w?$.]*)"), 1, 2 ),
+	( re.compile(r"^\s*0x([0-9A-Fa-f]{1,8})\s+([A-Za-z_?$][\w?$.]*)"), 1, 2 ),
+	( re.compile(r"^\s*([A-Za-z_?$][\w?$.]*)\s+(?:0x)?([0-9A-Fa-f]{4,8})\b"), 2, 1 ),
+]
+
+def linearAddress(pc, fmap):
+	"""
+	Return the flash address of a PC, given the FMAP value at the time
+	"""
+	if pc < 0x8000:
+		return pc
+	return (fmap & 0x07) * BANK_SIZE + pc - 0x8000
+
+def parseMapFile(path, banked=True):
+	"""
+	Read the symbols of a linker map file and return them as (address,
+	name) tuples sorted by address (see MAP_PATTERNS).
+
+	With banked=True, addresses above 0xFFFF are taken in the IAR banked
+	notation (bank << 16 | 0x8000-0xFFFF) and converted to flash addresses.
+	"""
+	symbols = {}
+	with open(path) as f:
+		for line in f:
+			for pattern, iAddr, iName in MAP_PATTERNS:
+				m = pattern.match(line)
+				if m:
+					addr = int(m.group(iAddr), 16)
+					if banked and (addr > 0xFFFF) and (addr & 0x8000):
+						addr = linearAddress( addr & 0xFFFF, addr >> 16 )
+					symbols.setdefault( m.group(iName), addr )
+					break
+	return sorted([ (addr, name) for name, addr in symbols.items() ])
+
+class CCProfiler:
+	"""
+	Collects PC samples of a running target
+	"""
+
+	def __init__(self, dbg, banked=True):
+		"""
+		Profile the target of a chip driver, which must be in debug mode. With
+		banked=True FMAP is sampled too, for firmware using code banking.
+		"""
+		self.dbg = dbg
+		self.banked = banked
+		self.samples = collections.Counter()
+		self.elapsed = 0.0
+		self.symbols = []
+		self.addresses = []
+		self.ranges = []
+
+	def loadMap(self, path):
+		"""
+		Attribute the samples to the symbols of a linker map file
+		"""
+		self.symbols = parseMapFile( path, self.banked )
+		self.addresses = [ addr for addr, name in self.symbols ]
+		return len(self.symbols)
+
+	def addRange(self, name, start, end):
+		"""
+		Attribute the samples between the given flash addresses (end
+		excluded) to a named range
+		"""
+		self.ranges.append( (start, end, name) )
+
+	def sampleFrames(self):
+		"""
+		Return the frames of one sample: halt, read the PC and resume. FMAP is
+		read by exchanging it with A twice, which restores both.
+		"""
+		frames = [ (CMD_HALT,), (CMD_PC,) ]
+		if self.banked:
+			frames += [
+				self.dbg.instrFrame( 0xC5, 0x9F ),	# XCH A,FMAP
+				self.dbg.instrFrame( 0xC5, 0x9F ),	# XCH A,FMAP
+			]
+		frames.append( (CMD_RESUME,) )
+		return frames
+
+	def sample(self, duration=10.0, interval=0.01, count=None):
+		"""
+		Take a sample every interval seconds, for the given duration or until
+		count samples are taken. The target is left running.
+
+		Returns the number of samples taken.
+		"""
+		frames = self.sampleFrames()
+		taken = 0
+		start = time.time()
+		try:
+			while (taken < count) if count is not None else (time.time() - start < duration):
+				ans = self.dbg.sendFrames( frames )
+				self.samples[ linearAddress( ans[1], ans[2] if self.banked else 0 ) ] += 1
+				taken += 1
+				if interval:
+					self.dbg.pollSleep(interval)
+		finally:
+			# The registers, SRAM and flash can change while the target runs
+			self.dbg.invalidateCaches()
+			self.elapsed += time.time() - start
+		return taken
+
+	def symbolOf(self, addr):
+		"""
+		Return the symbol an address belongs to, or its 256-byte block if
+		there is no symbol before it
+		"""
+		i = bisect.bisect_right( self.addresses, addr ) - 1
+		if i >= 0:
+			return self.symbols[i][1]
+		return "0x%05x" % (addr & ~0xFF)
+
+	def rangeOf(self, addr):
+		"""
+		Return the named range an address belongs to, or its code bank
+		"""
+		for start, end, name in self.ranges:
+			if start <= addr < end:
+				return name
+		return "bank%i" % int(addr / BANK_SIZE)
+
+	def flatProfile(self):
+		"""
+		Return the (range, symbol, samples) tuples, most sampled first
+		"""
+		counts = collections.Counter()
+		for addr, n in self.samples.items():
+			counts[ (self.rangeOf(addr), self.symbolOf(addr)) ] += n
+		return sorted([ (r, s, n) for (r, s), n in counts.items() ], key=lambda x: -x[2])
+
+	def foldedStacks(self):
+		"""
+		Return the profile as folded stacks ('range;symbol count' lines), the
+		input format of flamegraph.pl and speedscope
+		"""
+		return "".join([ "%s;%s %i\n" % (r, s, n) for r, s, n in self.flatProfile() ])
+
+	def saveFolded(self, path):
+		"""
+		Save the folded stacks to a file
+		"""
+		with open(path, "w") as f:
+			f.write( self.foldedStacks() )
+
+	def summary(self, out=sys.stdout, limit=30):
+		"""
+		Print a human-readable flat profile
+		"""
+		total = sum(self.samples.values())
+		rate = total / self.elapsed if self.elapsed else 0.0
+		print("\nPC sampling profile (%i samples in %0.2f s, %0.0f/s)" % (total, self.elapsed, rate), file=out)
+		print("\n  Samples      %  Range       Symbol", file=out)
+		for r, s, n in self.flatProfile()[:limit]:
+			print(" %8i  %5.1f%%  %-10s  %s" % (n, 100.0 * n / max(total, 1), r, s), file=out)
+		print("", file=out)
+
+if __name__ == "__main__":
+	from z2mflasher.cclib import getOptions, openCCDebugger
+
+	opts = getOptions("CC253x/CC254x PC-sampling profiler",
+		map=":Linker map file (SDCC or IAR) with the firmware symbols",
+		duration=":Seconds to sample (default 10)",
+		wait=":Seconds between samples (default 0.01)",
+		folded=":Save folded stacks for flame graphs to this file",
+		linear="Firmware without code banking (do not sample FMAP)")
+
+	dbg = openCCDebugger( opts['port'], enterDebug=opts['enter'] )
+	profiler = CCProfiler( dbg, banked=not opts['linear'] )
+	if opts['map']:
+		print("INFO: %i symbols loaded from %s" % (profiler.loadMap(opts['map']), opts['map']))
+	print("INFO: Sampling...")
+	profiler.sample( duration=float(opts['duration'] or 10), interval=float(opts['wait'] or 0.01) )
+	profiler.summary()
+	if opts['folded']:
+		profiler.saveFolded( opts['folded'] )
@@ -21,6 +21,10 @@ import time
 import glob
 import serial
 import serial.tools.list_ports
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from z2mflasher.cclib.cctransport import openTransport
+from z2mflasher.cclib.cccache import loadCache, saveCache
+from z2mflasher.cclib.cctrace import getTracer
 
 # Command constants
 CMD_ENTER     = 0x01
@@ -47,6 +51,80 @@ ANS_OK       = 0x01
 ANS_ERROR    = 0x02
 ANS_READY    = 0x03
 
+# Maximum number of frames in flight. The arduino serial receive buffer
+# is 64 bytes long, so up to 16 4-byte frames can be queued safely.
+PIPELINE_DEPTH = 16
+
+# Port auto-detection: how long to wait for a proxy to answer on each port
+# (this includes the arduino reboot) and how many ports to probe at once
+PROBE_TIMEOUT = 2.5
+PROBE_WORKERS = 16
+
+# Readiness detection: the proxy is considered ready after READY_PINGS
+# consecutive pings answered within READY_PING_TIMEOUT
+READY_TIMEOUT = 3.0
+READY_PING_TIMEOUT = 0.1
+READY_PINGS = 2
+
+# Cache file with the ports a CCLib_proxy was found on
+PORT_CACHE = "ports.json"
+
+def portCacheKey(port):
+	"""
+	Return the key identifying a port in the port cache. USB serial numbers
+	and locations survive re-enumeration, device names are the fallback.
+	"""
+	if getattr(port, 'serial_number', None):
+		return "usb:%s" % port.serial_number
+	if getattr(port, 'location', None):
+		return "loc:%s" % port.location
+	return "dev:%s" % port[0]
+
+def waitReady(ser, timeout=READY_TIMEOUT):
+	"""
+	Wait for the CCLib_proxy on the given port to answer, sending short
+	CMD_PING attempts until the deadline. This covers the arduino reboot
+	after opening the port without sleeping more than needed.
+	Returns True if the proxy is ready.
+	"""
+	portTimeout = ser.timeout
+	ser.timeout = READY_PING_TIMEOUT
+	try:
+		good = 0
+		deadline = time.time() + timeout
+		while time.time() < deadline:
+			ser.flushInput()
+			ser.write(bytearray([CMD_PING, 0, 0, 0]))
+			ser.flush()
+			ans = bytearray(ser.read(3))
+			if (len(ans) == 3) and (ans[0] == ANS_OK):
+				good += 1
+				if good >= READY_PINGS:
+					ser.flushInput()
+					return True
+			else:
+				good = 0
+		return False
+	finally:
+		ser.timeout = portTimeout
+
+def probePort(device, timeout=PROBE_TIMEOUT, noReset=False):
+	"""
+	Check if a CCLib_proxy answers on the given serial port.
+	Returns the opened port, or None.
+	"""
+	try:
+		ser = openTransport(device, timeout=3.0, noReset=noReset)
+	except Exception:
+		return None
+	try:
+		if waitReady(ser, timeout):
+			return ser
+	except Exception:
+		pass
+	ser.close()
+	return None
+
 class CCLibProxy:
 	"""
 	CCLib_proxy interface class that provides the high-level API for communicating
@@ -57,9 +135,22 @@ class CCLibProxy:
 	performance issues, a binary serial protocol was used.
 	"""
 
-	def __init__(self, port=None, parent=None, enterDebug=False):
+	# Number of frames to send before waiting for the responses
+	pipelineDepth = PIPELINE_DEPTH
+
+	# Port used when auto-detecting
+	ser = None
+
+	# Frame-level tracer (see cctrace), None when tracing is disabled
+	tracer = None
+
+	def __init__(self, port=None, parent=None, enterDebug=False, noReset=False):
 		"""
 		Initialize the CCLibProxy class
+
+		The port can be a local serial port, 'auto' for auto-detection or a
+		URL such as socket://<host>:<port> (see cctransport). Use noReset for
+		adapters that should not (or do not) reboot when the port is opened.
 		"""
 
 		# If we are subclassing, just adopt properties
@@ -72,30 +163,32 @@ class CCLibProxy:
 			self.debugStatus = parent.debugStatus
 			self.debugConfig = parent.debugConfig
 			self.instructionTableVersion = parent.instructionTableVersion
+			self.tracer = parent.tracer
 
 		else:
 
+			# Pick up the tracer, if tracing is enabled
+			self.tracer = getTracer()
+
 			# If we don't have a port specified perform autodetect
 			if port is None or port == 'auto':
-				self.detectPort()
+				self.detectPort(noReset)
 
 			else:
 				# Open port
 				try:
-					self.ser = serial.Serial(port, baudrate=115200, timeout=3.0, write_timeout=3.0)
+					self.ser = openTransport(port, baudrate=115200, timeout=3.0, noReset=noReset)
 					self.port = port
-					time.sleep(1)
 					self.ser.flushInput()
 					self.ser.flushOutput()
 				except:
 					raise IOError("Could not open port %s" % port)
 
-				# Ping
-				try:
-					self.ping()
-				except IOError as e:
-					print(e)
-					raise IOError("Could not find CCLib_proxy device on port %s" % self.ser.name)
+				# Wait until the proxy answers to pings (ex. after the
+				# arduino reboots)
+				if not waitReady(self.ser):
+					self.ser.close()
+					raise IOError("Could not find CCLib_proxy device on port %s" % port)
 
 			# Check if we should enter debug mode
 			if enterDebug:
@@ -109,10 +202,13 @@ class CCLibProxy:
 			self.debugStatus = self.getStatus()
 			self.debugConfig = self.readConfig()
 
-	def detectPort(self):
+	def detectPort(self, noReset=False):
 		"""
 		Iterate over system COM ports in order to locate a port that the proxy
 		responds upon.
+
+		The port that answered last time is tried first (see cccache), the
+		rest are probed in parallel with short timeouts.
 		"""
 		print("NOTE: Performing auto-detection (use -p to specify port manually)")
 
@@ -122,32 +218,48 @@ class CCLibProxy:
 		priority_names =  ['acm', 'usb', 'ttys']
 		all_ports = list(serial.tools.list_ports.comports())
 		for name in priority_names:
-			for i in range(0, len(all_ports)):
-				if name.lower() in all_ports[i][0]:
-					ports.append(all_ports[i])
-					all_ports.pop(i)
+			for p in list(all_ports):
+				if name.lower() in p[0].lower():
+					ports.append(p)
+					all_ports.remove(p)
 		ports += all_ports
 
-		# Try to ping each one
-		for port in ports:
-			try:
-				print("INFO: Checking %s" % port[0])
-				self.ser = serial.Serial(port[0])
-
-				# If ping fails, we will get an exception
-				self.sendFrame(CMD_PING)
+		# Try the last known good ports first
+		cache = loadCache(PORT_CACHE)
+		for port in [ p for p in ports if portCacheKey(p) in cache ]:
+			print("INFO: Checking last known port %s" % port[0])
+			self.ser = probePort(port[0], noReset=noReset)
+			if self.ser is not None:
 				self.port = port[0]
 				return
-
-			except:
-				try:
-					self.ser.close()
-				except:
-					pass
-				self.ser = None
+			del cache[portCacheKey(port)]
+			ports.remove(port)
+
+		# Probe the rest in parallel and take the first port that answers
+		if ports:
+			print("INFO: Checking %s" % ", ".join([ p[0] for p in ports ]))
+			pool = ThreadPoolExecutor(max_workers=min(len(ports), PROBE_WORKERS))
+			jobs = dict([ (pool.submit(probePort, p[0], noReset=noReset), p) for p in ports ])
+			for job in as_completed(jobs):
+				if job.result() is not None:
+					self.ser = job.result()
+					self.port = jobs[job][0]
+					cache[portCacheKey(jobs[job])] = self.port
+					break
+
+			# Close any other proxies answering on the remaining ports
+			def closeOther(job):
+				ser = job.result()
+				if (ser is not None) and (ser is not self.ser):
+					ser.close()
+			for job in jobs:
+				job.add_done_callback(closeOther)
+			pool.shutdown(wait=False)
 
 		# No port defined? Raise an exception
-		raise IOError("Could not detect a CCLib_proxy connected on any serial port")
+		saveCache(PORT_CACHE, cache)
+		if self.ser is None:
+			raise IOError("Could not detect a CCLib_proxy connected on any serial port")
 
 	def close(self):
 		self.ser.close()
@@ -162,18 +274,29 @@ class CCLibProxy:
 		"""
 
 		# Read response frame
-		b = self.ser.read()
-		if len(b) == 0:
-			raise IOError("Could not read from the serial port!")
-		status = ord(b)
-		b = self.ser.read()
-		if len(b) == 0:
-			raise IOError("Could not read from the serial port!")
-		bH = ord(b)
-		b = self.ser.read()
-		if len(b) == 0:
-			raise IOError("Could not read from the serial port!")
-		bL = ord(b)
+		b = self.readBytes(3)
+		return self.decodeFrame(b[0], b[1], b[2], raiseException)
+
+	def readBytes(self, size):
+		"""
+		Read exactly the given number of bytes from the serial port
+		"""
+
+		# Collect bytes until we have them all (or the port times out)
+		ans = bytearray()
+		while len(ans) < size:
+			b = self.ser.read(size - len(ans))
+			if len(b) == 0:
+				raise IOError("Could not read from the serial port!")
+			ans += b
+
+		# Return buffer
+		return ans
+
+	def decodeFrame(self, status, bH, bL, raiseException=True):
+		"""
+		Translate the status and the two data bytes of a response frame
+		"""
 
 		# Handle error responses
 		if status == ANS_ERROR:
@@ -212,11 +335,64 @@ class CCLibProxy:
 		packet.append(c1)
 		packet.append(c2)
 		packet.append(c3)
+		t0 = time.time()
 		self.ser.write(packet)
 		self.ser.flush()
 
 		# Read frame
-		return self.readFrame(raiseException)
+		b = self.readBytes(3)
+		if self.tracer:
+			self.tracer.roundTrip([ cmd ], 4, 3, time.time() - t0)
+		return self.decodeFrame(b[0], b[1], b[2], raiseException)
+
+	def sendFrames(self, frames, raiseException=True):
+		"""
+		Send a batch of frames and return the list of their responses.
+
+		Each frame is a (cmd, c1, c2, c3) tuple (trailing arguments can be
+		omitted). Up to `pipelineDepth` frames are written to the serial port
+		in a single write and their 3-byte responses are collected with a
+		single read, removing the per-frame USB round trip.
+
+		NOTE: Frames that expect a follow-up payload (CMD_BRUSTWR and
+		      CMD_INSTR_UPD) cannot be batched.
+		"""
+
+		# Prepare answers array
+		ans = []
+
+		# Split in windows that fit in the arduino receive buffer
+		frames = list(frames)
+		for i in range(0, len(frames), self.pipelineDepth):
+			window = frames[i:i+self.pipelineDepth]
+
+			# Concatenate the 4-byte command frames
+			packet = bytearray()
+			for f in window:
+				packet.append(f[0])
+				packet += bytearray(f[1:]) + bytearray(4 - len(f))
+			t0 = time.time()
+			self.ser.write(packet)
+			self.ser.flush()
+
+			# Read all the response frames at once, before decoding them,
+			# so the stream stays in sync even if one of them is an error
+			b = self.readBytes(3 * len(window))
+			if self.tracer:
+				self.tracer.roundTrip([ f[0] for f in window ], len(packet), len(b), time.time() - t0)
+			for j in range(0, len(b), 3):
+				ans.append(self.decodeFrame(b[j], b[j+1], b[j+2], raiseException))
+
+		# Return answers
+		return ans
+
+	def pollSleep(self, seconds):
+		"""
+		Sleep while polling the chip, accounting the time in the tracer
+		"""
+		if self.tracer:
+			self.tracer.sleep(seconds)
+		time.sleep(seconds)
 
 	###############################################
 	# Debug-level functions
@@ -304,31 +480,49 @@ class CCLibProxy:
 		"""
 		return self.sendFrame(CMD_PC)
 
+	def setPC(self, address):
+		"""
+		Set the program counter position
+		"""
+		return self.instri(0x02, address)	# LJMP addr16
+
 	def instr(self, c1, c2=None, c3=None):
 		"""
 		Execute a debug instruction
 		"""
+		return self.sendFrame(*self.instrFrame(c1, c2, c3))
 
-		# Call the appropriate instruction according
+	def instri(self, c1, i1):
+		"""
+		Execute a debug instruction with 16-bit constant
+		"""
+		return self.sendFrame(*self.instriFrame(c1, i1))
+
+	def instrFrame(self, c1, c2=None, c3=None):
+		"""
+		Build the frame of a debug instruction, for use with sendFrames
+		"""
+
+		# Pick the appropriate command according
 		# to the number of bytes
 		if (c2 == None):
-			return self.sendFrame(CMD_EXEC_1, c1)
+			return (CMD_EXEC_1, c1)
 		elif (c3 == None):
-			return self.sendFrame(CMD_EXEC_2, c1, c2)
+			return (CMD_EXEC_2, c1, c2)
 		else:
-			return self.sendFrame(CMD_EXEC_3, c1, c2, c3)
+			return (CMD_EXEC_3, c1, c2, c3)
 
-	def instri(self, c1, i1):
+	def instriFrame(self, c1, i1):
 		"""
-		Execute a debug instruction with 16-bit constant
+		Build the frame of a debug instruction with 16-bit constant
 		"""
 
 		# Split short in high/low order bytes
 		cHigh = (i1 >> 8) & 0xFF
 		cLow = (i1 & 0xFF)
 
-		# Send instruction
-		return self.sendFrame(CMD_EXEC_3, c1, cHigh, cLow)
+		# Build instruction
+		return (CMD_EXEC_3, c1, cHigh, cLow)
 
 	def brustWrite(self, data):
 		"""
@@ -351,11 +545,14 @@ class CCLibProxy:
 			raise IOError("Unable to prepare for brust-write! (Unknown response 0x%02x)" % ans)
 
 		# Start sending data
+		t0 = time.time()
 		self.ser.write(data)
 		self.ser.flush()
 
 		# Handle response & update debug status
 		self.debugStatus = self.readFrame()
+		if self.tracer:
+			self.tracer.roundTrip([ CMD_BRUSTWR ], length, 3, time.time() - t0, payload=True)
 		return self.debugStatus
 
 	def chipErase(self):
@@ -372,7 +569,7 @@ class CCLibProxy:
 		# Wait until CHIP_ERASE_BUSY goes down
 		s = self.getStatus()
 		while (( s & 0x80 ) != 0):
-			time.sleep(0.01)
+			self.pollSleep(0.01)
 			s = self.getStatus()
 
 		# We are good
@@ -407,12 +604,14 @@ class CCLibProxy:
 			raise IOError("Unable to prepare for instruction table update! (Unknown response 0x%02x)" % ans)
 
 		# Start sending data
-		for b in table:
-			self.ser.write((b & 0xFF).to_bytes(1))
+		t0 = time.time()
+		self.ser.write(bytearray([b & 0xFF for b in table]))
 		self.ser.flush()
 
 		# Get confirmation
 		newVersion = self.readFrame()
+		if self.tracer:
+			self.tracer.roundTrip([ CMD_INSTR_UPD ], len(table), 3, time.time() - t0, payload=True)
 		if newVersion != version:
 			raise IOError("Unable to update the instruction table! (Unknown response 0x%02x)" % ans)
 
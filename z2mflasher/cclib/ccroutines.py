@@ -0,0 +1,313 @@
+#
+# CCLib_proxy Interface Library for High-Level operations
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+8051 routines that the chip drivers upload to SRAM and run on the target,
+together with their host-side counterparts.
+
+The routines only use relative jumps, so they can be placed anywhere. They
+take their parameters in registers (set with debug instructions before
+resuming the CPU) and end with the 0xA5 opcode, which halts the CPU when
+running under the debugger.
+"""
+from __future__ import print_function
+import binascii
+
+def crc16(data, crc=0xFFFF):
+	"""
+	CRC16-CCITT (polynomial 0x1021, MSB first) of the given buffer, the
+	same as computed by crc16Routine()
+	"""
+	return binascii.crc_hqx(bytes(bytearray(data)), crc)
+
+def loopCounter(count):
+	"""
+	Split a 16-bit loop count in the (outer, inner) register values of a
+	DJNZ inner / DJNZ outer loop pair
+	"""
+	lo = count & 0xFF
+	hi = (count >> 8) & 0xFF
+	if lo:
+		hi += 1
+	return (hi & 0xFF, lo)
+
+def crc16Routine():
+	"""
+	CRC16-CCITT over an XDATA range
+
+	Input : DPTR = start address, R2:R3 = loopCounter(length),
+	        R4:R5 = initial CRC (high:low)
+	Output: R4:R5 = CRC, DPTR = end address
+	"""
+	return bytearray([
+		0xE0,				# loop:	MOVX A,@DPTR
+		0xA3,				#	INC DPTR
+		0x6C,				#	XRL A,R4		; x = b ^ crc.H
+		0xF8,				#	MOV R0,A
+		0xC4,				#	SWAP A
+		0x54, 0x0F,			#	ANL A,#0x0F
+		0x68,				#	XRL A,R0		; x ^= x >> 4
+		0xF8,				#	MOV R0,A
+		0xC4,				#	SWAP A
+		0x54, 0xF0,			#	ANL A,#0xF0
+		0x6D,				#	XRL A,R5
+		0xFC,				#	MOV R4,A		; H = L ^ (x << 4)
+		0xE8,				#	MOV A,R0
+		0x03,				#	RR A
+		0x03,				#	RR A
+		0x03,				#	RR A
+		0xF9,				#	MOV R1,A
+		0x54, 0x1F,			#	ANL A,#0x1F
+		0x6C,				#	XRL A,R4
+		0xFC,				#	MOV R4,A		; H ^= x >> 3
+		0xE9,				#	MOV A,R1
+		0x54, 0xE0,			#	ANL A,#0xE0
+		0x68,				#	XRL A,R0
+		0xFD,				#	MOV R5,A		; L = (x << 5) ^ x
+		0xDB, 0xE2,			#	DJNZ R3,loop
+		0xDA, 0xE0,			#	DJNZ R2,loop
+		0xA5,				#	DB 0xA5 ; halt
+	])
+
+def cc251xFlashRoutine(pageWords, wordSize=2):
+	"""
+	Erase and program consecutive flash pages from an XDATA buffer, with
+	the CC251x flash controller (FLC, FADDRH:FADDRL and FWDATA SFRs)
+
+	Input : DPTR = buffer address, R2 = FADDRH of the first page,
+	        R3 = number of pages, R4 = non-zero to erase the pages first
+	Output: DPTR = end of the buffer
+	"""
+	hi, lo = loopCounter(pageWords)
+	return bytearray([
+		0x8A, 0xAD,			# page:	MOV FADDRH,R2
+		0x75, 0xAC, 0x00,	#	MOV FADDRL,#0
+		0xEC,				#	MOV A,R4
+		0x60, 0x08,			#	JZ write
+		0x75, 0xAE, 0x01,	#	MOV FLC,#0x01		; ERASE
+		0xE5, 0xAE,			# eWait:	MOV A,FLC
+		0x20, 0xE7, 0xFB,	#	JB ACC.7,eWait		; BUSY
+		0x7F, hi,			# write:	MOV R7,#hi
+		0x7E, lo,			#	MOV R6,#lo
+		0x75, 0xAE, 0x02,	#	MOV FLC,#0x02		; WRITE
+		0x7D, wordSize,		# wLoop:	MOV R5,#wordSize
+		0xE0,				# wByte:	MOVX A,@DPTR
+		0xA3,				#	INC DPTR
+		0xF5, 0xAF,			#	MOV FWDATA,A
+		0xDD, 0xFA,			#	DJNZ R5,wByte
+		0xE5, 0xAE,			# wWait:	MOV A,FLC
+		0x20, 0xE6, 0xFB,	#	JB ACC.6,wWait		; SWBSY
+		0xDE, 0xF1,			#	DJNZ R6,wLoop
+		0xDF, 0xEF,			#	DJNZ R7,wLoop
+		0xE5, 0xAE,			# fWait:	MOV A,FLC
+		0x20, 0xE7, 0xFB,	#	JB ACC.7,fWait		; BUSY
+		0x0A,				#	INC R2			; next page
+		0x0A,				#	INC R2
+		0xDB, 0xCF,			#	DJNZ R3,page
+		0xA5,				#	DB 0xA5 ; halt
+	])
+
+def iramCopyRoutine():
+	"""
+	Copy a buffer from IRAM to XDATA
+
+	Input : R0 = IRAM address, R1 = length (0 for 256), DPTR = XDATA address
+	Output: DPTR = end of the XDATA buffer
+	"""
+	return bytearray([
+		0xE6,				# loop:	MOV A,@R0
+		0x08,				#	INC R0
+		0xF0,				#	MOVX @DPTR,A
+		0xA3,				#	INC DPTR
+		0xD9, 0xFA,			#	DJNZ R1,loop
+		0xA5,				#	DB 0xA5 ; halt
+	])
+
+def blankCheckRoutine():
+	"""
+	AND of all the bytes in an XDATA range, which is 0xFF only if the
+	range is blank (erased)
+
+	Input : DPTR = start address, R2:R3 = loopCounter(length),
+	        R4 = initial value (0xFF)
+	Output: R4 = AND of the bytes, DPTR = end address
+	"""
+	return bytearray([
+		0xE0,				# loop:	MOVX A,@DPTR
+		0xA3,				#	INC DPTR
+		0x5C,				#	ANL A,R4
+		0xFC,				#	MOV R4,A
+		0xDB, 0xFA,			#	DJNZ R3,loop
+		0xDA, 0xF8,			#	DJNZ R2,loop
+		0xA5,				#	DB 0xA5 ; halt
+	])
+
+def programCheckRoutine():
+	"""
+	OR of (new & ~current) over an XDATA range and a buffer with the data
+	to program in it, which is 0 only if the data can be programmed without
+	erasing (flash bits only go from 1 to 0). Uses both data pointers.
+
+	Input : DPTR0 = start address, DPTR1 = buffer address, DPS = 0,
+	        R2:R3 = loopCounter(length), R4 = initial value (0)
+	Output: R4 = OR of the bits to set, DPTR0/DPTR1 = end addresses
+	"""
+	return bytearray([
+		0xE0,				# loop:	MOVX A,@DPTR		; current
+		0xF4,				#	CPL A
+		0xF8,				#	MOV R0,A
+		0xA3,				#	INC DPTR
+		0x05, 0x92,			#	INC DPS
+		0xE0,				#	MOVX A,@DPTR		; new
+		0xA3,				#	INC DPTR
+		0x15, 0x92,			#	DEC DPS
+		0x58,				#	ANL A,R0
+		0x4C,				#	ORL A,R4
+		0xFC,				#	MOV R4,A
+		0xDB, 0xF1,			#	DJNZ R3,loop
+		0xDA, 0xEF,			#	DJNZ R2,loop
+		0xA5,				#	DB 0xA5 ; halt
+	])
+
+def cc254xLoaderRoutine(upMask=0x01, flashMask=0x02):
+	"""
+	Flash loader for the CC253x/CC254x flash controller: erase a page and/or
+	program a chunk that a DMA channel (DBG_BW trigger) received from a
+	brust-write into a RAM buffer, through a second channel (FLASH trigger)
+	feeding FWDATA. The channel descriptors are set up by the host.
+
+	Input : R1:R2 = FADDRL:FADDRH, R3 = bit 0 to erase the page first and
+	        bit 1 to program the uploaded chunk
+	On a flash abort (locked page) it does not halt, it spins with
+	R7 = FCTL until the host halts the CPU.
+	"""
+	return bytearray([
+		0x90, 0x62, 0x71,	#	MOV DPTR,#0x6271	; FADDRL
+		0xE9,				#	MOV A,R1
+		0xF0,				#	MOVX @DPTR,A
+		0xA3,				#	INC DPTR		; FADDRH
+		0xEA,				#	MOV A,R2
+		0xF0,				#	MOVX @DPTR,A
+		0x90, 0x62, 0x70,	#	MOV DPTR,#0x6270	; FCTL
+		0xEB,				#	MOV A,R3
+		0x30, 0xE0, 0x0A,	#	JNB ACC.0,write
+		0xE0,				#	MOVX A,@DPTR
+		0x54, 0x0C,			#	ANL A,#0x0C		; keep CM
+		0x44, 0x01,			#	ORL A,#0x01		; ERASE
+		0xF0,				#	MOVX @DPTR,A
+		0xE0,				# eWait:	MOVX A,@DPTR
+		0x20, 0xE7, 0xFC,	#	JB ACC.7,eWait		; BUSY
+		0xEB,				# write:	MOV A,R3
+		0x30, 0xE1, 0x1F,	#	JNB ACC.1,done
+		0xE5, 0xD1,			# uWait:	MOV A,DMAIRQ		; upload done
+		0x54, upMask,		#	ANL A,#upMask
+		0x60, 0xFA,			#	JZ uWait
+		0x75, 0xD1, ~upMask & 0xFF,		#	MOV DMAIRQ,#~upMask
+		0x43, 0xD6, flashMask,			#	ORL DMAARM,#flashMask
+		0xE0,				#	MOVX A,@DPTR
+		0x54, 0x0C,			#	ANL A,#0x0C
+		0x44, 0x02,			#	ORL A,#0x02		; WRITE
+		0xF0,				#	MOVX @DPTR,A
+		0xE0,				# fWait:	MOVX A,@DPTR
+		0x20, 0xE5, 0x0E,	#	JB ACC.5,abort		; ABORT
+		0xE5, 0xD1,			#	MOV A,DMAIRQ
+		0x54, flashMask,	#	ANL A,#flashMask
+		0x60, 0xF6,			#	JZ fWait
+		0x75, 0xD1, ~flashMask & 0xFF,	#	MOV DMAIRQ,#~flashMask
+		0xE0,				# done:	MOVX A,@DPTR
+		0x20, 0xE7, 0xFC,	#	JB ACC.7,done		; BUSY
+		0xA5,				#	DB 0xA5 ; halt
+		0xFF,				# abort:	MOV R7,A
+		0x80, 0xFE,			#	SJMP $
+	])
+
+def packBits(data):
+	"""
+	PackBits compression of a buffer, as expanded by packBitsRoutine(): a
+	header byte n is followed by n+1 literal bytes (n < 128) or by a byte
+	repeated 257-n times (n > 128). The stream ends with n = 128.
+	"""
+	data = bytearray(data)
+	out = bytearray()
+	i = 0
+	while i < len(data):
+
+		# Run of 3 to 128 repeated bytes
+		j = i + 1
+		while (j < len(data)) and (j - i < 128) and (data[j] == data[i]):
+			j += 1
+		if j - i >= 3:
+			out += bytearray([ 257 - (j - i), data[i] ])
+			i = j
+			continue
+
+		# Literal bytes, up to the next run
+		j = i
+		while (j < len(data)) and (j - i < 128):
+			if (j + 2 < len(data)) and (data[j] == data[j+1] == data[j+2]):
+				break
+			j += 1
+		out.append(j - i - 1)
+		out += data[i:j]
+		i = j
+
+	out.append(0x80)
+	return out
+
+def packBitsRoutine(upMask=0x01, next=None):
+	"""
+	Expand a packBits() stream into an XDATA buffer, once the DMA channel
+	that receives it (DBG_BW trigger) is done. Uses both data pointers.
+
+	Input : DPTR0 = stream address, DPTR1 = buffer address, DPS = 0
+	Output: DPTR0 = end of the stream, DPTR1 = end of the buffer
+
+	If a CODE address is given the routine jumps there when done, so that
+	another routine (ex. the flash loader) can follow without the host
+	resuming the CPU again. R1-R3 are left untouched.
+	"""
+	end = [ 0xA5 ] if next is None else [ 0x02, (next >> 8) & 0xFF, next & 0xFF ]
+	return bytearray([
+		0xE5, 0xD1,			# uWait:	MOV A,DMAIRQ		; upload done
+		0x54, upMask,		#	ANL A,#upMask
+		0x60, 0xFA,			#	JZ uWait
+		0xE0,				# loop:	MOVX A,@DPTR		; header
+		0xA3,				#	INC DPTR
+		0xB4, 0x80, 0x02,	#	CJNE A,#0x80,chunk
+		0x80, 0x21,			#	SJMP done
+		0x20, 0xE7, 0x0E,	# chunk:	JB ACC.7,run
+		0xFE,				#	MOV R6,A		; n+1 literal bytes
+		0x0E,				#	INC R6
+		0xE0,				# lit:	MOVX A,@DPTR
+		0xA3,				#	INC DPTR
+		0x05, 0x92,			#	INC DPS
+		0xF0,				#	MOVX @DPTR,A
+		0xA3,				#	INC DPTR
+		0x15, 0x92,			#	DEC DPS
+		0xDE, 0xF6,			#	DJNZ R6,lit
+		0x80, 0xE8,			#	SJMP loop
+		0xF4,				# run:	CPL A			; 257-n repeated bytes
+		0x24, 0x02,			#	ADD A,#2
+		0xFE,				#	MOV R6,A
+		0xE0,				#	MOVX A,@DPTR
+		0xA3,				#	INC DPTR
+		0x05, 0x92,			#	INC DPS
+		0xF0,				# rep:	MOVX @DPTR,A
+		0xA3,				#	INC DPTR
+		0xDE, 0xFC,			#	DJNZ R6,rep
+		0x15, 0x92,			#	DEC DPS
+		0x80, 0xD8,			#	SJMP loop
+	] + end)					# done:	DB 0xA5 ; halt (or LJMP next)
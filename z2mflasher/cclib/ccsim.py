@@ -0,0 +1,1365 @@
+#
+# CCLib_proxy Interface Library for High-Level operations
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Software simulator of a CCLib_proxy arduino wired to a CC2530 (or to a
+CC2510, see CC2510Sim).
+
+The simulator speaks the CCLib_proxy frame protocol and models the parts of
+the chip the drivers rely on: an 8051 core (for debug instructions and for
+routines started with resume), SRAM, the XDATA memory map, MEMCTR/FMAP
+banking, the DMA controller (DBG_BW and FLASH triggers) and the flash
+controller (FCTL, FADDR, FWDATA, page and chip erase).
+
+It is reachable through the 'sim://<name>' transport, so the regular code
+paths can be exercised without hardware:
+
+	sim = CC2530Sim()
+	registerSimulator('bench', sim)
+	dbg = openCCDebugger('sim://bench')
+
+The link is emulated with a virtual clock that accounts for the USB latency,
+the serial line speed and the time the arduino needs to process each frame,
+plus the real time spent on the host between calls (ex. polling sleeps).
+`sim.now` is therefore an estimate of the wall-clock time the same sequence
+of operations would take on real hardware. Run this module to benchmark
+writeCODE on a simulated chip (add 'cc2510' for the CC2510 model,
+'loader' for the CC2530 flash loader, or 'compress' for the loader with
+compressed transfers of an image with padding).
+"""
+from __future__ import print_function
+import collections
+import time
+
+from z2mflasher.cclib.ccproxy import *
+from z2mflasher.cclib.cctransport import registerTransport
+
+###############################################
+# 8051 core
+###############################################
+
+# SFR addresses used by the core
+SFR_SP    = 0x81
+SFR_DPL0  = 0x82
+SFR_DPH0  = 0x83
+SFR_DPL1  = 0x84
+SFR_DPH1  = 0x85
+SFR_DPS   = 0x92
+SFR_MPAGE = 0x93
+SFR_PSW   = 0xD0
+SFR_ACC   = 0xE0
+SFR_B     = 0xF0
+
+class C8051:
+	"""
+	Minimal 8051 core. Memory spaces other than IRAM are delegated to the
+	chip model through readSFR/writeSFR/readX/writeX/readCode.
+	"""
+
+	def __init__(self, chip):
+		self.chip = chip
+		self.iram = bytearray(256)
+		self.pc = 0
+		self.halted = True
+		self.elapsed = 0
+		self.jumped = False
+		self.fetchBuf = None
+		self.fetchBase = 0
+		self.ops = [ self.opInvalid ] * 256
+		self.buildOpcodeTable()
+
+	###############################################
+	# Memory access
+	###############################################
+
+	def fetch(self, addr):
+		if self.fetchBuf is not None:
+			return self.fetchBuf[addr - self.fetchBase]
+		return self.chip.readCode(addr & 0xFFFF)
+
+	def rd(self, addr):
+		"""
+		Read direct address
+		"""
+		if addr < 0x80:
+			return self.iram[addr]
+		if addr == SFR_PSW:
+			a = self.chip.sfr[SFR_ACC - 0x80]
+			p = bin(a).count("1") & 1
+			return (self.chip.sfr[SFR_PSW - 0x80] & 0xFE) | p
+		return self.chip.readSFR(addr)
+
+	def wr(self, addr, v):
+		"""
+		Write direct address
+		"""
+		if addr < 0x80:
+			self.iram[addr] = v & 0xFF
+		else:
+			self.chip.writeSFR(addr, v & 0xFF)
+
+	@property
+	def a(self):
+		return self.chip.sfr[SFR_ACC - 0x80]
+
+	@a.setter
+	def a(self, v):
+		self.chip.sfr[SFR_ACC - 0x80] = v & 0xFF
+
+	@property
+	def c(self):
+		return self.chip.sfr[SFR_PSW - 0x80] >> 7
+
+	@c.setter
+	def c(self, v):
+		psw = self.chip.sfr[SFR_PSW - 0x80]
+		self.chip.sfr[SFR_PSW - 0x80] = (psw | 0x80) if v else (psw & 0x7F)
+
+	def setFlags(self, c=None, ac=None, ov=None):
+		psw = self.chip.sfr[SFR_PSW - 0x80]
+		if c is not None:
+			psw = (psw | 0x80) if c else (psw & 0x7F)
+		if ac is not None:
+			psw = (psw | 0x40) if ac else (psw & 0xBF)
+		if ov is not None:
+			psw = (psw | 0x04) if ov else (psw & 0xFB)
+		self.chip.sfr[SFR_PSW - 0x80] = psw
+
+	def regAddr(self, n):
+		return ((self.chip.sfr[SFR_PSW - 0x80] >> 3) & 3) * 8 + n
+
+	def getR(self, n):
+		return self.iram[self.regAddr(n)]
+
+	def setR(self, n, v):
+		self.iram[self.regAddr(n)] = v & 0xFF
+
+	def dptrRegs(self):
+		if self.chip.sfr[SFR_DPS - 0x80] & 1:
+			return (SFR_DPL1, SFR_DPH1)
+		return (SFR_DPL0, SFR_DPH0)
+
+	@property
+	def dptr(self):
+		l, h = self.dptrRegs()
+		return (self.chip.sfr[h - 0x80] << 8) | self.chip.sfr[l - 0x80]
+
+	@dptr.setter
+	def dptr(self, v):
+		l, h = self.dptrRegs()
+		self.chip.sfr[h - 0x80] = (v >> 8) & 0xFF
+		self.chip.sfr[l - 0x80] = v & 0xFF
+
+	def bitAddr(self, bit):
+		if bit < 0x80:
+			return (0x20 + (bit >> 3), bit & 7)
+		return (bit & 0xF8, bit & 7)
+
+	def getBit(self, bit):
+		addr, n = self.bitAddr(bit)
+		return (self.rd(addr) >> n) & 1
+
+	def setBit(self, bit, v):
+		addr, n = self.bitAddr(bit)
+		a = self.rd(addr)
+		self.wr(addr, (a | (1 << n)) if v else (a & ~(1 << n)))
+
+	def push(self, v):
+		sp = (self.chip.sfr[SFR_SP - 0x80] + 1) & 0xFF
+		self.chip.sfr[SFR_SP - 0x80] = sp
+		self.iram[sp] = v & 0xFF
+
+	def pop(self):
+		sp = self.chip.sfr[SFR_SP - 0x80]
+		self.chip.sfr[SFR_SP - 0x80] = (sp - 1) & 0xFF
+		return self.iram[sp]
+
+	###############################################
+	# Execution
+	###############################################
+
+	def debugInstr(self, code):
+		"""
+		Execute an instruction injected through the debug interface. The
+		PC is only updated by jumps.
+		"""
+		pc = self.pc
+		self.fetchBuf = bytearray(code)
+		self.fetchBase = pc
+		self.jumped = False
+		try:
+			self.pc = (pc + 1) & 0xFFFF
+			self.ops[code[0]](code[0])
+		finally:
+			self.fetchBuf = None
+		if not self.jumped:
+			self.pc = pc
+		return self.a
+
+	def step(self):
+		"""
+		Execute the instruction at PC and return the cycles it took
+		"""
+		op = self.chip.readCode(self.pc)
+		self.pc = (self.pc + 1) & 0xFFFF
+		return self.ops[op](op) or 1
+
+	def run(self, cycles):
+		"""
+		Run until halted or until the given number of cycles elapsed.
+		Returns the cycles executed. The cycles of the current run are
+		visible to the chip model in `elapsed`.
+		"""
+		self.elapsed = 0
+		while (self.elapsed < cycles) and not self.halted:
+			n = self.step()
+			self.elapsed += n
+		done, self.elapsed = self.elapsed, 0
+		return done
+
+	def imm(self):
+		v = self.fetch(self.pc)
+		self.pc = (self.pc + 1) & 0xFFFF
+		return v
+
+	def rel(self, off):
+		return (self.pc + (off - 256 if off > 127 else off)) & 0xFFFF
+
+	def jump(self, addr):
+		self.pc = addr & 0xFFFF
+		self.jumped = True
+
+	###############################################
+	# Instruction set
+	###############################################
+
+	def opInvalid(self, op):
+		raise IOError("Simulated 8051 hit unsupported opcode 0x%02x" % op)
+
+	def buildOpcodeTable(self):
+		"""
+		Populate the opcode dispatch table
+		"""
+		t = self.ops
+
+		# Helpers to resolve the second operand of arithmetic groups
+		# (op & 0x0F): 4=#data, 5=direct, 6/7=@Ri, 8..F=Rn
+		def src(op):
+			lo = op & 0x0F
+			if lo == 4:
+				return self.imm()
+			elif lo == 5:
+				return self.rd(self.imm())
+			elif lo < 8:
+				return self.iram[self.getR(lo & 1)]
+			return self.getR(lo - 8)
+
+		def add(op, carry=0):
+			a = self.a
+			v = src(op)
+			r = a + v + carry
+			self.setFlags(c=r > 0xFF, ac=((a & 0xF) + (v & 0xF) + carry) > 0xF,
+				ov=((a ^ r) & (v ^ r) & 0x80) != 0)
+			self.a = r
+			return 1
+
+		def subb(op):
+			a = self.a
+			v = src(op)
+			c = self.c
+			r = a - v - c
+			self.setFlags(c=r < 0, ac=((a & 0xF) - (v & 0xF) - c) < 0,
+				ov=((a ^ v) & (a ^ r) & 0x80) != 0)
+			self.a = r
+			return 1
+
+		def logic(fn):
+			def opA(op):
+				self.a = fn(self.a, src(op))
+				return 1
+			def opDirA(op):
+				d = self.imm()
+				self.wr(d, fn(self.rd(d), self.a))
+				return 2
+			def opDirImm(op):
+				d = self.imm()
+				self.wr(d, fn(self.rd(d), self.imm()))
+				return 3
+			return opA, opDirA, opDirImm
+
+		for base, fn in ((0x40, lambda a, b: a | b), (0x50, lambda a, b: a & b),
+				(0x60, lambda a, b: a ^ b)):
+			opA, opDirA, opDirImm = logic(fn)
+			t[base + 2] = opDirA
+			t[base + 3] = opDirImm
+			for lo in range(4, 16):
+				t[base + lo] = opA
+
+		for lo in range(4, 16):
+			t[0x20 + lo] = add
+			t[0x30 + lo] = lambda op: add(op, self.c)
+			t[0x90 + lo] = subb
+
+		# INC / DEC
+		def incdec(delta):
+			def op_(op):
+				lo = op & 0x0F
+				if lo == 4:
+					self.a = self.a + delta
+				elif lo == 5:
+					d = self.imm()
+					self.wr(d, self.rd(d) + delta)
+				elif lo < 8:
+					r = self.getR(lo & 1)
+					self.iram[r] = (self.iram[r] + delta) & 0xFF
+				else:
+					self.setR(lo - 8, self.getR(lo - 8) + delta)
+				return 1
+			return op_
+		for lo in range(4, 16):
+			t[0x00 + lo] = incdec(1)
+			t[0x10 + lo] = incdec(-1)
+
+		def incDPTR(op):
+			self.dptr = (self.dptr + 1) & 0xFFFF
+			return 1
+		t[0xA3] = incDPTR
+
+		# MOV A,src / MOV dst,A / MOV dst,#data
+		for lo in range(5, 16):
+			t[0xE0 + lo] = lambda op: setattr(self, 'a', src(op)) or 1
+		t[0x74] = lambda op: setattr(self, 'a', self.imm()) or 1
+
+		def movToA(op):
+			lo = op & 0x0F
+			if lo == 5:
+				self.wr(self.imm(), self.a)
+			elif lo < 8:
+				self.iram[self.getR(lo & 1)] = self.a
+			else:
+				self.setR(lo - 8, self.a)
+			return 1
+		for lo in range(5, 16):
+			t[0xF0 + lo] = movToA
+
+		def movImm(op):
+			lo = op & 0x0F
+			if lo == 5:
+				d = self.imm()
+				self.wr(d, self.imm())
+			elif lo < 8:
+				self.iram[self.getR(lo & 1)] = self.imm()
+			else:
+				self.setR(lo - 8, self.imm())
+			return 2
+		for lo in range(5, 16):
+			t[0x70 + lo] = movImm
+		t[0x75] = movImm
+
+		def movDirSrc(op):
+			lo = op & 0x0F
+			if lo == 5:
+				s = self.imm()
+				d = self.imm()
+				self.wr(d, self.rd(s))
+			else:
+				d = self.imm()
+				if lo < 8:
+					self.wr(d, self.iram[self.getR(lo & 1)])
+				else:
+					self.wr(d, self.getR(lo - 8))
+			return 2
+		for lo in range(5, 16):
+			t[0x80 + lo] = movDirSrc
+
+		def movToSrc(op):
+			lo = op & 0x0F
+			v = self.rd(self.imm())
+			if lo < 8:
+				self.iram[self.getR(lo & 1)] = v
+			else:
+				self.setR(lo - 8, v)
+			return 2
+		for lo in range(6, 16):
+			t[0xA0 + lo] = movToSrc
+
+		def movDPTR(op):
+			h = self.imm()
+			self.dptr = (h << 8) | self.imm()
+			return 2
+		t[0x90] = movDPTR
+
+		# MOVX / MOVC
+		def movxRead(op):
+			if op == 0xE0:
+				self.a = self.chip.readX(self.dptr)
+			else:
+				self.a = self.chip.readX((self.chip.sfr[SFR_MPAGE - 0x80] << 8) | self.getR(op & 1))
+			return 2
+		def movxWrite(op):
+			if op == 0xF0:
+				self.chip.writeX(self.dptr, self.a)
+			else:
+				self.chip.writeX((self.chip.sfr[SFR_MPAGE - 0x80] << 8) | self.getR(op & 1), self.a)
+			return 2
+		t[0xE0] = t[0xE2] = t[0xE3] = movxRead
+		t[0xF0] = t[0xF2] = t[0xF3] = movxWrite
+		t[0x93] = lambda op: setattr(self, 'a', self.chip.readCode((self.a + self.dptr) & 0xFFFF)) or 2
+		t[0x83] = lambda op: setattr(self, 'a', self.chip.readCode((self.a + self.pc) & 0xFFFF)) or 2
+
+		# Accumulator operations
+		def clrA(op):
+			self.a = 0
+			return 1
+		def cplA(op):
+			self.a = ~self.a
+			return 1
+		def rl(op):
+			a = self.a
+			self.a = (a << 1) | (a >> 7)
+			return 1
+		def rr(op):
+			a = self.a
+			self.a = (a >> 1) | ((a & 1) << 7)
+			return 1
+		def rlc(op):
+			a = self.a
+			c = self.c
+			self.c = a >> 7
+			self.a = (a << 1) | c
+			return 1
+		def rrc(op):
+			a = self.a
+			c = self.c
+			self.c = a & 1
+			self.a = (a >> 1) | (c << 7)
+			return 1
+		def swap(op):
+			a = self.a
+			self.a = ((a << 4) | (a >> 4)) & 0xFF
+			return 1
+		def mul(op):
+			r = self.a * self.rd(SFR_B)
+			self.a = r & 0xFF
+			self.wr(SFR_B, r >> 8)
+			self.setFlags(c=0, ov=r > 0xFF)
+			return 4
+		def div(op):
+			b = self.rd(SFR_B)
+			if b == 0:
+				self.setFlags(c=0, ov=1)
+			else:
+				a = self.a
+				self.a = a // b
+				self.wr(SFR_B, a % b)
+				self.setFlags(c=0, ov=0)
+			return 4
+		def da(op):
+			a = self.a
+			c = self.c
+			if ((a & 0x0F) > 9) or (self.chip.sfr[SFR_PSW - 0x80] & 0x40):
+				a += 6
+			if ((a >> 4) > 9) or c or (a > 0xFF):
+				a += 0x60
+			self.c = c or (a > 0xFF)
+			self.a = a
+			return 1
+		t[0xE4] = clrA
+		t[0xF4] = cplA
+		t[0x23] = rl
+		t[0x03] = rr
+		t[0x33] = rlc
+		t[0x13] = rrc
+		t[0xC4] = swap
+		t[0xA4] = mul
+		t[0x84] = div
+		t[0xD4] = da
+
+		# XCH / XCHD
+		def xch(op):
+			lo = op & 0x0F
+			a = self.a
+			if lo == 5:
+				d = self.imm()
+				self.a = self.rd(d)
+				self.wr(d, a)
+			elif lo < 8:
+				r = self.getR(lo & 1)
+				self.a = self.iram[r]
+				self.iram[r] = a
+			else:
+				self.a = self.getR(lo - 8)
+				self.setR(lo - 8, a)
+			return 1
+		for lo in range(5, 16):
+			t[0xC0 + lo] = xch
+		def xchd(op):
+			r = self.getR(op & 1)
+			a = self.a
+			m = self.iram[r]
+			self.a = (a & 0xF0) | (m & 0x0F)
+			self.iram[r] = (m & 0xF0) | (a & 0x0F)
+			return 1
+		t[0xD6] = t[0xD7] = xchd
+
+		# Stack
+		t[0xC0] = lambda op: self.push(self.rd(self.imm())) or 2
+		def pop(op):
+			d = self.imm()
+			self.wr(d, self.pop())
+			return 2
+		t[0xD0] = pop
+
+		# Bit operations
+		def setC(v):
+			def op_(op):
+				self.c = v
+				return 1
+			return op_
+		t[0xC3] = setC(0)
+		t[0xD3] = setC(1)
+		t[0xB3] = lambda op: setattr(self, 'c', 1 - self.c) or 1
+		t[0xC2] = lambda op: self.setBit(self.imm(), 0) or 1
+		t[0xD2] = lambda op: self.setBit(self.imm(), 1) or 1
+		def cplBit(op):
+			b = self.imm()
+			self.setBit(b, 1 - self.getBit(b))
+			return 1
+		t[0xB2] = cplBit
+		t[0xA2] = lambda op: setattr(self, 'c', self.getBit(self.imm())) or 1
+		t[0x92] = lambda op: self.setBit(self.imm(), self.c) or 2
+		t[0x82] = lambda op: setattr(self, 'c', self.c & self.getBit(self.imm())) or 2
+		t[0xB0] = lambda op: setattr(self, 'c', self.c & (1 - self.getBit(self.imm()))) or 2
+		t[0x72] = lambda op: setattr(self, 'c', self.c | self.getBit(self.imm())) or 2
+		t[0xA0] = lambda op: setattr(self, 'c', self.c | (1 - self.getBit(self.imm()))) or 2
+
+		# Jumps
+		def ajmp(op):
+			lo = self.imm()
+			self.jump((self.pc & 0xF800) | ((op & 0xE0) << 3) | lo)
+			return 2
+		def acall(op):
+			lo = self.imm()
+			self.push(self.pc & 0xFF)
+			self.push(self.pc >> 8)
+			self.jump((self.pc & 0xF800) | ((op & 0xE0) << 3) | lo)
+			return 2
+		for hi in range(0, 0x100, 0x20):
+			t[hi + 0x01] = ajmp
+			t[hi + 0x11] = acall
+		def ljmp(op):
+			h = self.imm()
+			self.jump((h << 8) | self.imm())
+			return 2
+		def lcall(op):
+			h = self.imm()
+			l = self.imm()
+			self.push(self.pc & 0xFF)
+			self.push(self.pc >> 8)
+			self.jump((h << 8) | l)
+			return 2
+		def ret(op):
+			h = self.pop()
+			self.jump((h << 8) | self.pop())
+			return 2
+		t[0x02] = ljmp
+		t[0x12] = lcall
+		t[0x22] = t[0x32] = ret
+		t[0x73] = lambda op: self.jump(self.a + self.dptr) or 2
+
+		def condJump(cond):
+			def op_(op):
+				off = self.imm()
+				if cond():
+					self.jump(self.rel(off))
+				return 2
+			return op_
+		t[0x80] = condJump(lambda: True)
+		t[0x60] = condJump(lambda: self.a == 0)
+		t[0x70] = condJump(lambda: self.a != 0)
+		t[0x40] = condJump(lambda: self.c == 1)
+		t[0x50] = condJump(lambda: self.c == 0)
+
+		def bitJump(op):
+			b = self.imm()
+			off = self.imm()
+			v = self.getBit(b)
+			if op == 0x20 and v:
+				self.jump(self.rel(off))
+			elif op == 0x30 and not v:
+				self.jump(self.rel(off))
+			elif op == 0x10 and v:
+				self.setBit(b, 0)
+				self.jump(self.rel(off))
+			return 2
+		t[0x10] = t[0x20] = t[0x30] = bitJump
+
+		def cjne(op):
+			lo = op & 0x0F
+			if lo == 4:
+				x, y = self.a, self.imm()
+			elif lo == 5:
+				x, y = self.a, self.rd(self.imm())
+			elif lo < 8:
+				x, y = self.iram[self.getR(lo & 1)], self.imm()
+			else:
+				x, y = self.getR(lo - 8), self.imm()
+			off = self.imm()
+			self.c = x < y
+			if x != y:
+				self.jump(self.rel(off))
+			return 2
+		for lo in range(4, 16):
+			t[0xB0 + lo] = cjne
+
+		def djnz(op):
+			lo = op & 0x0F
+			if lo == 5:
+				d = self.imm()
+				v = (self.rd(d) - 1) & 0xFF
+				self.wr(d, v)
+			else:
+				v = (self.getR(lo - 8) - 1) & 0xFF
+				self.setR(lo - 8, v)
+			off = self.imm()
+			if v != 0:
+				self.jump(self.rel(off))
+			return 2
+		t[0xD5] = djnz
+		for lo in range(8, 16):
+			t[0xD0 + lo] = djnz
+
+		# NOP and the debug breakpoint
+		t[0x00] = lambda op: 1
+		def breakpoint(op):
+			self.halted = True
+			self.jumped = True
+			return 1
+		t[0xA5] = breakpoint
+
+###############################################
+# CC2530 chip model
+###############################################
+
+# SFRs
+SFR_DMAIRQ  = 0xD1
+SFR_DMA1CFGL = 0xD2
+SFR_DMA1CFGH = 0xD3
+SFR_DMA0CFGL = 0xD4
+SFR_DMA0CFGH = 0xD5
+SFR_DMAARM  = 0xD6
+SFR_DMAREQ  = 0xD7
+SFR_MEMCTR  = 0xC7
+SFR_FMAP    = 0x9F
+
+# XDATA registers
+X_DBGDATA   = 0x6260
+X_FCTL      = 0x6270
+X_FADDRL    = 0x6271
+X_FADDRH    = 0x6272
+X_FWDATA    = 0x6273
+X_CHIPINFO0 = 0x6276
+X_CHIPINFO1 = 0x6277
+
+# DMA triggers
+DMA_TRIG_NONE  = 0x00
+DMA_TRIG_FLASH = 0x12
+DMA_TRIG_DBG_BW = 0x1F
+
+class DMAChannel:
+	"""
+	Armed DMA channel state (latched descriptor)
+	"""
+	def __init__(self, desc):
+		self.src = (desc[0] << 8) | desc[1]
+		self.dst = (desc[2] << 8) | desc[3]
+		self.len = ((desc[4] & 0x1F) << 8) | desc[5]
+		self.mode = (desc[6] >> 5) & 0x03
+		self.trigger = desc[6] & 0x1F
+		self.srcInc = (desc[7] >> 6) & 0x03
+		self.dstInc = (desc[7] >> 4) & 0x03
+		self.done = 0
+
+class CC2530Sim:
+	"""
+	CC2530 and CCLib_proxy model
+	"""
+
+	# Chip timings (from the CC2530 datasheet)
+	clockHz = 32000000
+	pageEraseTime = 0.020
+	chipEraseTime = 0.020
+	wordWriteTime = 0.000020
+
+	# Link timings (arduino + USB serial adapter)
+	baudrate = 115200
+	usbLatency = 0.001
+	frameTime = 0.000100
+	burstByteTime = 0.000010
+
+	def __init__(self, flashSize=256*1024, chipID=0xA524, ieee=b"\x01\x02\x03\x04\x05\x06\x4b\x12"):
+		"""
+		Create a simulated chip with erased flash
+		"""
+		self.chipID = chipID
+		self.flashSize = flashSize
+		self.flash = bytearray(b"\xff" * flashSize)
+		self.sram = bytearray(8 * 1024)
+		self.infoPage = bytearray(b"\xff" * 2048)
+		self.infoPage[0x0E:0x0E+len(ieee)] = ieee
+		self.sfr = bytearray(128)
+		self.sfr[SFR_SP - 0x80] = 0x07
+		self.cpu = C8051(self)
+
+		# Peripheral state
+		self.fctl = 0
+		self.faddr = 0
+		self.fwdata = bytearray()
+		self.flashWriteAddr = 0
+		self.busyUntil = 0.0
+		self.chipEraseUntil = 0.0
+		self.dbgdata = 0
+		self.dma = [ None ] * 5
+		self.events = []
+
+		# Debug interface state
+		self.debugConfig = 0x22
+		self.instructionTableVersion = 0
+
+		# Clock and statistics
+		self.now = 0.0
+		self.frames = collections.Counter()
+		self.cycles = 0
+
+	###############################################
+	# Time
+	###############################################
+
+	def advance(self, t):
+		"""
+		Move the chip clock forward, running the CPU and completing
+		pending flash operations
+		"""
+		if t <= self.now:
+			return
+		while True:
+			# Next event due before t
+			pending = [ e for e in self.events if e[0] <= t ]
+			until = min([ e[0] for e in pending ] + [ t ])
+
+			# Run the CPU meanwhile
+			if not self.cpu.halted:
+				self.cycles += self.cpu.run(int((until - self.now) * self.clockHz) + 1)
+			self.now = max(self.now, until)
+
+			# Fire events
+			if not pending:
+				break
+			ev = min(pending, key=lambda e: e[0])
+			self.events.remove(ev)
+			ev[1]()
+
+	def schedule(self, delay, fn):
+		self.events.append((self.now + delay, fn))
+
+	###############################################
+	# Memory map
+	###############################################
+
+	def readSFR(self, addr):
+		return self.sfr[addr - 0x80]
+
+	def writeSFR(self, addr, v):
+		if addr == SFR_DMAARM:
+			old = self.sfr[addr - 0x80]
+			if v & 0x80:
+				# Abort the selected channels
+				for i in range(0, 5):
+					if v & (1 << i):
+						self.dma[i] = None
+				v = old & ~(v & 0x1F)
+			else:
+				for i in range(0, 5):
+					if (v & (1 << i)) and not (old & (1 << i)):
+						self.dma[i] = DMAChannel(self.dmaDescriptor(i))
+					elif not (v & (1 << i)):
+						self.dma[i] = None
+			self.sfr[addr - 0x80] = v & 0x1F
+		elif addr == SFR_DMAIRQ:
+			# Bits can only be cleared by software
+			self.sfr[addr - 0x80] &= v
+		elif addr == SFR_DMAREQ:
+			for i in range(0, 5):
+				if v & (1 << i):
+					self.dmaTrigger(i)
+		else:
+			self.sfr[addr - 0x80] = v
+
+	def readX(self, addr):
+		if addr < len(self.sram):
+			return self.sram[addr]
+		elif addr == X_FCTL:
+			v = self.fctl
+			if self.busyUntil > self.now:
+				v |= 0x80
+			return v
+		elif addr == X_FADDRL:
+			return self.faddr & 0xFF
+		elif addr == X_FADDRH:
+			return (self.faddr >> 8) & 0xFF
+		elif addr == X_DBGDATA:
+			return self.dbgdata
+		elif addr == X_CHIPINFO0:
+			n = 0
+			while (16 << n) < (self.flashSize // 1024):
+				n += 1
+			return (n << 4)
+		elif addr == X_CHIPINFO1:
+			return (len(self.sram) // 1024) - 1
+		elif 0x7080 <= addr < 0x7100:
+			return self.cpu.rd(addr - 0x7000)
+		elif 0x7800 <= addr < 0x8000:
+			return self.infoPage[addr - 0x7800]
+		elif addr >= 0x8000:
+			bank = self.sfr[SFR_MEMCTR - 0x80] & 0x07
+			ofs = bank * 0x8000 + addr - 0x8000
+			return self.flash[ofs] if ofs < self.flashSize else 0xFF
+		return 0
+
+	def writeX(self, addr, v):
+		if addr < len(self.sram):
+			self.sram[addr] = v
+		elif addr == X_FCTL:
+			self.writeFCTL(v)
+		elif addr == X_FADDRL:
+			self.faddr = (self.faddr & 0xFF00) | v
+		elif addr == X_FADDRH:
+			self.faddr = (self.faddr & 0x00FF) | (v << 8)
+		elif addr == X_FWDATA:
+			self.writeFWDATA(v)
+		elif addr == X_DBGDATA:
+			self.dbgdata = v
+		elif 0x7080 <= addr < 0x7100:
+			self.cpu.wr(addr - 0x7000, v)
+
+	def readCode(self, addr):
+		if addr < 0x8000:
+			return self.flash[addr]
+		if self.sfr[SFR_MEMCTR - 0x80] & 0x08:
+			ofs = addr - 0x8000
+			return self.sram[ofs] if ofs < len(self.sram) else 0xFF
+		ofs = (self.sfr[SFR_FMAP - 0x80] & 0x07) * 0x8000 + addr - 0x8000
+		return self.flash[ofs] if ofs < self.flashSize else 0xFF
+
+	###############################################
+	# Flash controller
+	###############################################
+
+	def writeFCTL(self, v):
+		"""
+		Handle a write to the flash control register
+		"""
+		self.fctl = v & 0x0C
+		if self.busyUntil > self.now:
+			return
+
+		# Page erase
+		if v & 0x01:
+			page = (self.faddr >> 9) & 0x7F
+			ofs = page * 0x800
+			self.flash[ofs:ofs+0x800] = b"\xff" * 0x800
+			self.fctl |= 0x01
+			self.busyUntil = self.now + self.pageEraseTime
+			self.schedule(self.pageEraseTime, self.flashDone)
+
+		# Flash write, fed by the DMA channels using the FLASH trigger
+		elif v & 0x02:
+			self.fctl |= 0x02
+			self.flashWriteAddr = self.faddr * 4
+			self.fwdata = bytearray()
+			for i in range(0, 5):
+				ch = self.dma[i]
+				if ch is not None and ch.trigger == DMA_TRIG_FLASH:
+					words = (ch.len - ch.done + 3) // 4
+					while self.dma[i] is not None:
+						self.dmaTrigger(i, complete=False)
+					delay = words * self.wordWriteTime
+					self.busyUntil = self.now + delay
+					self.schedule(delay, lambda i=i: self.flashWriteDone(i))
+
+	def writeFWDATA(self, v):
+		"""
+		Collect a flash word and program it
+		"""
+		if not (self.fctl & 0x02):
+			return
+		self.fwdata.append(v)
+		if len(self.fwdata) == 4:
+			a = self.flashWriteAddr
+			if a + 4 <= self.flashSize:
+				for i in range(0, 4):
+					self.flash[a+i] &= self.fwdata[i]
+			self.flashWriteAddr += 4
+			self.fwdata = bytearray()
+
+	def flashDone(self):
+		self.fctl &= ~0x03
+
+	def flashWriteDone(self, channel):
+		self.fctl &= ~0x03
+		self.sfr[SFR_DMAIRQ - 0x80] |= (1 << channel)
+
+	###############################################
+	# DMA controller
+	###############################################
+
+	def dmaDescriptor(self, index):
+		if index == 0:
+			addr = (self.sfr[SFR_DMA0CFGH - 0x80] << 8) | self.sfr[SFR_DMA0CFGL - 0x80]
+		else:
+			addr = (self.sfr[SFR_DMA1CFGH - 0x80] << 8) | self.sfr[SFR_DMA1CFGL - 0x80]
+			addr += (index - 1) * 8
+		return [ self.readX(addr + i) for i in range(0, 8) ]
+
+	def dmaTrigger(self, index, complete=True):
+		"""
+		Perform the transfer(s) of a triggered channel
+		"""
+		ch = self.dma[index]
+		if ch is None:
+			return
+
+		# DMA is paused while the CPU is halted, if DMA_PAUSE is set
+		if self.cpu.halted and (self.debugConfig & 0x04):
+			return
+		count = ch.len if ch.mode in (1, 3) else 1
+		for i in range(0, min(count, ch.len - ch.done)):
+			self.writeX(ch.dst, self.readX(ch.src))
+			ch.src = (ch.src + (0, 1, 2, -1)[ch.srcInc]) & 0xFFFF
+			ch.dst = (ch.dst + (0, 1, 2, -1)[ch.dstInc]) & 0xFFFF
+			ch.done += 1
+
+		# Channel finished
+		if ch.done >= ch.len:
+			self.dma[index] = None
+			self.sfr[SFR_DMAARM - 0x80] &= ~(1 << index)
+			if complete:
+				self.sfr[SFR_DMAIRQ - 0x80] |= (1 << index)
+
+	def debugWrite(self, v):
+		"""
+		Handle a byte written to DBGDATA by a burst write
+		"""
+		self.dbgdata = v
+		for i in range(0, 5):
+			ch = self.dma[i]
+			if ch is not None and ch.trigger == DMA_TRIG_DBG_BW:
+				self.dmaTrigger(i)
+
+	###############################################
+	# Debug interface
+	###############################################
+
+	def status(self):
+		s = 0x02
+		if self.chipEraseUntil > self.now:
+			s |= 0x80
+		if self.cpu.halted:
+			s |= 0x20
+		return s
+
+	def command(self, cmd, c1, c2, c3):
+		"""
+		Execute a CCLib_proxy command frame and return the response frame
+		"""
+		self.frames[cmd] += 1
+		if cmd == CMD_PING:
+			return (ANS_OK, 0, 0)
+		elif cmd == CMD_ENTER:
+			self.cpu.halted = True
+			return (ANS_OK, 0, 0)
+		elif cmd == CMD_EXIT:
+			self.cpu.halted = False
+			return (ANS_OK, 0, self.status())
+		elif cmd == CMD_CHIP_ID:
+			return (ANS_OK, self.chipID >> 8, self.chipID & 0xFF)
+		elif cmd == CMD_STATUS:
+			return (ANS_OK, 0, self.status())
+		elif cmd == CMD_PC:
+			return (ANS_OK, self.cpu.pc >> 8, self.cpu.pc & 0xFF)
+		elif cmd == CMD_RD_CFG:
+			return (ANS_OK, 0, self.debugConfig)
+		elif cmd == CMD_WR_CFG:
+			self.debugConfig = c1
+			return (ANS_OK, 0, self.status())
+		elif cmd == CMD_HALT:
+			self.cpu.halted = True
+			return (ANS_OK, 0, self.status())
+		elif cmd == CMD_RESUME:
+			self.cpu.halted = False
+			return (ANS_OK, 0, self.status())
+		elif cmd == CMD_CHPERASE:
+			self.flash[:] = b"\xff" * self.flashSize
+			self.chipEraseUntil = self.now + self.chipEraseTime
+			return (ANS_OK, 0, self.status())
+		elif cmd == CMD_INSTR_VER:
+			return (ANS_OK, 0, self.instructionTableVersion)
+		elif cmd in (CMD_EXEC_1, CMD_EXEC_2, CMD_EXEC_3, CMD_STEP):
+			if not self.cpu.halted:
+				return (ANS_ERROR, 0, 0x02)
+			if cmd == CMD_STEP:
+				self.cpu.step()
+				a = self.cpu.a
+			else:
+				a = self.cpu.debugInstr([c1, c2, c3][0:cmd - CMD_EXEC_1 + 1])
+			return (ANS_OK, 0, a)
+		return (ANS_ERROR, 0, 0xFF)
+
+###############################################
+# CC2510 chip model
+###############################################
+
+# CC251x flash controller SFRs
+SFR_FADDRL = 0xAC
+SFR_FADDRH = 0xAD
+SFR_FLC    = 0xAE
+SFR_FWDATA = 0xAF
+
+class CC2510Sim(CC2530Sim):
+	"""
+	CC2510 (CC251x) model. Flash is mapped at CODE 0x0000 and SRAM at
+	0xF000 in both XDATA and CODE. The flash controller has no DMA trigger
+	for the debugger, it is fed by the CPU through the FLC, FADDRH:FADDRL
+	and FWDATA SFRs, so flash routines really run on the simulated core.
+	"""
+
+	# Chip timings (from the CC2510 datasheet)
+	clockHz = 26000000
+	pageEraseTime = 0.020
+	chipEraseTime = 0.020
+	wordWriteTime = 0.000020
+
+	# Memory layout
+	pageSize = 0x400
+	wordSize = 2
+	sramBase = 0xF000
+
+	def __init__(self, flashSize=16*1024, sramSize=2*1024, chipID=0x8104):
+		"""
+		Create a simulated chip with erased flash
+		"""
+		CC2530Sim.__init__(self, flashSize=flashSize, chipID=chipID)
+		self.sram = bytearray(sramSize)
+
+	def clock(self):
+		"""
+		Return the chip time, including the cycles of the running CPU
+		"""
+		return self.now + float(self.cpu.elapsed) / self.clockHz
+
+	###############################################
+	# Memory map
+	###############################################
+
+	def readSFR(self, addr):
+		if addr == SFR_FLC:
+			v = self.fctl
+			t = self.clock()
+			if self.busyUntil > t:
+				v |= 0xC0
+
+				# A running CPU spins on FLC until the flash is done, skip
+				# ahead instead of simulating the loop
+				if not self.cpu.halted:
+					self.cpu.elapsed += int((self.busyUntil - t) * self.clockHz) + 1
+			return v
+		return CC2530Sim.readSFR(self, addr)
+
+	def writeSFR(self, addr, v):
+		if addr == SFR_FLC:
+			self.writeFLC(v)
+		elif addr == SFR_FWDATA:
+			self.writeFWDATA(v)
+		else:
+			CC2530Sim.writeSFR(self, addr, v)
+
+	def readX(self, addr):
+		ofs = addr - self.sramBase
+		if 0 <= ofs < len(self.sram):
+			return self.sram[ofs]
+		return 0
+
+	def writeX(self, addr, v):
+		ofs = addr - self.sramBase
+		if 0 <= ofs < len(self.sram):
+			self.sram[ofs] = v
+
+	def readCode(self, addr):
+		if addr < self.flashSize:
+			return self.flash[addr]
+		return self.readX(addr)
+
+	###############################################
+	# Flash controller
+	###############################################
+
+	def writeFLC(self, v):
+		"""
+		Handle a write to the flash control register
+		"""
+		if self.busyUntil > self.clock():
+			return
+		faddr = (self.sfr[SFR_FADDRH - 0x80] << 8) | self.sfr[SFR_FADDRL - 0x80]
+
+		# Page erase
+		if v & 0x01:
+			ofs = (faddr * self.wordSize) & ~(self.pageSize - 1)
+			self.flash[ofs:ofs+self.pageSize] = b"\xff" * self.pageSize
+			self.busyUntil = self.clock() + self.pageEraseTime
+			self.fctl = 0
+
+		# Flash write, fed word by word through FWDATA
+		elif v & 0x02:
+			self.fctl = 0x02
+			self.flashWriteAddr = faddr * self.wordSize
+			self.fwdata = bytearray()
+
+	def writeFWDATA(self, v):
+		"""
+		Collect a flash word and program it. The write ends at the end of
+		the page.
+		"""
+		if not (self.fctl & 0x02):
+			return
+		self.fwdata.append(v)
+		if len(self.fwdata) == self.wordSize:
+			a = self.flashWriteAddr
+			if a + self.wordSize <= self.flashSize:
+				for i in range(0, self.wordSize):
+					self.flash[a+i] &= self.fwdata[i]
+			self.flashWriteAddr += self.wordSize
+			self.fwdata = bytearray()
+			self.busyUntil = self.clock() + self.wordWriteTime
+			if (self.flashWriteAddr % self.pageSize) == 0:
+				self.fctl &= ~0x02
+
+class SimTransport:
+	"""
+	In-memory transport to a simulated CCLib_proxy, with a pyserial-like API.
+
+	Host writes are processed immediately, and the virtual time at which each
+	response byte would become readable is computed from the link model.
+	"""
+
+	def __init__(self, sim, name="sim", timeout=3.0, realtime=False):
+		self.sim = sim
+		self.name = name
+		self.timeout = timeout
+		self.realtime = realtime
+		self.rx = collections.deque()
+		self.inbuf = bytearray()
+		self.txFree = sim.now
+		self.devFree = sim.now
+		self.rxFree = sim.now
+		self.burstLeft = 0
+		self.burstData = None
+		self.tableLeft = 0
+		self.tableData = None
+		self.realMark = time.time()
+
+	def sync(self):
+		"""
+		Account for the time spent on the host since the last call
+		"""
+		t = time.time()
+		self.sim.advance(self.sim.now + (t - self.realMark))
+		self.realMark = t
+
+	def done(self, until):
+		"""
+		Finish a call, optionally sleeping to follow the virtual clock
+		"""
+		if self.realtime:
+			ahead = until - self.sim.now
+			if ahead > 0:
+				time.sleep(ahead)
+		self.sim.advance(until)
+		self.realMark = time.time()
+
+	def respond(self, t, frame):
+		"""
+		Queue a response frame, ready at the given device time
+		"""
+		byteTime = 10.0 / self.sim.baudrate
+		for b in frame:
+			self.rxFree = max(self.rxFree, t) + byteTime
+			self.rx.append((b & 0xFF, self.rxFree + self.sim.usbLatency))
+
+	def write(self, data):
+		self.sync()
+		sim = self.sim
+		byteTime = 10.0 / sim.baudrate
+
+		# Bytes arrive one after the other, after the USB latency
+		start = max(sim.now, self.txFree) + sim.usbLatency
+		for i, b in enumerate(bytearray(data)):
+			arrival = start + (i + 1) * byteTime
+			self.txFree = arrival - sim.usbLatency
+
+			# Burst write payload
+			if self.burstLeft:
+				self.devFree = max(self.devFree, arrival) + sim.burstByteTime
+				sim.advance(self.devFree)
+				sim.debugWrite(b)
+				self.burstLeft -= 1
+				if self.burstLeft == 0:
+					self.respond(self.devFree, (ANS_OK, 0, sim.status()))
+				continue
+
+			# Instruction table payload
+			if self.tableLeft:
+				self.tableData.append(b)
+				self.tableLeft -= 1
+				if self.tableLeft == 0:
+					sim.instructionTableVersion = self.tableData[0]
+					self.respond(arrival, (ANS_OK, 0, sim.instructionTableVersion))
+				continue
+
+			# Command frames
+			self.inbuf.append(b)
+			if len(self.inbuf) < 4:
+				continue
+			cmd, c1, c2, c3 = self.inbuf
+			self.inbuf = bytearray()
+			self.devFree = max(self.devFree, arrival) + sim.frameTime
+			sim.advance(self.devFree)
+			if cmd == CMD_BRUSTWR:
+				sim.frames[cmd] += 1
+				self.burstLeft = (c1 << 8) | c2
+				self.respond(self.devFree, (ANS_READY, 0, 0))
+			elif cmd == CMD_INSTR_UPD:
+				sim.frames[cmd] += 1
+				self.tableLeft = 16
+				self.tableData = bytearray()
+				self.respond(self.devFree, (ANS_READY, 0, 0))
+			else:
+				self.respond(self.devFree, sim.command(cmd, c1, c2, c3))
+
+		self.realMark = time.time()
+		return len(data)
+
+	def flush(self):
+		pass
+
+	def read(self, size=1):
+		self.sync()
+		ans = bytearray()
+		until = self.sim.now
+		while self.rx and len(ans) < size:
+			b, t = self.rx.popleft()
+			ans.append(b)
+			until = max(until, t)
+		if len(ans) < size:
+			until = self.sim.now + self.timeout
+		self.done(until)
+		return bytes(ans)
+
+	def flushInput(self):
+		self.rx.clear()
+
+	def flushOutput(self):
+		pass
+
+	reset_input_buffer = flushInput
+	reset_output_buffer = flushOutput
+
+	def close(self):
+		pass
+
+###############################################
+# sim:// transport
+###############################################
+
+SIMULATORS = {}
+
+def registerSimulator(name, sim):
+	"""
+	Make a simulator reachable as sim://<name>
+	"""
+	SIMULATORS[name] = sim
+	return sim
+
+def openSimTransport(url, baudrate=115200, timeout=3.0):
+	"""
+	Transport factory for sim://<name> URLs. Unknown names get a new
+	CC2530 simulator.
+	"""
+	name = url.split("://", 1)[-1]
+	if name not in SIMULATORS:
+		registerSimulator(name, CC2530Sim())
+	return SimTransport(SIMULATORS[name], name=url, timeout=timeout)
+
+registerTransport('sim', openSimTransport)
+
+###############################################
+# Benchmark
+###############################################
+
+def benchmark(size=32*1024, verify=True, chip=CC2530Sim, padding=False, **kwargs):
+	"""
+	Measure a chip erase and writeCODE of a pseudo-random image on a
+	simulated chip, in estimated hardware time. With padding=True the image
+	alternates random data and runs of zeros, like a real firmware. Extra
+	arguments are passed to writeCODE.
+	"""
+	import random
+	from z2mflasher.cclib.ccdebugger import openCCDebugger
+
+	sim = registerSimulator('benchmark', chip())
+	dbg = openCCDebugger('sim://benchmark')
+	rnd = random.Random(0)
+	data = bytearray([ rnd.randint(0, 255) for i in range(0, size) ])
+	if padding:
+		for i in range(0, size, 1024):
+			data[i:i+512] = bytearray(len(data[i:i+512]))
+	data = bytes(data)
+
+	# Erase and flash
+	start = sim.now
+	dbg.chipErase()
+	dbg.pauseDMA(False)
+	dbg.writeCODE(0, data, verify=verify, **kwargs)
+	elapsed = sim.now - start
+
+	# Check result
+	if bytes(sim.flash[0:size]) != data:
+		raise IOError("Simulated flash contents do not match the image!")
+
+	print("\nFlashed %i bytes in %0.2f s (estimated), %0.1f KB/s" % (size, elapsed, size / elapsed / 1024))
+	print("Frames: %i (%s)" % (sum(sim.frames.values()),
+		", ".join("0x%02x: %i" % (k, v) for k, v in sorted(sim.frames.items()))))
+	return elapsed
+
+if __name__ == "__main__":
+	import sys
+	if "cc2510" in sys.argv[1:]:
+		benchmark(size=16*1024, chip=CC2510Sim)
+	elif "loader" in sys.argv[1:]:
+		benchmark(loader=True)
+	elif "compress" in sys.argv[1:]:
+		benchmark(padding=True, verify='crc', compress=True)
+	else:
+		benchmark()
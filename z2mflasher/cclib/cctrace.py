@@ -0,0 +1,188 @@
+#
+# CCLib_proxy Interface Library for High-Level operations
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Opt-in instrumentation of the CCLib_proxy frame layer.
+
+When enabled (CC_TRACE environment variable or enableTracing()), every
+proxy records the round trips it performs, the frames sent per command,
+the bytes transferred and the time spent sleeping while polling the chip.
+The summary tells whether an operation is link-bound (round trips),
+poll-bound (sleeps) or chip-bound (status polls that keep coming back busy).
+
+CC_TRACE can be set to a file name, where the trace is saved as JSON at
+exit, or to 1 for the summary only.
+"""
+from __future__ import print_function
+import atexit
+import json
+import os
+import sys
+import time
+
+# Upper bounds (in seconds) of the round-trip latency histogram buckets
+LATENCY_BUCKETS = [ 0.00025, 0.0005, 0.001, 0.002, 0.004, 0.008, 0.016, 0.032, 0.064, 0.128, 0.256 ]
+
+# Names of the CMD_* constants, populated on first use
+COMMAND_NAMES = {}
+
+def commandName(cmd):
+	"""
+	Return the name of a CMD_* constant
+	"""
+	if not COMMAND_NAMES:
+		from z2mflasher.cclib import ccproxy
+		for k in dir(ccproxy):
+			if k.startswith("CMD_"):
+				COMMAND_NAMES[getattr(ccproxy, k)] = k[4:]
+	return COMMAND_NAMES.get(cmd, "0x%02x" % cmd)
+
+class CCTracer:
+	"""
+	Collects frame-level statistics
+	"""
+
+	def __init__(self):
+		self.start = time.time()
+		self.commands = {}
+		self.roundTrips = 0
+		self.bytesOut = 0
+		self.bytesIn = 0
+		self.linkTime = 0.0
+		self.sleeps = 0
+		self.sleepTime = 0.0
+		self.histogram = [ 0 ] * (len(LATENCY_BUCKETS) + 1)
+
+	def roundTrip(self, cmds, bytesOut, bytesIn, elapsed, payload=False):
+		"""
+		Record a write/read round trip carrying the given command frames. For
+		payloads (ex. brust-write data) no frames are counted, the bytes and
+		time are accounted to the given command.
+		"""
+		self.roundTrips += 1
+		self.bytesOut += bytesOut
+		self.bytesIn += bytesIn
+		self.linkTime += elapsed
+
+		# Update histogram
+		i = 0
+		while (i < len(LATENCY_BUCKETS)) and (elapsed > LATENCY_BUCKETS[i]):
+			i += 1
+		self.histogram[i] += 1
+
+		# Split time and bytes among the commands of the round trip
+		for cmd in cmds:
+			name = commandName(cmd)
+			if name not in self.commands:
+				self.commands[name] = { 'frames': 0, 'payloadBytes': 0, 'time': 0.0 }
+			st = self.commands[name]
+			if payload:
+				st['payloadBytes'] += bytesOut
+			else:
+				st['frames'] += 1
+			st['time'] += elapsed / len(cmds)
+
+	def sleep(self, seconds):
+		"""
+		Record a host-side sleep while polling
+		"""
+		self.sleeps += 1
+		self.sleepTime += seconds
+
+	def toDict(self):
+		"""
+		Return the trace as a JSON-serializable dict
+		"""
+		return {
+			'elapsed': time.time() - self.start,
+			'roundTrips': self.roundTrips,
+			'frames': sum([ c['frames'] for c in self.commands.values() ]),
+			'bytesOut': self.bytesOut,
+			'bytesIn': self.bytesIn,
+			'linkTime': self.linkTime,
+			'sleeps': self.sleeps,
+			'sleepTime': self.sleepTime,
+			'latencyHistogram': [
+				{ 'le': b, 'count': c } for b, c in zip(LATENCY_BUCKETS + [ None ], self.histogram)
+			],
+			'commands': self.commands,
+		}
+
+	def save(self, path):
+		"""
+		Save the trace as JSON
+		"""
+		with open(path, "w") as f:
+			json.dump(self.toDict(), f, indent=2, sort_keys=True)
+
+	def summary(self, out=sys.stderr):
+		"""
+		Print a human-readable summary
+		"""
+		d = self.toDict()
+		other = max(0.0, d['elapsed'] - d['linkTime'] - d['sleepTime'])
+		print("\nCCLib trace summary (%0.2f s)" % d['elapsed'], file=out)
+		print("       Link : %0.2f s in %i round trips, %i frames, %i B out / %i B in" % (
+			d['linkTime'], d['roundTrips'], d['frames'], d['bytesOut'], d['bytesIn']), file=out)
+		print("    Polling : %0.2f s in %i sleeps" % (d['sleepTime'], d['sleeps']), file=out)
+		print("      Other : %0.2f s" % other, file=out)
+
+		# Latency histogram
+		print("\n Round-trip latency:", file=out)
+		top = max(self.histogram + [ 1 ])
+		for b, c in zip(LATENCY_BUCKETS + [ None ], self.histogram):
+			label = ("<= %6.2f ms" % (b * 1000)) if b is not None else "    > %3i ms" % (LATENCY_BUCKETS[-1] * 1000)
+			print("  %s : %7i %s" % (label, c, "#" * int(40 * c / top)), file=out)
+
+		# Commands
+		print("\n Command       Frames  Payload      Time", file=out)
+		for name, st in sorted(self.commands.items(), key=lambda x: -x[1]['time']):
+			print("  %-10s %8i %8i %8.2f s" % (name, st['frames'], st['payloadBytes'], st['time']), file=out)
+		print("", file=out)
+
+# The tracer used by new proxies, if tracing is enabled
+TRACER = None
+
+def enableTracing(path=None, summary=True):
+	"""
+	Enable tracing for all the proxies opened from now on. The trace is
+	saved as JSON in the given path and/or summarized when the program exits.
+	"""
+	global TRACER
+	if TRACER is not None:
+		return TRACER
+	TRACER = CCTracer()
+
+	def onExit():
+		if path:
+			TRACER.save(path)
+		if summary:
+			TRACER.summary()
+	atexit.register(onExit)
+	return TRACER
+
+def getTracer():
+	"""
+	Return the active tracer, enabling it from the CC_TRACE environment
+	variable if needed
+	"""
+	if TRACER is None:
+		value = os.environ.get("CC_TRACE", "")
+		if value.lower() in ("1", "yes", "true"):
+			enableTracing()
+		elif value and value.lower() not in ("0", "no", "false"):
+			enableTracing(value)
+	return TRACER
@@ -0,0 +1,165 @@
+#
+# CCLib_proxy Interface Library for High-Level operations
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+from __future__ import print_function
+import importlib
+import socket
+import time
+import serial
+
+# Transport classes for the URL schemes we handle ourselves
+TRANSPORTS = {}
+
+# Modules registering additional transports, imported on first use
+TRANSPORT_MODULES = {
+	'sim': 'z2mflasher.cclib.ccsim',
+}
+
+def registerTransport(scheme, cls):
+	"""
+	Register a transport class for the given URL scheme (ex. 'socket')
+	"""
+	TRANSPORTS[scheme.lower()] = cls
+	return cls
+
+def isURL(port):
+	"""
+	Check if the given port is a URL rather than a local serial port
+	"""
+	return "://" in port
+
+def openSerial(port, noReset=False, **kwargs):
+	"""
+	Open a local serial port. With noReset, DTR and RTS are kept low while
+	opening, so adapters wired for the arduino auto-reset don't reboot.
+	"""
+	ser = serial.Serial(None, **kwargs)
+	ser.port = port
+	if noReset:
+		ser.dtr = False
+		ser.rts = False
+	ser.open()
+	return ser
+
+def openTransport(port, baudrate=115200, timeout=3.0, noReset=False):
+	"""
+	Open the transport for the given port. This can be a local serial port,
+	a URL handled by a registered transport or any URL pyserial understands.
+	"""
+
+	# Local serial port
+	if not isURL(port):
+		return openSerial(port, noReset=noReset, baudrate=baudrate, timeout=timeout, write_timeout=timeout)
+
+	# Registered transports
+	scheme = port.split("://", 1)[0].lower()
+	if (scheme not in TRANSPORTS) and (scheme in TRANSPORT_MODULES):
+		importlib.import_module(TRANSPORT_MODULES[scheme])
+	if scheme in TRANSPORTS:
+		return TRANSPORTS[scheme](port, baudrate=baudrate, timeout=timeout)
+
+	# Let pyserial handle the rest (rfc2217://, loop://, ...)
+	return serial.serial_for_url(port, baudrate=baudrate, timeout=timeout)
+
+class SocketTransport:
+	"""
+	Raw TCP transport for reaching a CCLib_proxy through a serial-to-TCP
+	bridge, like the one running on the z2m module (socket://host:port).
+
+	It mimics the subset of the pyserial API used by CCLibProxy. Nagle's
+	algorithm is disabled, since the debug protocol is made of tiny frames.
+	"""
+
+	def __init__(self, url, baudrate=115200, timeout=3.0):
+		"""
+		Connect to the host:port given in the socket:// URL
+		"""
+
+		# Parse URL
+		address = url.split("://", 1)[-1].split("/", 1)[0]
+		host, sep, port = address.rpartition(":")
+		if not sep or not port.isdigit():
+			raise IOError("Invalid socket URL '%s', expected socket://<host>:<port>" % url)
+
+		# Connect
+		self.name = url
+		self.timeout = timeout
+		self.baudrate = baudrate
+		self.sock = socket.create_connection((host.strip("[]"), int(port)), timeout)
+		self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+	def close(self):
+		self.sock.close()
+
+	def write(self, data):
+		"""
+		Send all the given bytes
+		"""
+		self.sock.sendall(bytes(data))
+		return len(data)
+
+	def flush(self):
+		"""
+		Nothing to do, sendall() returns when data are handed to the kernel
+		"""
+		pass
+
+	def read(self, size=1):
+		"""
+		Read up to size bytes, blocking until they arrive or the timeout expires
+		"""
+		ans = bytearray()
+		deadline = time.time() + self.timeout
+		while len(ans) < size:
+
+			# Check for timeout
+			left = deadline - time.time()
+			if left <= 0:
+				break
+
+			# Receive
+			self.sock.settimeout(left)
+			try:
+				b = self.sock.recv(size - len(ans))
+			except socket.timeout:
+				break
+			if not b:
+				raise IOError("Connection to %s closed by the remote end" % self.name)
+			ans += b
+
+		# Return data
+		return bytes(ans)
+
+	def flushInput(self):
+		"""
+		Discard any pending input
+		"""
+		self.sock.setblocking(False)
+		try:
+			while self.sock.recv(4096):
+				pass
+		except (socket.error, BlockingIOError):
+			pass
+		finally:
+			self.sock.setblocking(True)
+
+	def flushOutput(self):
+		pass
+
+	reset_input_buffer = flushInput
+	reset_output_buffer = flushOutput
+
+registerTransport('socket', SocketTransport)
@@ -16,7 +16,58 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+from __future__ import print_function
 from z2mflasher.cclib.ccproxy import CCLibProxy
+from z2mflasher.cclib.ccroutines import crc16
+from z2mflasher.cclib.cchex import CCHEXWriter, fileFormat
+from z2mflasher.progress import ProgressTracker
+import json
+import os
+import random
+import time
+
+# Verification policies of writeCODE (see parseVerify)
+VERIFY_MODES = ( 'off', 'crc', 'sample', 'full', 'deferred' )
+
+# Pages checked by the 'sample' policy, unless given as 'sample:N'
+VERIFY_SAMPLES = 4
+
+def parseVerify(verify):
+	"""
+	Normalize a writeCODE verify argument to a (mode, samples) tuple:
+
+	- 'off' (or False/None): no verification
+	- 'crc': checksum of every chunk, computed on the chip
+	- 'sample' or 'sample:N': read back N random pages after programming
+	- 'full' (or True): read back every chunk
+	- 'deferred': verify the whole image once after programming
+	"""
+	if (verify is None) or (verify is False):
+		return ('off', 0)
+	if verify is True:
+		return ('full', 0)
+	mode, _, n = str(verify).partition(':')
+	if (mode not in VERIFY_MODES) or (n and (mode != 'sample' or not n.isdigit())):
+		raise ValueError("Unknown verification policy '%s'" % verify)
+	return (mode, int(n) if n else VERIFY_SAMPLES)
+
+class CCVerifyError(IOError):
+	"""
+	Flash verification error, with the CODE offset of the first mismatch
+	"""
+
+	def __init__(self, offset):
+		IOError.__init__(self, "Flash verification error on offset 0x%04x" % offset)
+		self.offset = offset
+
+class CCFlashLockedError(IOError):
+	"""
+	The flash controller aborted a write to a locked page
+	"""
+
+	def __init__(self, page):
+		IOError.__init__(self, "Flash page 0x%02x is locked!" % page)
+		self.page = page
 
 class ChipDriver(CCLibProxy):
 	"""
@@ -24,11 +75,19 @@ class ChipDriver(CCLibProxy):
 	in order to have a simple API all the way to the serial port.
 	"""
 
+	# Flash pages that writeCODE may erase and program again when their
+	# verification fails, unless given with its retries argument
+	flashRetries = 3
+
 	def __init__(self, proxy):
 		"""
 		Construct a new chip driver
 		"""
 		self._proxy = proxy
+		# Shadow copies of chip registers (see invalidateShadow)
+		self.shadow = {}
+		# Seconds spent in verifyCODE, for the flash statistics
+		self.verifyTime = 0.0
 		# Initialize proxy subclass
 		CCLibProxy.__init__(self, parent=proxy)
 
@@ -51,6 +110,50 @@ class ChipDriver(CCLibProxy):
 		"""
 		raise NotImplementedError("This function is not implemented!")
 
+	###############################################
+	# Register shadow
+	###############################################
+
+	def invalidateShadow(self):
+		"""
+		Forget the shadow copies of the chip registers and DMA descriptors.
+
+		Drivers keep in self.shadow the last values they wrote to registers
+		that only change when written, so that hot loops can skip redundant
+		writes and read-modify-write sequences. Anything that lets the CPU
+		run or resets the chip makes them stale.
+		"""
+		self.shadow = {}
+
+	def invalidateCaches(self):
+		"""
+		Forget the shadow (see invalidateShadow) and everything else the
+		driver remembers about the chip, like the routines uploaded to SRAM
+		or the flash pages known to be erased. Subclasses extend it with
+		their own caches. Firmware running on the CPU can overwrite any of it.
+		"""
+		self.invalidateShadow()
+
+	def enter(self):
+		self.invalidateCaches()
+		return CCLibProxy.enter(self)
+
+	def exit(self):
+		self.invalidateCaches()
+		return CCLibProxy.exit(self)
+
+	def resume(self):
+		self.invalidateCaches()
+		return CCLibProxy.resume(self)
+
+	def step(self):
+		self.invalidateCaches()
+		return CCLibProxy.step(self)
+
+	def chipErase(self):
+		self.invalidateShadow()
+		return CCLibProxy.chipErase(self)
+
 	###############################################
 	# Interface Functions
 	###############################################
@@ -81,7 +184,8 @@ class ChipDriver(CCLibProxy):
 
 	def writeCODE(self, offset, data, erase=False, verify=False, showProgress=False):
 		"""
-		Fully automated function for writing the Flash memory.
+		Fully automated function for writing the Flash memory. Returns the
+		number of bytes programmed.
 		"""
 		raise NotImplementedError("This function is not implemented!")
 
@@ -97,5 +201,209 @@ class ChipDriver(CCLibProxy):
 		"""
 		raise NotImplementedError("This function is not implemented!")
 
+	def getCODEChecksums(self, ranges):
+		"""
+		Compute the CRC16-CCITT (see ccroutines.crc16) of each (offset, size)
+		CODE range on the chip
+		"""
+		raise NotImplementedError("This function is not implemented!")
+
+	def isCODEBlank(self, ranges):
+		"""
+		Check if each (offset, size) CODE range is blank (all 0xFF). Drivers
+		that can check it on the chip override this, by default nothing is
+		known to be blank.
+		"""
+		return [ False ] * len(ranges)
+
+	###############################################
+	# Flash verification
+	###############################################
+
+	def pageSegments(self, offset, size):
+		"""
+		Split a CODE range in (offset, size) segments that do not cross
+		flash page boundaries
+		"""
+		segments = []
+		iOfs = 0
+		while iOfs < size:
+			fAddr = offset + iOfs
+			iLen = min( size - iOfs, self.flashPageSize - (fAddr % self.flashPageSize) )
+			segments.append( (fAddr, iLen) )
+			iOfs += iLen
+		return segments
+
+	def verifyCODE(self, offset, data, verify='full'):
+		"""
+		Check that the CODE region at the given offset holds the given data,
+		with one of the policies of parseVerify:
+
+		- 'crc': compare the checksum of every page
+		- 'deferred': compare a single checksum of the whole data, and the
+		  page checksums only to locate a mismatch
+		- 'sample': read back N random pages
+		- 'full': read back everything
+
+		Checksums are computed on the chip if the driver can do it (see
+		getCODEChecksums), otherwise the data is read back. The time spent is
+		added to self.verifyTime.
+
+		Raises CCVerifyError on mismatch.
+		"""
+		t0 = time.time()
+		try:
+			mode, samples = parseVerify(verify)
+			if (mode == 'off') or (len(data) == 0):
+				return
+			segments = self.pageSegments( offset, len(data) )
+
+			# Checksum policies
+			if mode in ('crc', 'deferred'):
+				try:
+					if (mode == 'deferred') and (self.getCODEChecksums([ (offset, len(data)) ])[0] == crc16(data)):
+						return
+					crcs = self.getCODEChecksums( segments )
+					for (fAddr, iLen), crc in zip(segments, crcs):
+						if crc != crc16( data[fAddr-offset:fAddr-offset+iLen] ):
+							raise CCVerifyError(fAddr)
+					return
+				except NotImplementedError:
+					mode = 'full'
+
+			# Read-back policies
+			if mode == 'sample':
+				segments = sorted(random.sample( segments, min(samples, len(segments)) ))
+			for fAddr, iLen in segments:
+				verifyBytes = self.readCODE( fAddr, iLen )
+				for i in range(0, iLen):
+					if verifyBytes[i] != data[fAddr-offset+i]:
+						raise CCVerifyError(fAddr+i)
+		finally:
+			self.verifyTime += time.time() - t0
+
+	###############################################
+	# Flash repair
+	###############################################
+
+	def writeCODEPage(self, page, pageData):
+		"""
+		Erase and program a whole flash page, without verification
+		"""
+		raise NotImplementedError("This function is not implemented!")
+
+	def rewriteCODEPage(self, page, offset, data):
+		"""
+		Erase and program again the part of the given data that falls in a
+		flash page, preserving the rest of the page
+		"""
+		fPage = page * self.flashPageSize
+		pageData = bytearray( self.readCODE( fPage, self.flashPageSize ) )
+		lo = max( offset, fPage )
+		hi = min( offset + len(data), fPage + self.flashPageSize )
+		pageData[lo-fPage:hi-fPage] = bytearray( data[lo-offset:hi-offset] )
+		self.writeCODEPage( page, bytes(pageData) )
+
+	def repairCODE(self, offset, data, verify, retries):
+		"""
+		Verify the CODE region (see verifyCODE), rewriting every page that
+		fails (see rewriteCODEPage) and verifying it again, instead of
+		starting the whole programming over.
+
+		At most the given number of pages are rewritten, after that the
+		verification error is raised. Returns the rewrites left, so that the
+		budget can be shared by all the verifications of an image.
+		"""
+		while True:
+			try:
+				self.verifyCODE( offset, data, verify )
+				return retries
+			except CCVerifyError as e:
+				if retries <= 0:
+					raise
+				retries -= 1
+				page = int( e.offset / self.flashPageSize )
+				print("WARNING: %s, rewriting page %i" % (e, page))
+				self.rewriteCODEPage( page, offset, data )
+
+				# Carry on from the rewritten page, which is checked again
+				cut = max( offset, page * self.flashPageSize )
+				data = data[cut-offset:]
+				offset = cut
+
+	###############################################
+	# Flash dump
+	###############################################
+
+	def dumpCODE(self, filename, ftype=None, resume=True, showProgress=False):
+		"""
+		Stream the CODE region to an Intel HEX or binary file, one 32 KB bank
+		at a time, writing the file as the flash is read.
+
+		Blank pages (see isCODEBlank) are not read: they are left out of HEX
+		files, and the dump ends with the last non-blank page.
+
+		The progress is recorded in a sidecar file (<filename>.resume) after
+		every bank, so with resume=True an interrupted dump of the same chip
+		continues from the last completed bank.
+
+		Returns the number of bytes read.
+		"""
+		ftype = fileFormat(filename, ftype)
+		bankSize = 0x8000
+		pSize = self.flashPageSize
+
+		# Find the blank pages and the end of the used flash
+		pages = int(self.flashSize / pSize)
+		blank = self.isCODEBlank([ (p * pSize, pSize) for p in range(0, pages) ])
+		used = [ p for p in range(0, pages) if not blank[p] ]
+		end = (used[-1] + 1) * pSize if used else 0
+		state = {
+			'serial': self.getSerial(),
+			'flashSize': self.flashSize,
+			'ftype': ftype,
+			'end': end,
+		}
+
+		# Check if we can continue a previous dump of this chip
+		sidecar = filename + ".resume"
+		startBank = 0
+		resumeAt = None
+		if resume and os.path.isfile(sidecar) and os.path.isfile(filename):
+			try:
+				with open(sidecar, "r") as f:
+					saved = json.load(f)
+				if all(saved.get(k) == v for k, v in state.items()) and (os.path.getsize(filename) >= saved['size']):
+					startBank = saved['bank']
+					resumeAt = saved['size']
+			except (IOError, OSError, ValueError, KeyError):
+				pass
+
+		# Read the non-blank pages, bank by bank
+		writer = CCHEXWriter(filename, ftype, resumeAt)
+		todo = len([ p for p in used if p * pSize >= startBank * bankSize ]) * pSize
+		progress = ProgressTracker( 'dump', todo, source=self.port, show=showProgress )
+		try:
+			for bank in range(startBank, int((end + bankSize - 1) / bankSize)):
+				for p in range(int(bank * bankSize / pSize), int(min(end, (bank + 1) * bankSize) / pSize)):
+					if blank[p]:
+						continue
+
+					writer.write( p * pSize, self.readCODE( p * pSize, pSize ) )
+					progress.advance( pSize )
+
+				# Record the completed bank
+				writer.flush()
+				with open(sidecar, "w") as f:
+					json.dump(dict(state, bank=bank + 1, size=writer.tell()), f)
+		finally:
+			writer.close()
+
+		# Done
+		if os.path.isfile(sidecar):
+			os.remove(sidecar)
+		progress.finish( "%i KB, %i blank pages skipped" % (end / 1024, pages - len(used)) )
+		return todo
+
 	def close( self ):
 		self._proxy.close()
\ No newline at end of file
@@ -18,8 +18,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 from __future__ import print_function
-from z2mflasher.cclib.chip import ChipDriver
-import sys
+from z2mflasher.cclib.chip import ChipDriver, parseVerify
+from z2mflasher.cclib.ccproxy import CMD_RESUME, CMD_STATUS
+from z2mflasher.cclib.ccroutines import cc251xFlashRoutine, iramCopyRoutine
+from z2mflasher.progress import ProgressTracker
 import time
 
 class CC2510(ChipDriver):
@@ -27,6 +29,19 @@ class CC2510(ChipDriver):
 	Chip-specific code for CC2510 SOC
 	"""
 
+	# SRAM (XDATA) address of the flash page buffers, followed by the
+	# resident flash routine
+	flashBufferAddr = 0xF000
+
+	# Maximum time the flash routine is allowed to spend on a page
+	flashPageTimeout = 1.0
+
+	# IRAM range where large XDATA writes are staged (one instruction per
+	# byte), above register bank 0
+	stageIRAMAddr = 0x08
+	stageIRAMSize = 0x78
+	stageXDATAThreshold = 64
+
 	@staticmethod
 	def test(chipID):
 		"""
@@ -78,6 +93,19 @@ class CC2510(ChipDriver):
 		self.bulkBlockSize = 0x400 # < This should be the same as the flash page size
 		self.flashWordSize = 2 #cc251x have 2 bytes per word
 
+		# Page buffers that fit in SRAM, keeping 256 bytes for the routine
+		self.flashBatchPages = max(1, int((self.sramSize - 0x100) / self.flashPageSize))
+		self.routineAddr = self.flashBufferAddr + self.flashBatchPages * self.flashPageSize
+		self.copyRoutineAddr = self.routineAddr + 0x80
+		self.routines = {}
+
+	def invalidateCaches(self):
+		"""
+		Forget the shadow and the uploaded routines
+		"""
+		ChipDriver.invalidateCaches(self)
+		self.routines = {}
+
 	###############################################
 	# Data reading
 	###############################################
@@ -88,37 +116,108 @@ class CC2510(ChipDriver):
 		"""
 
 		# Setup DPTR
-		a = self.instri( 0x90, offset )		# MOV DPTR,#data16
-
-		# Prepare ans array
-		ans = bytearray()
+		frames = [ self.instriFrame( 0x90, offset ) ]	# MOV DPTR,#data16
 
 		# Read bytes
 		for i in range(0, size):
-			a = self.instr ( 0xE0 )			# MOVX A,@DPTR
-			ans.append(a)
-			a = self.instr ( 0xA3 )			# INC DPTR
+			frames.append( self.instrFrame( 0xE0 ) )	# MOVX A,@DPTR
+			frames.append( self.instrFrame( 0xA3 ) )	# INC DPTR
 
-		# Return ans
-		return ans
+		# Send all frames in a batch and keep the MOVX answers
+		ans = self.sendFrames( frames )
+		return bytearray( ans[1::2] )
 
-	def writeXDATA( self, offset, bytes ):
+	def writeXDATAFrames( self, offset, bytes ):
 		"""
-		Write any size of buffer in the XDATA region
+		Return the frames that write a buffer in the XDATA region
 		"""
 
 		# Setup DPTR
-		a = self.instri( 0x90, offset )		# MOV DPTR,#data16
+		frames = [ self.instriFrame( 0x90, offset ) ]	# MOV DPTR,#data16
 
-		# Read bytes
+		# Write bytes
 		for b in bytes:
-			a = self.instr ( 0x74, b )		# MOV A,#data
-			a = self.instr ( 0xF0 )			# MOVX @DPTR,A
-			a = self.instr ( 0xA3 )			# INC DPTR
+			frames.append( self.instrFrame( 0x74, b ) )	# MOV A,#data
+			frames.append( self.instrFrame( 0xF0 ) )	# MOVX @DPTR,A
+			frames.append( self.instrFrame( 0xA3 ) )	# INC DPTR
+
+		# Return frames
+		return frames
+
+	def writeXDATA( self, offset, bytes ):
+		"""
+		Write any size of buffer in the XDATA region
+		"""
+
+		# Large buffers are faster to send staged in IRAM
+		if self.canStageXDATA( offset, len(bytes) ):
+			return self.writeXDATAStaged( offset, bytes )
+
+		# Send all frames in a batch
+		self.sendFrames( self.writeXDATAFrames( offset, bytes ) )
 
 		# Return bytes written
 		return len(bytes)
 
+	def canStageXDATA( self, offset, size ):
+		"""
+		Check if an XDATA write can use writeXDATAStaged: it must be large
+		enough and not overwrite the copy routine
+		"""
+		return (size >= self.stageXDATAThreshold) \
+			and ((offset + size <= self.copyRoutineAddr) or (offset >= self.copyRoutineAddr + 0x80))
+
+	def writeXDATAStaged( self, offset, bytes ):
+		"""
+		Write a buffer in the XDATA region in blocks staged in IRAM, where
+		each byte takes a single MOV direct,#data instruction (instead of
+		three), and copied to their destination by the resident copy
+		routine. The routine is started at the end of each block's batch,
+		so every block costs a single round trip.
+		"""
+		bytes = bytearray(bytes)
+		self.uploadRoutine( iramCopyRoutine(), self.copyRoutineAddr )
+
+		# The destination pointer is kept by the routine between blocks
+		frames = self.routineSetupFrames() + [
+			self.instriFrame( 0x90, offset ),				# MOV DPTR,#data16
+		]
+		for iOfs in range(0, len(bytes), self.stageIRAMSize):
+			block = bytes[iOfs:iOfs+self.stageIRAMSize]
+			for i in range(0, len(block)):
+				frames.append( self.instrFrame( 0x75, self.stageIRAMAddr + i, block[i] ) )	# MOV direct,#data
+			frames += [
+				self.instrFrame( 0x78, self.stageIRAMAddr ),	# MOV R0,#data
+				self.instrFrame( 0x79, len(block) ),			# MOV R1,#data
+				self.instriFrame( 0x02, self.copyRoutineAddr ),	# LJMP addr16
+				( CMD_RESUME, ),
+				( CMD_STATUS, ),
+			]
+
+			# The copy is usually over by the time the status is read
+			ans = self.sendFrames( frames )
+			if (ans[-1] & 0x20) == 0:
+				self.waitHalted( self.copyRoutineAddr, time.time() + self.flashPageTimeout )
+			frames = []
+
+		# Return bytes written
+		return len(bytes)
+
+	def modifyXDATA( self, offset, andMask=0xFF, orMask=0x00 ):
+		"""
+		Read-modify-write a single XDATA byte on the chip, in one batch
+		"""
+		ans = self.sendFrames([
+				self.instriFrame( 0x90, offset ),	# MOV DPTR,#data16
+				self.instrFrame( 0xE0 ),			# MOVX A,@DPTR
+				self.instrFrame( 0x54, andMask ),	# ANL A,#data
+				self.instrFrame( 0x44, orMask ),	# ORL A,#data
+				self.instrFrame( 0xF0 ),			# MOVX @DPTR,A
+			])
+
+		# Return the new value
+		return ans[3]
+
 	def readCODE( self, offset, size ):
 		"""
 		Read any size of buffer from the XDATA+0x8000 (code-mapped) region
@@ -131,22 +230,19 @@ class CC2510(ChipDriver):
 		# Recalibrate offset
 		offset -= fBank * 0x8000
 
-		# Setup DPTR
-		a = self.instri( 0x90, offset )		# MOV DPTR,#data16
-
-		# Prepare ans array
-		ans = bytearray()
-
-		# Read bytes
+		# Read bytes, indexing with A from a DPTR that moves every 256 bytes
+		frames = []
+		movc = []
 		for i in range(0, size):
-			a = self.instr ( 0xE4 )			# MOVX A,@DPTR
-			a = self.instr ( 0x93 )			# MOVX A,@DPTR
-			ans.append(a)
-			a = self.instr ( 0xA3 )			# INC DPTR
-
+			if (i & 0xFF) == 0:
+				frames.append( self.instriFrame( 0x90, offset + i ) )	# MOV DPTR,#data16
+			frames.append( self.instrFrame( 0x74, i & 0xFF ) )	# MOV A,#data
+			movc.append( len(frames) )
+			frames.append( self.instrFrame( 0x93 ) )			# MOVC A,@A+DPTR
 
-		#
-		return ans
+		# Send all frames in a batch and keep the MOVC answers
+		ans = self.sendFrames( frames )
+		return bytearray( [ ans[i] for i in movc ] )
 
 
 	def getRegister( self, reg ):
@@ -168,6 +264,11 @@ class CC2510(ChipDriver):
 		#a = self.getRegister( 0xC7 )
 		#a = (a & 0xF8) | (bank & 0x07)
 		#return self.setRegister( 0xC7, a )
+
+		# Nothing to do if the shadow says the bank is already selected
+		if self.shadow.get('MEMCTR') == bank*16 + 1:
+			return
+		self.shadow['MEMCTR'] = bank*16 + 1
 		return self.instr(0x75, 0xC7, bank*16 + 1);
 
 
@@ -177,6 +278,19 @@ class CC2510(ChipDriver):
 		"""
 		return self.setRegister( 0x9F, bank & 0x07 )
 
+	def pauseDMA(self, pause):
+		"""
+		Pause/Unpause DMA in debug mode
+		"""
+		# Get current debug config
+		a = self.readConfig()
+		# Update
+		if pause:
+			a |= 0x4
+		else:
+			a &= ~0x4
+		# Commit
+		self.writeConfig(a)
 
 	###############################################
 	# Chip information
@@ -248,126 +362,96 @@ class CC2510(ChipDriver):
 	# cc251x
 	###############################################
 
-	def readFlashPage(self, address):
-		if (not self.debug_active):
-			print("ERROR: not in debug mode! did you forget a enter() call?\n")
-			sys.exit(2)
-		return self.readCODE(address & 0x7FFFF, self.flashPageSize)
-
-	def writeFlashPage(self, address, inputArray, erase_page=True):
-		if len(inputArray) != self.flashPageSize:
-			raise IOError("input data size != flash page size!")
-
-		if (not self.debug_active):
-			print("ERROR: not in debug mode! did you forget a enter() call?\n")
-			sys.exit(2)
-
-		#calc words per flash page
-		words_per_flash_page = self.flashPageSize / self.flashWordSize
-
-		#print "words_per_flash_page = %d" % (words_per_flash_page)
-		#print "flashWordSize = %d" % (self.flashWordSize)
-		if (erase_page):
-			print("[page erased]", end=' ')
+	def uploadRoutine(self, code, address=None):
+		"""
+		Upload an 8051 routine to SRAM, unless it's already there
+		"""
+		if address is None:
+			address = self.routineAddr
+		code = bytearray(code)
+		if self.routines.get(address) != code:
+			self.sendFrames( self.writeXDATAFrames( address, code ) )
+			self.routines[address] = code
+		return address
 
-		routine8_1 = [
-			#see http://www.ti.com/lit/ug/swra124/swra124.pdf page 11
-			0x75, 0xAD, ((address >> 8) / self.flashWordSize) & 0x7E, 	#MOV FADDRH, #imm;
-			0x75, 0xAC, 0x00						#MOV FADDRL, #00;
-		]
-		routine8_erase = [
-			0x75, 0xAE, 0x01,						#MOV FLC, #01H; // ERASE
-			#; Wait for flash erase to complete
-			0xE5, 0xAE,							#eraseWaitLoop:  MOV A, FLC;
-			0x20, 0xE7, 0xFB						#JB ACC_BUSY, eraseWaitLoop;
-		]
-		routine8_2 = [
-			#; Initialize the data pointer
-			0x90, 0xF0, 0x00,						#MOV DPTR, #0F000H;
-			#; Outer loops
-			0x7F, (((words_per_flash_page)>>8)&0xFF),			#MOV R7, #imm;
-			0x7E, ((words_per_flash_page)&0xFF),				#MOV R6, #imm;
-			0x75, 0xAE, 0x02,						#MOV FLC, #02H; // WRITE
-			#; Inner loops
-			0x7D, self.flashWordSize,					#writeLoop:          MOV R5, #imm;
-			0xE0,								#writeWordLoop:          MOVX A, @DPTR;
-			0xA3,								#INC DPTR;
-			0xF5, 0xAF,							#MOV FWDATA, A;
-			0xDD, 0xFA,							#DJNZ R5, writeWordLoop;
-			#; Wait for completion
-			0xE5, 0xAE,							#writeWaitLoop:      MOV A, FLC;
-			0x20, 0xE6, 0xFB,						#JB ACC_SWBSY, writeWaitLoop;
-			0xDE, 0xF1,							#DJNZ R6, writeLoop;
-			0xDF, 0xEF,							#DJNZ R7, writeLoop;
-			#set green led for debugging info (DO NOT USE THIS!)
-			#LED_GREEN_DIR |= (1<<LED_GREEN_PIN);
-			#0x43, 0xFF, 0x18,	#      [24]  935         orl     _P2DIR,#0x10
-			#LED_GREEN_PORT = (1<<LED_GREEN_PIN);
-			#0x75, 0xA0, 0x18,	#      [24]  937         mov     _P2,#0x10
-			#; Done with writing, fake a breakpoint in order to HALT the cpu
-			0xA5								#DB 0xA5;
+	def routineSetupFrames(self):
+		"""
+		Return the frames that prepare the CPU for running a routine from
+		SRAM: register bank 0, SRAM mapping and interrupts disabled. The
+		routines are ours, so the shadow survives them.
+		"""
+		self.shadow['MEMCTR'] = 0x51
+		return [
+			self.instrFrame( 0x75, 0xD0, 0x00 ),	# MOV PSW,#data
+			self.instrFrame( 0x75, 0xC7, 0x51 ),	# MOV MEMCTR,#data
+			self.instrFrame( 0xC2, 0xAF ),			# CLR EA
 		]
 
-		#build routine
-		routine = routine8_1
-		if (erase_page):
-			routine += routine8_erase
-		routine += routine8_2
-
-		#add led code to flash code (for debugging)
-		#aroutine = led_routine + routine
-		#routine = routine + led_routine
-
-		#for x in routine:
-		#	print "%02X" % (x),
-
-		#halt CPU
-		self.halt()
-
-		#send data to xdata memory:
-		if (self.show_debug_info): print("copying data to xdata")
-		self.writeXDATA(0xF000, inputArray)
-
-		#send program to xdata mem
-		if (self.show_debug_info): print("copying flash routine to xdata")
-		self.writeXDATA(0xF000 + self.flashPageSize, routine)
+	def waitHalted(self, address, deadline):
+		"""
+		Wait until the routine at the given address halts the CPU (status
+		bit 0x20), halting it on timeout
+		"""
+		while (self.getStatus() & 0x20) == 0:
+			if time.time() > deadline:
+				self.halt()
+				raise IOError("On-chip routine at 0x%04x timed out!" % address)
+			self.pollSleep(0.005)
 
-		if (self.show_debug_info): print("executing code")
-		#execute MOV MEMCTR, (bank * 16) + 1;
-		self.instr(0x75, 0xC7, 0x51)
+	def readFlashPage(self, address):
+		"""
+		Read the flash page the given address belongs to
+		"""
+		return self.readCODE(address & ~(self.flashPageSize - 1), self.flashPageSize)
 
-		#set PC to start of program
-		self.setPC(0xF000 + self.flashPageSize)
+	def writeFlashPage(self, address, inputArray, erase_page=True):
+		"""
+		Write the flash page the given address belongs to
+		"""
+		if len(inputArray) != self.flashPageSize:
+			raise IOError("input data size != flash page size!")
+		return self.writeFlashPages(int(address / self.flashPageSize), inputArray, erase=erase_page)
 
-		#start program exec, will continue after routine exec due to breakpoint
-		self.resume()
+	def writeFlashPages(self, page, data, erase=True):
+		"""
+		Program consecutive flash pages starting at the given page number.
 
+		The data (a whole number of pages, at most flashBatchPages) is
+		uploaded to the SRAM page buffers and the resident flash routine
+		(see ccroutines.cc251xFlashRoutine) erases and programs all the pages
+		in one run, so the host only waits for the CPU to halt again.
+		"""
+		count = int(len(data) / self.flashPageSize)
+		if (count == 0) or (count > self.flashBatchPages) or (len(data) % self.flashPageSize):
+			raise IOError("Flash batch must be 1 to %i whole pages!" % self.flashBatchPages)
 
-		if (self.show_debug_info): print("page write running", end=' ')
+		# The routine is uploaded once and stays resident
+		self.uploadRoutine( cc251xFlashRoutine( int(self.flashPageSize / self.flashWordSize), self.flashWordSize ) )
 
-		#set some timeout (2 seconds)
-		timeout = 200
-		while (timeout > 0):
-			#show progress
-			if (self.show_debug_info):
-				print(".", end=' ')
-				sys.stdout.flush()
-			#check status (bit 0x20 = cpu halted)
-			if ((self.getStatus() & 0x20 ) != 0):
-				if (self.show_debug_info): print("done")
-				break
-			#timeout increment
-			timeout -= 1
-			#delay (10ms)
-			time.sleep(0.01)
+		# Word address of the first page, in FADDRH:FADDRL
+		fHigh = (int(page * self.flashPageSize / self.flashWordSize) >> 8) & 0xFF
 
+		# Upload data
+		self.writeXDATA( self.flashBufferAddr, data )
 
-		if (timeout <=0):
-			raise IOError("flash write timed out!")
+		# Set the routine parameters, jump to it and run it
+		self.sendFrames( self.routineSetupFrames() + [
+			self.instriFrame( 0x90, self.flashBufferAddr ),	# MOV DPTR,#data16
+			self.instrFrame( 0x7A, fHigh ),					# MOV R2,#data
+			self.instrFrame( 0x7B, count ),					# MOV R3,#data
+			self.instrFrame( 0x7C, 1 if erase else 0 ),		# MOV R4,#data
+			self.instriFrame( 0x02, self.routineAddr ),		# LJMP addr16
+			( CMD_RESUME, ),
+		])
+		self.waitHalted( self.routineAddr, time.time() + self.flashPageTimeout * count )
 
-		self.halt()
+		return count
 
-		if (self.show_debug_info): print("done")
+	def writeCODEPage(self, page, pageData):
+		"""
+		Erase and program a whole flash page, without verification
+		"""
+		self.writeFlashPages( page, pageData, erase=True )
 
 
 	###############################################
@@ -418,10 +502,8 @@ class CC2510(ChipDriver):
 		Clear the flash status register
 		"""
 
-		# Read & mask-out status register bits
-		a = self.readXDATA(0x6270, 1)
-		a[0] &= 0x1F
-		return self.writeXDATA(0x6270, a)
+		# Mask-out status register bits
+		return self.modifyXDATA(0x6270, andMask=0x1F)
 
 	def setFlashWrite(self):
 		"""
@@ -429,9 +511,7 @@ class CC2510(ChipDriver):
 		"""
 
 		# Set flash WRITE bit
-		a = self.readXDATA(0x6270, 1)
-		a[0] |= 0x02
-		return self.writeXDATA(0x6270, a)
+		return self.modifyXDATA(0x6270, orMask=0x02)
 
 	def setFlashErase(self):
 		"""
@@ -439,119 +519,70 @@ class CC2510(ChipDriver):
 		"""
 
 		# Set flash ERASE bit
-		a = self.readXDATA(0x6270, 1)
-		a[0] |= 0x01
-		return self.writeXDATA(0x6270, a)
+		return self.modifyXDATA(0x6270, orMask=0x01)
 
-	def writeCODE(self, offset, data, erase=False, verify=False, showProgress=False):
+	def writeCODE(self, offset, data, erase=False, verify=False, showProgress=False, retries=None):
 		"""
 		Fully automated function for writing the Flash memory.
 
-		WARNING: This requires DMA operations to be unpaused ( use: self.pauseDMA(False) )
-		"""
-
-		# Prepare DMA-0 for DEBUG -> RAM (using DBG_BW trigger)
-		self.configDMAChannel( 0, 0x6260, 0x0000, 0x1F, tlen=self.bulkBlockSize, srcInc=0, dstInc=1, priority=1, interrupt=True )
-		# Prepare DMA-1 for RAM -> FLASH (using the FLASH trigger)
-		self.configDMAChannel( 1, 0x0000, 0x6273, 0x12, tlen=self.bulkBlockSize, srcInc=1, dstInc=0, priority=2, interrupt=True )
-
-		# Reset flags
-		self.clearFlashStatus()
-		self.clearDMAIRQ(0)
-		self.clearDMAIRQ(1)
-		self.disarmDMAChannel(0)
-		self.disarmDMAChannel(1)
-		flashRetries = 0
-
-		# Split in 2048-byte chunks
-		iOfs = 0
-		while (iOfs < len(data)):
-
-			# Check if we should show progress
-			if showProgress:
-				print("\r    Progress %0.0f%%... " % (iOfs*100/len(data)), end=' ')
-				sys.stdout.flush()
-
-			# Get next page
-			iLen = min( len(data) - iOfs, self.bulkBlockSize )
-
-			# Update DMA configuration if we have less than bulk-block size data
-			if (iLen < self.bulkBlockSize):
-				self.configDMAChannel( 0, 0x6260, 0x0000, 0x1F, tlen=iLen, srcInc=0, dstInc=1, priority=1, interrupt=True )
-				self.configDMAChannel( 1, 0x0000, 0x6273, 0x12, tlen=iLen, srcInc=1, dstInc=0, priority=2, interrupt=True )
-
-			# Upload to RAM through DMA-0
-			self.armDMAChannel(0)
-			self.brustWrite( data[iOfs:iOfs+iLen] )
-
-			# Wait until DMA-0 raises interrupt
-			while not self.isDMAIRQ(0):
-				time.sleep(0.010)
-
-			# Clear DMA IRQ flag
-			self.clearDMAIRQ(0)
-
-			# Calculate the page where this data belong to
-			fAddr = offset + iOfs
-			fPage = int( fAddr / self.flashPageSize )
-
-			# Calculate FLASH address High/Low bytes
-			# for writing (addressable as 32-bit words)
-			fWordOffset = int(fAddr / 4)
-			cHigh = (fWordOffset >> 8) & 0xFF
-			cLow = fWordOffset & 0xFF
-			self.writeXDATA( 0x6271, [cLow, cHigh] )
-
-			# Debug
-			#print "[@%04x: p=%i, ofs=%04x, %02x:%02x]" % (fAddr, fPage, fWordOffset, cHigh, cLow),
-			#sys.stdout.flush()
-
-			# Check if we should erase page first
-			if erase:
-				# Select the page to erase using FADDRH[7:1]
-				#
-				# NOTE: Specific to (CC2530, CC2531, CC2540, and CC2541),
-				#       the CC2533 uses FADDRH[6:0]
-				#
-				cHigh = (fPage << 1)
-				cLow = 0
-				self.writeXDATA( 0x6271, [cLow, cHigh] )
-				# Set the erase bit
-				self.setFlashErase()
-				# Wait until flash is not busy any more
-				while self.isFlashBusy():
-					time.sleep(0.010)
-
-			# Upload to FLASH through DMA-1
-			self.armDMAChannel(1)
-			self.setFlashWrite()
-
-			# Wait until DMA-1 raises interrupt
-			while not self.isDMAIRQ(1):
-				# Also check for errors
-				if self.isFlashAbort():
-					self.disarmDMAChannel(1)
-					raise IOError("Flash page 0x%02x is locked!" % fPage)
-				time.sleep(0.010)
-
-			# Clear DMA IRQ flag
-			self.clearDMAIRQ(1)
-
-			# Check if we should verify
-			if verify:
-				verifyBytes = self.readCODE(fAddr, iLen)
-				for i in range(0, iLen):
-					if verifyBytes[i] != data[iOfs+i]:
-						if flashRetries < 3:
-							print("\n[Flash Error at @0x%04x, will retry]" % (fAddr+i))
-							flashRetries += 1
-							continue
-						else:
-							raise IOError("Flash verification error on offset 0x%04x" % (fAddr+i))
-			flashRetries = 0
-
-			# Forward to next page
-			iOfs += iLen
-
-		if showProgress:
-			print("\r    Progress 100%... OK")
+		The data is written in batches of whole pages (see writeFlashPages).
+		Partial pages at the edges are completed with their current contents
+		when erasing, or with 0xFF (which leaves the flash untouched) when not.
+
+		The verify argument selects a verification policy (see parseVerify).
+		There is no checksum routine for the CC251x, so both 'crc' and 'full'
+		read back every batch.
+
+		A page that fails verification is erased and programmed again, up to
+		retries pages per call (flashRetries by default), before giving up
+		with a CCVerifyError (see repairCODE).
+
+		Returns the number of bytes programmed, which are whole pages.
+		"""
+
+		# Per-batch verification, or once at the end
+		batchVerify = parseVerify(verify)[0] in ('crc', 'full')
+		if retries is None:
+			retries = self.flashRetries
+
+		# Build a page-aligned image
+		pSize = self.flashPageSize
+		firstPage = int(offset / pSize)
+		lastPage = int((offset + len(data) - 1) / pSize)
+		start = firstPage * pSize
+		end = (lastPage + 1) * pSize
+		image = bytearray(b"\xff" * (end - start))
+		if erase:
+			if offset > start:
+				image[0:offset-start] = self.readCODE( start, offset - start )
+			if offset + len(data) < end:
+				image[offset+len(data)-start:] = self.readCODE( offset + len(data), end - offset - len(data) )
+		image[offset-start:offset-start+len(data)] = bytearray(data)
+
+		# Write in batches of as many pages as the SRAM buffers hold
+		progress = ProgressTracker( 'write', len(image), source=self.port, show=showProgress )
+		page = firstPage
+		while page <= lastPage:
+
+			progress.update( (page - firstPage) * pSize )
+
+			iOfs = (page - firstPage) * pSize
+			iLen = min( lastPage - page + 1, self.flashBatchPages ) * pSize
+			chunk = image[iOfs:iOfs+iLen]
+			self.writeFlashPages( page, chunk, erase=erase )
+
+			# Check if we should verify the data in this batch
+			if batchVerify:
+				lo = max( offset, start + iOfs )
+				hi = min( offset + len(data), start + iOfs + iLen )
+				retries = self.repairCODE( lo, data[lo-offset:hi-offset], 'full', retries )
+
+			# Forward to next batch
+			page += int(iLen / pSize)
+
+		# Verify the whole image
+		if not batchVerify:
+			self.repairCODE( offset, data, verify, retries )
+
+		progress.finish()
+		return len(image)
@@ -18,8 +18,11 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 from __future__ import print_function
-from z2mflasher.cclib.chip import ChipDriver
-import sys
+from z2mflasher.cclib.chip import CCFlashLockedError, ChipDriver, parseVerify
+from z2mflasher.cclib.ccproxy import CMD_RESUME
+from z2mflasher.cclib.ccroutines import crc16, crc16Routine, blankCheckRoutine, loopCounter, \
+	cc254xLoaderRoutine, packBits, packBitsRoutine, programCheckRoutine
+from z2mflasher.progress import ProgressTracker
 import time
 
 # From the SWRU191F user guide, section 3.6, CHIPID register
@@ -41,11 +44,62 @@ def getChipName(chipID):
 	return chipIDs[shortID]
 
 
+# Named flash regions kept by a page erase (see CC254X.preservedRanges)
+PRESERVE_PRESETS = ('nv', 'ieee', 'lock')
+
+def parsePreserve(specs):
+	"""
+	Check a list of preserved regions, returning each one either as a
+	preset name or as a (start, end) tuple. Raises a ValueError on an
+	unknown name or an invalid address range.
+	"""
+	regions = []
+	for spec in specs:
+		if spec in PRESERVE_PRESETS:
+			regions.append( spec )
+			continue
+		start, sep, end = spec.partition('-')
+		try:
+			region = ( int(start, 16), int(end, 16) )
+		except ValueError:
+			region = None
+		if not sep or region is None or region[0] >= region[1]:
+			raise ValueError("Unknown preserved region '%s'" % spec)
+		regions.append( region )
+	return regions
+
+
 class CC254X(ChipDriver):
 	"""
 	Chip-specific code for CC253X and CC2540/41 SOC
 	"""
 
+	# SRAM address where on-chip routines are uploaded, after the DMA
+	# buffer (0x0000) and the DMA descriptors (0x1000)
+	routineAddr = 0x1100
+
+	# Maximum time an on-chip routine is allowed to run
+	routineTimeout = 10.0
+
+	# SRAM address of the flash loader (see writeCODELoader), its DMA
+	# channels (upload, flash) and the time it may take for one chunk
+	loaderAddr = 0x1180
+	loaderDMAChannels = (0, 1)
+	loaderTimeout = 1.0
+
+	# SRAM addresses of the decompression routine that runs before the
+	# loader, and of the buffer that receives the compressed chunks
+	unpackAddr = 0x11D0
+	unpackBufferAddr = 0x0800
+
+	# XDATA writes of at least this size go through a brust-write and
+	# the DMA channel below, instead of 3 debug instructions per byte
+	burstXDATAThreshold = 64
+	burstDMAChannel = 4
+
+	# Z-Stack NV pages, right before the last flash page (HAL_NV_PAGE_CNT)
+	nvPages = 6
+
 	@staticmethod
 	def test(chipID):
 		"""
@@ -95,6 +149,12 @@ class CC254X(ChipDriver):
 		self.sramSize = self.chipInfo['sram'] * 1024
 		self.bulkBlockSize = 0x800
 
+		# Routines already uploaded to SRAM (address -> code)
+		self.routines = {}
+
+		# Flash pages known to be erased
+		self.erasedPages = set()
+
 
 	###############################################
 	# Data reading
@@ -106,37 +166,104 @@ class CC254X(ChipDriver):
 		"""
 
 		# Setup DPTR
-		a = self.instri( 0x90, offset )		# MOV DPTR,#data16
-
-		# Prepare ans array
-		ans = bytearray()
+		frames = [ self.instriFrame( 0x90, offset ) ]	# MOV DPTR,#data16
 
 		# Read bytes
 		for i in range(0, size):
-			a = self.instr ( 0xE0 )			# MOVX A,@DPTR
-			ans.append(a)
-			a = self.instr ( 0xA3 )			# INC DPTR
+			frames.append( self.instrFrame( 0xE0 ) )	# MOVX A,@DPTR
+			frames.append( self.instrFrame( 0xA3 ) )	# INC DPTR
 
-		# Return ans
-		return ans
+		# Send all frames in a batch and keep the MOVX answers
+		ans = self.sendFrames( frames )
+		return bytearray( ans[1::2] )
 
-	def writeXDATA( self, offset, bytes ):
+	def writeXDATAFrames( self, offset, bytes ):
 		"""
-		Write any size of buffer in the XDATA region
+		Return the frames that write a buffer in the XDATA region
 		"""
 
 		# Setup DPTR
-		a = self.instri( 0x90, offset )		# MOV DPTR,#data16
+		frames = [ self.instriFrame( 0x90, offset ) ]	# MOV DPTR,#data16
 
-		# Read bytes
+		# Write bytes
 		for b in bytes:
-			a = self.instr ( 0x74, b )		# MOV A,#data
-			a = self.instr ( 0xF0 )			# MOVX @DPTR,A
-			a = self.instr ( 0xA3 )			# INC DPTR
+			frames.append( self.instrFrame( 0x74, b ) )	# MOV A,#data
+			frames.append( self.instrFrame( 0xF0 ) )	# MOVX @DPTR,A
+			frames.append( self.instrFrame( 0xA3 ) )	# INC DPTR
+
+		# Return frames
+		return frames
+
+	def writeXDATA( self, offset, bytes ):
+		"""
+		Write any size of buffer in the XDATA region
+		"""
+
+		# Writes over DMA descriptors make their shadow stale
+		for key in [ k for k in self.shadow if isinstance(k, tuple) ]:
+			if (key[1] < offset + len(bytes)) and (key[1] + 8 > offset):
+				del self.shadow[key]
+
+		# Large SRAM buffers are faster to send with a brust-write
+		if self.canBurstXDATA( offset, len(bytes) ):
+			return self.writeXDATABurst( offset, bytes )
+
+		# Send all frames in a batch
+		self.sendFrames( self.writeXDATAFrames( offset, bytes ) )
+
+		# Return bytes written
+		return len(bytes)
+
+	def canBurstXDATA( self, offset, size ):
+		"""
+		Check if an XDATA write can use writeXDATABurst: it must be large
+		enough, target SRAM outside the DMA descriptors, and the DMA must not
+		be paused
+		"""
+		descAddr = 0x1000 + self.burstDMAChannel * 8
+		return (size >= self.burstXDATAThreshold) \
+			and ((self.debugConfig & 0x04) == 0) \
+			and (offset + size <= self.sramSize) \
+			and ((offset + size <= 0x1000) or (offset >= descAddr + 8))
+
+	def writeXDATABurst( self, offset, bytes ):
+		"""
+		Write a buffer in SRAM with brust-writes, moved from DBGDATA to its
+		destination by a DMA channel (using the DBG_BW trigger)
+		"""
+		ch = self.burstDMAChannel
+		for iOfs in range(0, len(bytes), 2048):
+			chunk = bytes[iOfs:iOfs+2048]
+
+			# Prepare the DMA channel & upload
+			self.configDMAChannel( ch, 0x6260, offset + iOfs, 0x1F, tlen=len(chunk), srcInc=0, dstInc=1, priority=1, interrupt=True )
+			self.clearDMAIRQ(ch)
+			self.sendFrames( self.armDMAChannelFrames(ch) )
+			self.brustWrite( chunk )
+
+			# Wait until the DMA raises interrupt
+			while not self.isDMAIRQ(ch):
+				self.pollSleep(0.010)
+			self.clearDMAIRQ(ch)
 
 		# Return bytes written
 		return len(bytes)
 
+	def modifyXDATA( self, offset, andMask=0xFF, orMask=0x00 ):
+		"""
+		Read-modify-write a single XDATA byte on the chip, in one batch
+		"""
+		ans = self.sendFrames([
+				self.instriFrame( 0x90, offset ),	# MOV DPTR,#data16
+				self.instrFrame( 0xE0 ),			# MOVX A,@DPTR
+				self.instrFrame( 0x54, andMask ),	# ANL A,#data
+				self.instrFrame( 0x44, orMask ),	# ORL A,#data
+				self.instrFrame( 0xF0 ),			# MOVX @DPTR,A
+			])
+
+		# Return the new value
+		return ans[3]
+
 	def readCODE( self, offset, size ):
 		"""
 		Read any size of buffer from the XDATA+0x8000 (code-mapped) region
@@ -169,9 +296,20 @@ class CC254X(ChipDriver):
 		"""
 		Select XDATA bank from the Memory Arbiter Control register
 		"""
-		a = self.getRegister( 0xC7 )
-		a = (a & 0xF8) | (bank & 0x07)
-		return self.setRegister( 0xC7, a )
+
+		# Nothing to do if the shadow says the bank is already selected
+		memctr = self.shadow.get('MEMCTR')
+		if memctr is None:
+			memctr = self.sendFrames([
+					self.instrFrame( 0x53, 0xC7, 0xF8 ),			# ANL direct,#data @ MEMCTR
+					self.instrFrame( 0x43, 0xC7, bank & 0x07 ),	# ORL direct,#data @ MEMCTR
+					self.instrFrame( 0xE5, 0xC7 ),				# MOV A,direct @ MEMCTR
+				])[-1]
+		elif (memctr & 0x07) != (bank & 0x07):
+			memctr = (memctr & 0xF8) | (bank & 0x07)
+			self.instr( 0x75, 0xC7, memctr )					# MOV direct,#data @ MEMCTR
+		self.shadow['MEMCTR'] = memctr
+		return memctr
 
 	def selectFlashBank(self, bank):
 		"""
@@ -246,6 +384,24 @@ class CC254X(ChipDriver):
 		# Write flash code page
 		return self.writeCODE( self.flashSize - self.flashPageSize, pageData, erase=True )
 
+	def preservedRanges(self, specs):
+		"""
+		Turn a list of preserved region names into (start, end) CODE
+		ranges, end excluded:
+
+		- 'nv': the Z-Stack NV pages (nvPages before the last page)
+		- 'ieee': the secondary IEEE address, in the last page
+		- 'lock': the lock bits, at the end of the last page
+		- 'START-END': an address range in hex, end excluded
+		"""
+		lastPage = self.flashSize - self.flashPageSize
+		presets = {
+			'nv': ( lastPage - self.nvPages * self.flashPageSize, lastPage ),
+			'ieee': ( self.flashSize - 0x18, self.flashSize - 0x10 ),
+			'lock': ( self.flashSize - 0x10, self.flashSize ),
+		}
+		return [ presets.get(region, region) for region in parsePreserve(specs) ]
+
 
 	###############################################
 	# DMA functions
@@ -265,11 +421,18 @@ class CC254X(ChipDriver):
 		# Commit
 		self.writeConfig(a)
 
-	def configDMAChannel(self, index, srcAddr, dstAddr, trigger, vlen=0, tlen=1,
+	def configDMAChannel(self, index, srcAddr, dstAddr, trigger, **kwargs):
+		"""
+		Create a DMA buffer and place it in memory
+		"""
+		self.sendFrames( self.configDMAChannelFrames( index, srcAddr, dstAddr, trigger, **kwargs ) )
+
+	def configDMAChannelFrames(self, index, srcAddr, dstAddr, trigger, vlen=0, tlen=1,
 		word=False, transferMode=0, srcInc=0, dstInc=0, interrupt=False, m8=True,
 		priority=0, memBase=0x1000):
 		"""
-		Create a DMA buffer and place it in memory
+		Return the frames that place a DMA buffer in memory and point
+		the DMA configuration registers to it
 		"""
 
 		# Calculate numeric flags
@@ -302,29 +465,30 @@ class CC254X(ChipDriver):
 			(priority & 0x03)			# 7: PRIORITY[1:0]
 		]
 
-		# Pick an offset in memory to store the configuration
+		# Pick an offset in memory to store the configuration, unless the
+		# shadow says it's already there
 		memAddr = memBase + index*8
-		self.writeXDATA( memAddr, config )
+		frames = []
+		if self.shadow.get(('DMA', memAddr)) != config:
+			frames += self.writeXDATAFrames( memAddr, config )
+			self.shadow[('DMA', memAddr)] = config
 
-		# Split address in high/low
-		cHigh = (memAddr >> 8) & 0xFF
-		cLow = (memAddr & 0xFF)
-
-		# Update DMA registers
+		# For DMA1+ they reside one after the other, starting
+		# on the base address of the first in DMA1CFGH:DMA1CFGL
 		if index == 0:
-			self.instr( 0x75, 0xD4, cLow  ) # MOV direct,#data @ DMA0CFGL
-			self.instr( 0x75, 0xD5, cHigh ) # MOV direct,#data @ DMA0CFGH
-
+			regs = ('DMA0CFG', 0xD4, 0xD5)
 		else:
-
-			# For DMA1+ they reside one after the other, starting
-			# on the base address of the first in DMA1CFGH:DMA1CFGL
 			memAddr = memBase + 8
-			cHigh = (memAddr >> 8) & 0xFF
-			cLow = (memAddr & 0xFF)
+			regs = ('DMA1CFG', 0xD2, 0xD3)
 
-			self.instr( 0x75, 0xD2, cLow  ) # MOV direct,#data @ DMA1CFGL
-			self.instr( 0x75, 0xD3, cHigh ) # MOV direct,#data @ DMA1CFGH
+		# Update DMA registers
+		if self.shadow.get(regs[0]) != memAddr:
+			frames.append( self.instrFrame( 0x75, regs[1], memAddr & 0xFF ) )			# MOV direct,#data @ DMAxCFGL
+			frames.append( self.instrFrame( 0x75, regs[2], (memAddr >> 8) & 0xFF ) )	# MOV direct,#data @ DMAxCFGH
+			self.shadow[regs[0]] = memAddr
+
+		# Return descriptor and register frames
+		return frames
 
 	def getDMAConfig(self, index, memBase=0x1000):
 		"""
@@ -341,11 +505,16 @@ class CC254X(ChipDriver):
 
 		# Pick an offset in memory to store the configuration
 		memAddr = memBase + index*8
+		config = self.shadow.get(('DMA', memAddr))
 		self.writeXDATA( memAddr, [
 			(srcAddr >> 8) & 0xFF,		# 0: SRCADDR[15:8]
 			(srcAddr & 0xFF),			# 1: SRCADDR[7:0]
 		])
 
+		# Keep the shadow descriptor up to date
+		if config is not None:
+			self.shadow[('DMA', memAddr)] = [ (srcAddr >> 8) & 0xFF, srcAddr & 0xFF ] + config[2:]
+
 	def setDMADstAddr(self, index, dstAddr, memBase=0x1000):
 		"""
 		Set the DMA source address
@@ -353,54 +522,65 @@ class CC254X(ChipDriver):
 
 		# Pick an offset in memory to store the configuration
 		memAddr = memBase + index*8
+		config = self.shadow.get(('DMA', memAddr))
 		self.writeXDATA( memAddr+2, [
 			(dstAddr >> 8) & 0xFF,		# 2: DESTADDR[15:8]
 			(dstAddr & 0xFF),			# 3: DESTADDR[7:0]
 		])
 
+		# Keep the shadow descriptor up to date
+		if config is not None:
+			self.shadow[('DMA', memAddr)] = config[0:2] + [ (dstAddr >> 8) & 0xFF, dstAddr & 0xFF ] + config[4:]
+
 	def armDMAChannel(self, index):
 		"""
 		Arm a DMA channel (index in 0-4)
 		"""
 
-		# Get DMAARM state
-		a = self.getRegister(0xD6) # MOV A,direct @ DMAARM
+		# Set given flag in DMAARM
+		self.sendFrames( self.armDMAChannelFrames(index) )
 
-		# Set given flag
-		a |= pow(2, index)
+		self.pollSleep(0.01)
 
-		# Update DMAARM state
-		self.setRegister(0xD6, a) # MOV direct,#data @ DMAARM
+	def armDMAChannelFrames(self, index):
+		"""
+		Return the frames that arm a DMA channel (index in 0-4). Arming takes
+		a few clocks, less than the time the next frame needs to arrive.
+		"""
 
-		time.sleep(0.01)
+		# The channel is no longer known to be disarmed
+		flag = pow(2, index)
+		self.shadow['DMADISARMED'] = self.shadow.get('DMADISARMED', 0) & ~flag
+		return [ self.instrFrame( 0x43, 0xD6, flag ) ] # ORL direct,#data @ DMAARM
 
 	def disarmDMAChannel(self, index):
 		"""
 		Disarm a DMA channel (index in 0-4)
 		"""
 
-		# Get DMAARM state
-		a = self.getRegister( 0xD6 )
-
-		# Unset given flag
+		# Nothing to do if the shadow says it's disarmed. Channels are never
+		# armed behind our back, so this holds until armDMAChannel.
 		flag = pow(2, index)
-		a &= ~flag
+		disarmed = self.shadow.get('DMADISARMED', 0)
+		if disarmed & flag:
+			return
 
-		# Update DMAARM state
-		self.setRegister( 0xD6, a )
+		# Unset given flag in DMAARM
+		self.instr( 0x53, 0xD6, ~flag & 0xFF ) # ANL direct,#data @ DMAARM
+		self.shadow['DMADISARMED'] = disarmed | flag
 
 	def isDMAArmed(self, index):
 		"""
-		Check if DMA IRQ flag is set (index in 0-4)
+		Check if DMA channel is armed (index in 0-4)
 		"""
 
 		# Get DMAARM state
-		a = self.getRegister( 0xD1 )
+		a = self.getRegister( 0xD6 )
 
-		# Lookup IRQ bit
+		# Lookup ARM bit
 		bit = pow(2, index)
 
-		# Check if IRQ bit is set
+		# Check if ARM bit is set
 		return ((a & bit) != 0)
 
 	def isDMAIRQ(self, index):
@@ -414,6 +594,12 @@ class CC254X(ChipDriver):
 		# Lookup IRQ bit
 		bit = pow(2, index)
 
+		# Single and block (not repeated) transfers disarm the channel when
+		# they are over
+		config = self.shadow.get(('DMA', 0x1000 + index*8))
+		if (a & bit) and (config is not None) and ((config[6] >> 5) & 0x03) < 2:
+			self.shadow['DMADISARMED'] = self.shadow.get('DMADISARMED', 0) | bit
+
 		# Check if IRQ bit is set
 		return ((a & bit) != 0)
 
@@ -422,15 +608,9 @@ class CC254X(ChipDriver):
 		Clear DMA IRQ flag (index in 0-4)
 		"""
 
-		# Get DMAIRQ state
-		a = self.getRegister( 0xD1 )
-
-		# Unset given flag
+		# Unset given flag in DMAIRQ
 		flag = pow(2, index)
-		a &= ~flag
-
-		# Update DMAIRQ state
-		self.setRegister( 0xD1, a )
+		self.instr( 0x53, 0xD1, ~flag & 0xFF ) # ANL direct,#data @ DMAIRQ
 
 	###############################################
 	# Flash functions
@@ -480,10 +660,8 @@ class CC254X(ChipDriver):
 		Clear the flash status register
 		"""
 
-		# Read & mask-out status register bits
-		a = self.readXDATA(0x6270, 1)
-		a[0] &= 0x1F
-		return self.writeXDATA(0x6270, a)
+		# Mask-out status register bits
+		self.sendFrames( self.writeFCTLFrames(0x00) )
 
 	def setFlashWrite(self):
 		"""
@@ -491,9 +669,7 @@ class CC254X(ChipDriver):
 		"""
 
 		# Set flash WRITE bit
-		a = self.readXDATA(0x6270, 1)
-		a[0] |= 0x02
-		return self.writeXDATA(0x6270, a)
+		self.sendFrames( self.writeFCTLFrames(0x02) )
 
 	def setFlashErase(self):
 		"""
@@ -501,65 +677,722 @@ class CC254X(ChipDriver):
 		"""
 
 		# Set flash ERASE bit
-		a = self.readXDATA(0x6270, 1)
-		a[0] |= 0x01
-		return self.writeXDATA(0x6270, a)
+		self.sendFrames( self.writeFCTLFrames(0x01) )
 
-	def writeCODE(self, offset, data, erase=False, verify=False, showProgress=False):
+	def writeFCTLFrames(self, command):
 		"""
-		Fully automated function for writing the Flash memory.
+		Return the frames that write the given command bits (WRITE, ERASE)
+		to the flash control register. The cache mode bits (CM) are kept
+		from the shadow, so this is a plain write instead of a
+		read-modify-write.
+		"""
+		if 'FCTL' not in self.shadow:
+			self.shadow['FCTL'] = self.readXDATA(0x6270, 1)[0] & 0x0C
+		return self.writeXDATAFrames( 0x6270, [ self.shadow['FCTL'] | command ] )
+
+	def invalidateCaches(self):
+		"""
+		Forget the shadow, the uploaded routines and the erased pages
+		"""
+		ChipDriver.invalidateCaches(self)
+		self.routines = {}
+		self.erasedPages = set()
+
+	def chipErase(self):
+		"""
+		Perform a chip erase, remembering that all the pages are blank
+		"""
+		ans = ChipDriver.chipErase(self)
+		self.erasedPages = set(range( 0, int(self.flashSize / self.flashPageSize) ))
+		return ans
+
+	###############################################
+	# On-chip routines
+	###############################################
+
+	def uploadRoutine(self, code, address=None):
+		"""
+		Upload an 8051 routine to SRAM, unless it's already there
+		"""
+		if address is None:
+			address = self.routineAddr
+		code = bytearray(code)
+		if self.routines.get(address) != code:
+			self.writeXDATA( address, code )
+			self.routines[address] = code
+		return address
+
+	def runRoutine(self, address=None):
+		"""
+		Run the routine uploaded at the given SRAM address until it halts
+		with the 0xA5 opcode. SRAM is mapped in the CODE region at 0x8000
+		(MEMCTR.XMAP) while it runs, and interrupts are disabled.
+		"""
+		if address is None:
+			address = self.routineAddr
+
+		# Keep the PC, MEMCTR and IEN0, so they can be restored. Our
+		# routines leave everything else in the shadow, SRAM and flash
+		# untouched, so the caches survive the resume below.
+		shadow = dict(self.shadow)
+		routines = dict(self.routines)
+		erasedPages = set(self.erasedPages)
+		pc = self.getPC()
+		ans = self.sendFrames([
+				self.instrFrame( 0xE5, 0xC7 ),				# MOV A,MEMCTR
+				self.instrFrame( 0xE5, 0xA8 ),				# MOV A,IEN0
+				self.instrFrame( 0x43, 0xC7, 0x08 ),		# ORL MEMCTR,#0x08 (XMAP)
+				self.instrFrame( 0xC2, 0xAF ),				# CLR EA
+				self.instriFrame( 0x02, 0x8000 + address ),	# LJMP addr16
+			])
+
+		# Run until the CPU halts again
+		self.resume()
+		deadline = time.time() + self.routineTimeout
+		while (self.getStatus() & 0x20) == 0:
+			if time.time() > deadline:
+				self.halt()
+				raise IOError("On-chip routine at 0x%04x timed out!" % address)
+			self.pollSleep(0.005)
+
+		# Restore state
+		self.sendFrames([
+				self.instrFrame( 0x75, 0xC7, ans[0] ),		# MOV MEMCTR,#data
+				self.instrFrame( 0x75, 0xA8, ans[1] ),		# MOV IEN0,#data
+				self.instriFrame( 0x02, pc ),				# LJMP addr16
+			])
+		shadow['MEMCTR'] = ans[0]
+		self.shadow = shadow
+		self.routines = routines
+		self.erasedPages = erasedPages
+
+	def startLoader(self, compress=False):
+		"""
+		Upload the flash loader (see ccroutines.cc254xLoaderRoutine), and
+		the decompression routine that chains to it if compress=True, and
+		prepare the CPU to run it, like runRoutine does. Returns the state
+		to restore with stopLoader.
+		"""
+		chUp, chFlash = self.loaderDMAChannels
+		self.uploadRoutine( cc254xLoaderRoutine( 1 << chUp, 1 << chFlash ), self.loaderAddr )
+		if compress:
+			self.uploadRoutine( packBitsRoutine( 1 << chUp, 0x8000 + self.loaderAddr ), self.unpackAddr )
+		pc = self.getPC()
+		ans = self.sendFrames([
+				self.instrFrame( 0xE5, 0xC7 ),				# MOV A,MEMCTR
+				self.instrFrame( 0xE5, 0xA8 ),				# MOV A,IEN0
+				self.instrFrame( 0x43, 0xC7, 0x08 ),		# ORL MEMCTR,#0x08 (XMAP)
+				self.instrFrame( 0xC2, 0xAF ),				# CLR EA
+			])
+
+		# Bank switches keep XMAP set from now on
+		self.shadow['MEMCTR'] = ans[0] | 0x08
+		return (pc, ans[0], ans[1])
+
+	def stopLoader(self, state):
+		"""
+		Restore the state saved by startLoader
+		"""
+		pc, memctr, ien0 = state
+		self.sendFrames([
+				self.instrFrame( 0x75, 0xC7, memctr ),		# MOV MEMCTR,#data
+				self.instrFrame( 0x75, 0xA8, ien0 ),		# MOV IEN0,#data
+				self.instriFrame( 0x02, pc ),				# LJMP addr16
+			])
+		self.shadow['MEMCTR'] = memctr
+
+	def waitLoader(self, fPage):
+		"""
+		Wait until the flash loader halts. It keeps running if the flash
+		controller aborts, so on timeout the page is reported as locked if
+		the ABORT flag is set.
+		"""
+		deadline = time.time() + self.loaderTimeout
+		while (self.getStatus() & 0x20) == 0:
+			if time.time() > deadline:
+				self.halt()
+				if self.isFlashAbort():
+					self.disarmDMAChannel( self.loaderDMAChannels[1] )
+					raise CCFlashLockedError(fPage)
+				raise IOError("Flash loader timed out on page 0x%02x!" % fPage)
+			self.pollSleep(0.005)
+
+	def getCODEChecksum(self, offset, size):
+		"""
+		Compute the CRC16-CCITT of a CODE range on the chip
+		"""
+		return self.getCODEChecksums([ (offset, size) ])[0]
+
+	def getCODEChecksums(self, ranges):
+		"""
+		Compute the CRC16-CCITT (see ccroutines.crc16) of each (offset, size)
+		CODE range on the chip, running the checksum routine on the target.
+		This costs a few frames per range, instead of 3 per byte for readCODE.
+		"""
+		return self.scanCODE( crc16Routine(), ranges, 0xFFFF )
+
+	def isCODEBlank(self, ranges):
+		"""
+		Check if each (offset, size) CODE range is blank (all 0xFF), running
+		the blank-check routine on the target
+		"""
+		return [ (v >> 8) == 0xFF for v in self.scanCODE( blankCheckRoutine(), ranges, 0xFF00 ) ]
+
+	def scanCODE(self, routine, ranges, init):
+		"""
+		Run a routine taking DPTR = start, R2:R3 = loopCounter(length) and
+		R4:R5 = accumulator (see ccroutines) over each (offset, size) CODE
+		range, bank by bank, and return the final accumulators
+		"""
+		self.uploadRoutine( routine )
+
+		# Scan each range, bank by bank
+		ans = []
+		for offset, size in ranges:
+			acc = init
+			while size > 0:
+				fBank = int(offset / 0x8000)
+				fOfs = offset % 0x8000
+				iLen = min(size, 0x8000 - fOfs)
+				cHigh, cLow = loopCounter(iLen)
+
+				# Prepare parameters & run
+				self.selectXDATABank( fBank )
+				self.sendFrames([
+						self.instriFrame( 0x90, 0x8000 + fOfs ),	# MOV DPTR,#data16
+						self.instrFrame( 0x7A, cHigh ),				# MOV R2,#data
+						self.instrFrame( 0x7B, cLow ),				# MOV R3,#data
+						self.instrFrame( 0x7C, acc >> 8 ),			# MOV R4,#data
+						self.instrFrame( 0x7D, acc & 0xFF ),		# MOV R5,#data
+					])
+				self.runRoutine()
+
+				# Collect result
+				res = self.sendFrames([
+						self.instrFrame( 0xEC ),	# MOV A,R4
+						self.instrFrame( 0xED ),	# MOV A,R5
+					])
+				acc = (res[0] << 8) | res[1]
+				offset += iLen
+				size -= iLen
+			ans.append(acc)
+
+		# Return accumulators
+		return ans
+
+	###############################################
+	# Flash programming
+	###############################################
+
+	def writeCODEPage(self, page, pageData):
+		"""
+		Erase and program a whole flash page, without verification
+		"""
+		self.writeCODE( page * self.flashPageSize, pageData, erase=True, verify='off', showProgress=None )
+
+	def imagePages(self, memBlocks, keep=()):
+		"""
+		Return the sorted flash pages that the memory blocks occupy, except
+		the ones that overlap any of the (start, end) ranges to keep
+		"""
+		def pagesOf(start, end):
+			return set(range( int(start / self.flashPageSize), int((end - 1) / self.flashPageSize) + 1 ))
+
+		pages = set()
+		for mb in memBlocks:
+			if mb.size:
+				pages |= pagesOf( mb.addr, mb.addr + mb.size )
+		for start, end in keep:
+			if end > start:
+				pages -= pagesOf( start, end )
+		return sorted(pages)
+
+	def erasePages(self, pages, showProgress=False):
+		"""
+		Erase the given flash pages, leaving the rest of the flash as it is.
+		The flash loader (see startLoader) waits for each erase on the chip,
+		so every page costs one batch of frames and the polls until it halts.
+		"""
+		progress = ProgressTracker( 'erase', len(pages) * self.flashPageSize, source=self.port,
+			show=showProgress )
+		state = self.startLoader()
+		try:
+			for fPage in pages:
+				# FADDRH[7:1] selects the page, R3 bit 0 only erases
+				self.sendFrames([
+					self.instrFrame( 0x79, 0x00 ),					# MOV R1,#data
+					self.instrFrame( 0x7A, (fPage << 1) & 0xFF ),		# MOV R2,#data
+					self.instrFrame( 0x7B, 0x01 ),					# MOV R3,#data
+					self.instriFrame( 0x02, 0x8000 + self.loaderAddr ),	# LJMP addr16
+					( CMD_RESUME, ),
+				])
+				self.waitLoader( fPage )
+				self.erasedPages.add( fPage )
+				progress.advance( self.flashPageSize )
+		finally:
+			self.stopLoader(state)
+		progress.finish( "%i pages" % len(pages) )
+
+	def canProgramCODE(self, offset, data):
+		"""
+		Check if the data can be programmed at the given offset without
+		erasing, that is if it only clears bits of the current contents. The
+		data is uploaded to SRAM and compared on the chip (see
+		ccroutines.programCheckRoutine), so the flash is not read back.
+		The range must not cross a 32 KB bank.
+		"""
+		self.writeXDATA( 0x0000, data )
+		self.uploadRoutine( programCheckRoutine() )
+
+		# Prepare parameters & run
+		cHigh, cLow = loopCounter(len(data))
+		self.selectXDATABank( int(offset / 0x8000) )
+		self.sendFrames([
+				self.instrFrame( 0x75, 0x92, 0x01 ),				# MOV DPS,#1
+				self.instriFrame( 0x90, 0x0000 ),				# MOV DPTR,#data16
+				self.instrFrame( 0x75, 0x92, 0x00 ),				# MOV DPS,#0
+				self.instriFrame( 0x90, 0x8000 + offset % 0x8000 ),	# MOV DPTR,#data16
+				self.instrFrame( 0x7A, cHigh ),					# MOV R2,#data
+				self.instrFrame( 0x7B, cLow ),					# MOV R3,#data
+				self.instrFrame( 0x7C, 0x00 ),					# MOV R4,#data
+			])
+		self.runRoutine()
+
+		# No bits to set?
+		return self.instr( 0xEC ) == 0								# MOV A,R4
+
+	def planCODE(self, offset, data, base=None):
+		"""
+		Compare the page segments (see pageSegments) of the data with the
+		flash and decide how to write each one:
+
+		- 'unchanged': the checksums match, nothing to do
+		- 'program': bits only go from 1 to 0, so no erase is needed
+		- 'erase': the page must be erased and programmed
+
+		base is an optional list of CCMemBlock with the current flash
+		contents (ex. a previous dump). The segments of base whose checksum
+		still matches the chip, and the pages known to be erased, are
+		compared on the host, the others on the chip (see canProgramCODE).
+
+		Returns a list of (offset, size, action, current) tuples, where
+		current is the current contents of the segment, or None if not known.
+		"""
+
+		def baseSegment(fAddr, iLen):
+			# The part of base at the given range, if it covers it whole
+			for mb in base or []:
+				if (mb.addr <= fAddr) and (fAddr + iLen <= mb.addr + mb.size):
+					return bytearray( mb.bytes[fAddr-mb.addr:fAddr-mb.addr+iLen] )
+			return None
+
+		def isErased(fAddr):
+			return int( fAddr / self.flashPageSize ) in self.erasedPages
+
+		# Erased pages (see erasePages) are known to be blank
+		segments = self.pageSegments( offset, len(data) )
+		crcs = iter(self.getCODEChecksums([ seg for seg in segments if not isErased(seg[0]) ]))
+		plan = []
+		for fAddr, iLen in segments:
+			new = bytearray( data[fAddr-offset:fAddr-offset+iLen] )
+			if isErased(fAddr):
+				current = bytearray( b"\xff" * iLen )
+				crc = crc16(current)
+			else:
+				crc = next(crcs)
+				current = None
+			if crc == crc16(new):
+				plan.append( (fAddr, iLen, 'unchanged', None) )
+				continue
+
+			# A stale base (ex. NV pages written since) is not used
+			if current is None:
+				current = baseSegment( fAddr, iLen )
+			if (current is not None) and (crc16(current) != crc):
+				current = None
+			if current is not None:
+				program = not any([ n & ~c for n, c in zip(new, current) ])
+			else:
+				program = self.canProgramCODE( fAddr, new )
+			plan.append( (fAddr, iLen, 'program' if program else 'erase', current) )
+
+		return plan
+
+	def writeCODEIncremental(self, offset, data, verify=False, showProgress=False, retries=None,
+		base=None):
+		"""
+		Write the Flash memory following planCODE: the unchanged pages are
+		skipped, the pages that only need bits cleared are programmed
+		without erasing, and only the others are erased and programmed.
+		Parts of the erased pages outside the data are preserved.
+
+		When the current contents are known from base (see planCODE), only
+		the 32-bit words that change are programmed.
+
+		The verify and retries arguments are the ones of writeCODE, and so
+		is the return value.
 
 		WARNING: This requires DMA operations to be unpaused ( use: self.pauseDMA(False) )
 		"""
 
+		# Per-page verification, or once at the end
+		pageVerify = parseVerify(verify)[0]
+		if pageVerify not in ('crc', 'full'):
+			pageVerify = 'off'
+		if retries is None:
+			retries = self.flashRetries
+
+		# Compare the page segments with the chip
+		plan = self.planCODE( offset, data, base )
+		changed = [ p for p in plan if p[2] != 'unchanged' ]
+
+		# Consecutive segments that are programmed whole (blank pages, or
+		# contents not known) are streamed with a single writeCODE
+		jobs = []
+		for fAddr, iLen, action, current in changed:
+			whole = (action == 'program') and ((current is None) or
+				(int( fAddr / self.flashPageSize ) in self.erasedPages))
+			if whole and jobs and (jobs[-1][2] == 'stream') and (jobs[-1][0] + jobs[-1][1] == fAddr):
+				jobs[-1] = (jobs[-1][0], jobs[-1][1] + iLen, 'stream', None)
+			else:
+				jobs.append( (fAddr, iLen, 'stream' if whole else action, current) )
+
+		# Rewrite the changed pages
+		written = 0
+		progress = ProgressTracker( 'write', sum([ p[1] for p in changed ]),
+			source=self.port, show=showProgress )
+		for fAddr, iLen, action, current in jobs:
+			segData = bytes( data[fAddr-offset:fAddr-offset+iLen] )
+
+			if action == 'stream':
+				written += self.writeCODE( fAddr, segData, erase=False, verify=pageVerify,
+					showProgress=None, doubleBuffer=True, retries=retries )
+				progress.advance( iLen )
+				continue
+
+			if action == 'program':
+
+				# Program only the changed 32-bit words
+				runs = []
+				for wAddr in range( fAddr - fAddr % 4, fAddr + iLen, 4 ):
+					lo = max( wAddr, fAddr ) - fAddr
+					hi = min( wAddr + 4, fAddr + iLen ) - fAddr
+					if segData[lo:hi] == bytes(current[lo:hi]):
+						continue
+					if runs and (runs[-1][0] + runs[-1][1] == fAddr + lo):
+						runs[-1] = (runs[-1][0], hi - (runs[-1][0] - fAddr))
+					else:
+						runs.append( (fAddr + lo, hi - lo) )
+				for rAddr, rLen in runs:
+					written += self.writeCODE( rAddr, segData[rAddr-fAddr:rAddr-fAddr+rLen],
+						erase=False, verify='off', showProgress=None )
+
+			else:
+
+				# Complete partial pages with the current flash contents
+				fPage = int( fAddr / self.flashPageSize ) * self.flashPageSize
+				pageData = segData
+				if iLen < self.flashPageSize:
+					head = fAddr - fPage
+					tail = self.flashPageSize - head - iLen
+					pageData = bytes( self.readCODE(fPage, head) if head else b"" ) + pageData
+					pageData += bytes( self.readCODE(fAddr + iLen, tail) if tail else b"" )
+
+				# Erase & program
+				written += self.writeCODE( fPage, pageData, erase=True, verify='off', showProgress=None )
+
+			retries = self.repairCODE( fAddr, segData, pageVerify, retries )
+			progress.advance( iLen )
+
+		# Verify the whole image
+		if pageVerify == 'off':
+			self.repairCODE( offset, data, verify, retries )
+
+		programmed = len([ p for p in changed if p[2] == 'program' ])
+		progress.finish( "%i of %i pages unchanged, %i programmed without erase" % (
+			len(plan) - len(changed), len(plan), programmed) )
+
+		return written
+
+	def writeCODELoader(self, offset, data, erase=False, verify=False, showProgress=False, retries=None,
+		compress=False):
+		"""
+		Write the Flash memory with the on-chip flash loader, which erases,
+		programs and waits for the flash controller by itself.
+
+		For every 2048-byte chunk the host only sends a brust-write with the
+		data and one batch of frames with the loader parameters (along with
+		the DMA setup for the next chunk), then polls until the CPU halts.
+		The arguments are the ones of writeCODE.
+
+		With compress=True the chunks that get smaller with packBits are sent
+		compressed to a second buffer, and expanded on the chip before the
+		loader runs (see ccroutines.packBitsRoutine).
+
+		Returns the number of bytes programmed, like writeCODE.
+
+		WARNING: This requires DMA operations to be unpaused ( use: self.pauseDMA(False) )
+		"""
+
+		# Per-chunk verification, or once at the end
+		chunkVerify = parseVerify(verify)[0]
+		if chunkVerify not in ('crc', 'full'):
+			chunkVerify = 'off'
+		if retries is None:
+			retries = self.flashRetries
+
+		# Keep the unpadded image for the final verification
+		imageOffset, imageData = offset, data
+
 		# Pad data so that the start and end address are on 4-byte boundaries.
 		data = b"\xff" * (offset % 4) + data
 		data = data + b"\xff" * (-len(data) % 4)
 		offset -= offset % 4
 
-		# Prepare DMA-0 for DEBUG -> RAM (using DBG_BW trigger)
-		self.configDMAChannel( 0, 0x6260, 0x0000, 0x1F, tlen=self.bulkBlockSize, srcInc=0, dstInc=1, priority=1, interrupt=True )
-		# Prepare DMA-1 for RAM -> FLASH (using the FLASH trigger)
-		self.configDMAChannel( 1, 0x0000, 0x6273, 0x12, tlen=self.bulkBlockSize, srcInc=1, dstInc=0, priority=2, interrupt=True )
+		# DMA channels for DEBUG -> RAM (DBG_BW trigger) and RAM -> FLASH
+		# (FLASH trigger, armed by the loader)
+		ramAddr = 0x0000
+		chUp, chFlash = self.loaderDMAChannels
+
+		def uploadFrames(k):
+			# Compressed chunks go to the second buffer
+			packed = chunks[k][3]
+			if packed is None:
+				dstAddr, iLen = ramAddr, chunks[k][1]
+			else:
+				dstAddr, iLen = self.unpackBufferAddr, len(packed)
+			return self.configDMAChannelFrames( chUp, 0x6260, dstAddr, 0x1F, tlen=iLen, srcInc=0, dstInc=1, priority=1, interrupt=True ) + \
+				self.armDMAChannelFrames( chUp )
+
+		def flashFrames(iLen):
+			self.shadow['DMADISARMED'] = self.shadow.get('DMADISARMED', 0) & ~(1 << chFlash)
+			return self.configDMAChannelFrames( chFlash, ramAddr, 0x6273, 0x12, tlen=iLen, srcInc=1, dstInc=0, priority=2, interrupt=True )
 
 		# Reset flags
 		self.clearFlashStatus()
-		self.clearDMAIRQ(0)
-		self.clearDMAIRQ(1)
-		self.disarmDMAChannel(0)
-		self.disarmDMAChannel(1)
-
-		# Split in 2048-byte chunks
-		iOfs = 0
-		while (iOfs < len(data)):
-
-			# Check if we should show progress
-			if showProgress:
-				print("\r    Progress %0.0f%%... " % (iOfs*100/len(data)), end=' ')
-				sys.stdout.flush()
-
-			# Get next page
-			iLen = min( len(data) - iOfs, self.bulkBlockSize )
-
-			# Update DMA configuration if we have less than bulk-block size data
-			if (iLen < self.bulkBlockSize):
-				self.configDMAChannel( 0, 0x6260, 0x0000, 0x1F, tlen=iLen, srcInc=0, dstInc=1, priority=1, interrupt=True )
-				self.configDMAChannel( 1, 0x0000, 0x6273, 0x12, tlen=iLen, srcInc=1, dstInc=0, priority=2, interrupt=True )
-
-			# Upload to RAM through DMA-0
-			self.armDMAChannel(0)
+		for ch in (chUp, chFlash):
+			self.clearDMAIRQ(ch)
+			self.disarmDMAChannel(ch)
+
+		# Split in 2048-byte chunks, blank chunks are not sent and the
+		# others are compressed if that makes them smaller
+		chunks = []
+		for iOfs in range(0, len(data), self.bulkBlockSize):
+			chunk = data[iOfs:iOfs+self.bulkBlockSize]
+			blank = bytearray(chunk).count(0xFF) == len(chunk)
+			packed = packBits(chunk) if compress and not blank else None
+			if (packed is not None) and (len(packed) >= len(chunk)):
+				packed = None
+			chunks.append( (iOfs, len(chunk), blank, packed) )
+
+		skipped = 0
+		sent = 0
+		armed = False
+		progress = ProgressTracker( 'write', len(data), source=self.port, show=showProgress )
+		state = self.startLoader(compress)
+		try:
+			for k, (iOfs, iLen, blank, packed) in enumerate(chunks):
+
+				progress.update( iOfs )
+
+				# Calculate the page(s) where this data belong to
+				chunk = data[iOfs:iOfs+iLen]
+				fAddr = offset + iOfs
+				fPage = int( fAddr / self.flashPageSize )
+				pages = set(range( fPage, int( (fAddr + iLen - 1) / self.flashPageSize ) + 1 ))
+
+				if blank:
+					skipped += iLen
+				if not (blank and not erase):
+
+					# Upload the chunk to RAM
+					frames = []
+					if not blank:
+						if not armed:
+							self.sendFrames( uploadFrames(k) )
+						payload = chunk if packed is None else packed
+						self.brustWrite( payload )
+						sent += len(payload)
+						frames += flashFrames(iLen)
+
+					# Prepare the upload of the next chunk meanwhile
+					armed = (k + 1 < len(chunks)) and not chunks[k+1][2]
+					if armed:
+						frames += uploadFrames(k + 1)
+
+					# Start with the decompression, which then jumps to the loader
+					entry = self.loaderAddr
+					if packed is not None:
+						entry = self.unpackAddr
+						frames += [
+							self.instrFrame( 0x75, 0x92, 0x01 ),			# MOV DPS,#1
+							self.instriFrame( 0x90, ramAddr ),				# MOV DPTR,#data16
+							self.instrFrame( 0x75, 0x92, 0x00 ),			# MOV DPS,#0
+							self.instriFrame( 0x90, self.unpackBufferAddr ),	# MOV DPTR,#data16
+						]
+
+					# Run the loader (FADDRH[7:1] also selects the page to erase)
+					fWordOffset = int(fAddr / 4)
+					self.sendFrames( frames + [
+						self.instrFrame( 0x79, fWordOffset & 0xFF ),			# MOV R1,#data
+						self.instrFrame( 0x7A, (fWordOffset >> 8) & 0xFF ),	# MOV R2,#data
+						self.instrFrame( 0x7B, (1 if erase else 0) | (0 if blank else 2) ),	# MOV R3,#data
+						self.instriFrame( 0x02, 0x8000 + entry ),			# LJMP addr16
+						( CMD_RESUME, ),
+					])
+					self.waitLoader( fPage )
+					if erase:
+						self.erasedPages.add(fPage)
+					if not blank:
+						self.erasedPages -= pages
+
+				# Check if we should verify (blank chunks on pages known to be
+				# erased need no verification)
+				if (chunkVerify != 'off') and not (blank and pages.issubset(self.erasedPages)):
+					left = self.repairCODE( fAddr, chunk, chunkVerify, retries )
+					# Page rewrites use the DMA channels, the next upload must be set up again
+					if left < retries:
+						armed = False
+					retries = left
+		finally:
+			self.stopLoader( state )
+
+		# Verify the whole image
+		if chunkVerify == 'off':
+			self.repairCODE( imageOffset, imageData, verify, retries )
+
+		# Report the link savings
+		notes = []
+		if skipped:
+			notes.append( "%i blank bytes skipped" % skipped )
+		if compress:
+			raw = len(data) - skipped
+			notes.append( "%i of %i bytes sent compressed, %0.0f%% saved" % (sent, raw, 100.0 * (raw - sent) / max(raw, 1)) )
+		progress.finish( ", ".join(notes) if notes else None )
+		return len(data) - skipped
+
+	def writeCODE(self, offset, data, erase=False, verify=False, showProgress=False, incremental=False,
+		doubleBuffer=False, retries=None, loader=False, compress=False, base=None):
+		"""
+		Fully automated function for writing the Flash memory.
+
+		The verify argument selects a verification policy (see parseVerify).
+		With 'full' (or True) every chunk is read back and compared, with
+		'crc' its checksum is computed on the chip and compared with the one
+		of the data (see getCODEChecksums). The 'sample' and 'deferred'
+		policies verify the image once, after programming (see verifyCODE).
+
+		A page that fails verification is erased and programmed again, up to
+		retries pages per call (flashRetries by default), before giving up
+		with a CCVerifyError (see repairCODE).
+
+		With incremental=True only the pages that differ from the data are
+		written, and erased only if they need to (see writeCODEIncremental).
+		base optionally gives the current flash contents (see planCODE).
+
+		With doubleBuffer=True two RAM buffers (0x0000 and 0x0800) are used
+		in turns, so the next chunk is uploaded while the previous one is
+		being written to flash.
+
+		With loader=True the flash steps run on the chip instead (see
+		writeCODELoader), so each chunk costs a few frames. With
+		compress=True (which implies loader) the chunks are also sent
+		compressed and expanded on the chip.
+
+		Returns the number of bytes programmed, in every mode: the data
+		(padded to 32-bit words) without the blank chunks, which are not
+		sent, and without the unchanged words of incremental writes. Pages
+		rewritten after a verification failure are not counted.
+
+		WARNING: This requires DMA operations to be unpaused ( use: self.pauseDMA(False) )
+		"""
+
+		# Per-chunk verification, or once at the end
+		chunkVerify = parseVerify(verify)[0]
+		if chunkVerify not in ('crc', 'full'):
+			chunkVerify = 'off'
+
+		if retries is None:
+			retries = self.flashRetries
+
+		# Incremental mode rewrites only the changed pages
+		if incremental:
+			return self.writeCODEIncremental( offset, data, verify=verify, showProgress=showProgress,
+				retries=retries, base=base )
+		if loader or compress:
+			return self.writeCODELoader( offset, data, erase=erase, verify=verify,
+				showProgress=showProgress, retries=retries, compress=compress )
+
+		# Keep the unpadded image for the final verification
+		imageOffset, imageData = offset, data
+
+		# Pad data so that the start and end address are on 4-byte boundaries.
+		data = b"\xff" * (offset % 4) + data
+		data = data + b"\xff" * (-len(data) % 4)
+		offset -= offset % 4
+
+		# RAM buffers, each with a DMA channel for DEBUG -> RAM (using the
+		# DBG_BW trigger) and one for RAM -> FLASH (using the FLASH trigger)
+		buffers = [ (0x0000, 0, 1) ]
+		if doubleBuffer:
+			buffers.append( (0x0800, 2, 3) )
+
+		def configBuffer(b, iLen):
+			# Prepare the DMA channels of a buffer for the given chunk length
+			# (no frames are sent if the shadow descriptors already match)
+			ramAddr, chUp, chFlash = buffers[b]
+			self.sendFrames(
+				self.configDMAChannelFrames( chUp, 0x6260, ramAddr, 0x1F, tlen=iLen, srcInc=0, dstInc=1, priority=1, interrupt=True ) +
+				self.configDMAChannelFrames( chFlash, ramAddr, 0x6273, 0x12, tlen=iLen, srcInc=1, dstInc=0, priority=2, interrupt=True ) +
+				self.armDMAChannelFrames( chUp ) )
+
+		def upload(k):
+			# Upload a chunk to its RAM buffer
+			iOfs, iLen, blank = chunks[k]
+			if blank:
+				return
+			b = k % len(buffers)
+			configBuffer(b, iLen)
 			self.brustWrite( data[iOfs:iOfs+iLen] )
 
-			# Wait until DMA-0 raises interrupt
-			while not self.isDMAIRQ(0):
-				time.sleep(0.010)
+			# Wait until the DMA raises interrupt
+			while not self.isDMAIRQ(buffers[b][1]):
+				self.pollSleep(0.010)
 
 			# Clear DMA IRQ flag
-			self.clearDMAIRQ(0)
+			self.clearDMAIRQ(buffers[b][1])
 
-			# Calculate the page where this data belong to
+		# Reset flags
+		self.clearFlashStatus()
+		for b, (ramAddr, chUp, chFlash) in enumerate(buffers):
+			self.clearDMAIRQ(chUp)
+			self.clearDMAIRQ(chFlash)
+			self.disarmDMAChannel(chUp)
+			self.disarmDMAChannel(chFlash)
+
+		# Split in 2048-byte chunks. Programming 0xFF bits is a no-op, so
+		# blank chunks are not sent
+		chunks = []
+		for iOfs in range(0, len(data), self.bulkBlockSize):
+			chunk = data[iOfs:iOfs+self.bulkBlockSize]
+			chunks.append( (iOfs, len(chunk), bytearray(chunk).count(0xFF) == len(chunk)) )
+
+		# Upload the first chunk
+		skipped = 0
+		progress = ProgressTracker( 'write', len(data), source=self.port, show=showProgress )
+		if chunks:
+			upload(0)
+
+		for k, (iOfs, iLen, blank) in enumerate(chunks):
+
+			progress.update( iOfs )
+
+			# Calculate the page(s) where this data belong to
+			chunk = data[iOfs:iOfs+iLen]
 			fAddr = offset + iOfs
 			fPage = int( fAddr / self.flashPageSize )
+			pages = set(range( fPage, int( (fAddr + iLen - 1) / self.flashPageSize ) + 1 ))
+			ramAddr, chUp, chFlash = buffers[k % len(buffers)]
 
 			# Check if we should erase page first
 			if erase:
@@ -570,41 +1403,62 @@ class CC254X(ChipDriver):
 				#
 				cHigh = (fPage << 1)
 				cLow = 0
-				self.writeXDATA( 0x6271, [cLow, cHigh] )
-				# Set the erase bit
-				self.setFlashErase()
+				# Set the erase bit, in the same batch
+				self.sendFrames( self.writeXDATAFrames( 0x6271, [cLow, cHigh] ) + self.writeFCTLFrames(0x01) )
 				# Wait until flash is not busy any more
 				while self.isFlashBusy():
-					time.sleep(0.010)
-
-			# Calculate FLASH address High/Low bytes
-			# for writing (addressable as 32-bit words)
-			fWordOffset = int(fAddr / 4)
-			cHigh = (fWordOffset >> 8) & 0xFF
-			cLow = fWordOffset & 0xFF
-			self.writeXDATA( 0x6271, [cLow, cHigh] )
-
-			# Upload to FLASH through DMA-1
-			self.armDMAChannel(1)
-			self.setFlashWrite()
-
-			# Wait until DMA-1 raises interrupt
-			while not self.isDMAIRQ(1):
-				# Also check for errors
-				if self.isFlashAbort():
-					self.disarmDMAChannel(1)
-					raise IOError("Flash page 0x%02x is locked!" % fPage)
-				time.sleep(0.010)
-
-			# Clear DMA IRQ flag
-			self.clearDMAIRQ(1)
-
-			# Check if we should verify
-			if verify:
-				verifyBytes = self.readCODE(fAddr, iLen)
-				if verifyBytes != data[iOfs:iOfs+iLen]:
-					raise IOError("Flash verification error on offset 0x%04x" % fAddr)
-			iOfs += iLen
-
-		if showProgress:
-			print("\r    Progress 100%... OK")
+					self.pollSleep(0.010)
+				self.erasedPages.add(fPage)
+
+			if not blank:
+
+				# Calculate FLASH address High/Low bytes
+				# for writing (addressable as 32-bit words)
+				fWordOffset = int(fAddr / 4)
+				cHigh = (fWordOffset >> 8) & 0xFF
+				cLow = fWordOffset & 0xFF
+
+				# Upload to FLASH through the DMA, in one batch
+				self.sendFrames( self.writeXDATAFrames( 0x6271, [cLow, cHigh] ) +
+					self.armDMAChannelFrames(chFlash) + self.writeFCTLFrames(0x02) )
+				self.erasedPages -= pages
+
+			# Upload the next chunk to the other buffer meanwhile
+			if doubleBuffer and (k + 1 < len(chunks)):
+				upload(k + 1)
+
+			if not blank:
+
+				# Wait until the DMA raises interrupt
+				while not self.isDMAIRQ(chFlash):
+					# Also check for errors
+					if self.isFlashAbort():
+						self.disarmDMAChannel(chFlash)
+						raise CCFlashLockedError(fPage)
+					self.pollSleep(0.010)
+
+				# Clear DMA IRQ flag
+				self.clearDMAIRQ(chFlash)
+
+			if blank:
+				skipped += iLen
+
+			# Check if we should verify (blank chunks on pages known to be
+			# erased need no verification)
+			if (chunkVerify != 'off') and not (blank and pages.issubset(self.erasedPages)):
+				left = self.repairCODE( fAddr, chunk, chunkVerify, retries )
+				# Page rewrites use the first RAM buffer, which may hold the next chunk
+				if (left < retries) and doubleBuffer and (k + 1 < len(chunks)):
+					upload(k + 1)
+				retries = left
+
+			# Upload the next chunk
+			if (not doubleBuffer) and (k + 1 < len(chunks)):
+				upload(k + 1)
+
+		# Verify the whole image
+		if chunkVerify == 'off':
+			self.repairCODE( imageOffset, imageData, verify, retries )
+
+		progress.finish( ("%i blank bytes skipped" % skipped) if skipped else None )
+		return len(data) - skipped
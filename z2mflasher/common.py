@@ -5,6 +5,7 @@ import esptool
 
 from z2mflasher.const import HTTP_REGEX
 from z2mflasher.helpers import prevent_print
+from z2mflasher.progress import ProgressTracker
 
 
 class EsphomeflasherError(Exception):
@@ -208,3 +209,48 @@ def detect_chip(port, force_esp8266=False, force_esp32=False):
         raise EsphomeflasherError("Error connecting to ESP: {}".format(err))
 
     return chip
+
+
+class FlashProgress(object):
+    """Report the progress of esptool.write_flash as progress events.
+
+    esptool prints its progress itself, so the flash block commands of the
+    stub chip are wrapped while in the context. With compression the sizes
+    are the compressed ones, which is what goes over the serial port.
+    """
+
+    def __init__(self, chip, phase='write', source=None):
+        self.chip = chip
+        self.phase = phase
+        self.source = source
+        self.tracker = None
+
+    def __enter__(self):
+        self._wrap('flash_begin', 'flash_block', 0)
+        self._wrap('flash_defl_begin', 'flash_defl_block', 1)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for name in ('flash_begin', 'flash_block', 'flash_defl_begin', 'flash_defl_block'):
+            self.chip.__dict__.pop(name, None)
+        if self.tracker is not None and exc_type is None:
+            self.tracker.finish()
+
+    def _wrap(self, begin_name, block_name, size_arg):
+        begin = getattr(self.chip, begin_name)
+        block = getattr(self.chip, block_name)
+
+        def wrapped_begin(*args, **kwargs):
+            # A new file (or region) is being written
+            if self.tracker is not None:
+                self.tracker.finish()
+            self.tracker = ProgressTracker(self.phase, args[size_arg], source=self.source)
+            return begin(*args, **kwargs)
+
+        def wrapped_block(data, *args, **kwargs):
+            ret = block(data, *args, **kwargs)
+            self.tracker.advance(len(data))
+            return ret
+
+        setattr(self.chip, begin_name, wrapped_begin)
+        setattr(self.chip, block_name, wrapped_block)
@@ -10,6 +10,7 @@ import wx.lib.inspection
 import wx.lib.mixins.inspection
 
 from z2mflasher.helpers import list_serial_ports
+from z2mflasher.progress import add_listener
 
 
 COLOR_RE = re.compile(r'(?:\033)(?:\[(.*?)[@-~]|\].*?(?:\007|\033\\))')
@@ -220,6 +221,7 @@ class MainFrame(wx.Frame):
         self._redirect = RedirectText(self.console_ctrl)
         sys.stdout = self._redirect
         sys.stderr = self._redirect
+        add_listener(self._on_progress)
 
         self.SetMinSize((500, 380))
         self.Centre(wx.BOTH)
@@ -316,6 +318,15 @@ class MainFrame(wx.Frame):
         esp_fs_label = wx.StaticText(panel, label="FileSystem")
         flash_file_label = wx.StaticText(panel, label="")
 
+        progress_label = wx.StaticText(panel, label="Progress")
+        self.progress_gauge = wx.Gauge(panel, range=100)
+        self.progress_text = wx.StaticText(panel, label="")
+
+        progress_boxsizer = wx.BoxSizer(wx.HORIZONTAL)
+        progress_boxsizer.Add(self.progress_gauge, 1, wx.ALIGN_CENTER)
+        progress_boxsizer.AddSpacer(10)
+        progress_boxsizer.Add(self.progress_text, 0, wx.ALIGN_CENTER)
+
         console_label = wx.StaticText(panel, label="Console")
 
         fgs.AddMany([
@@ -327,10 +338,12 @@ class MainFrame(wx.Frame):
             esp_fs_label, (esp_fs_file_picker, 1, wx.EXPAND),
             # Flash firmware button
             flash_file_label, (flash_boxsizer, 1, wx.EXPAND),
+            # Progress of the current operation
+            progress_label, (progress_boxsizer, 1, wx.EXPAND),
             # Console View (growable)
             (console_label, 1, wx.EXPAND), (self.console_ctrl, 1, wx.EXPAND),
         ])
-        fgs.AddGrowableRow(4, 1)
+        fgs.AddGrowableRow(5, 1)
         fgs.AddGrowableCol(1, 1)
         hbox.Add(fgs, proportion=2, flag=wx.ALL | wx.EXPAND, border=15)
         panel.SetSizer(hbox)
@@ -352,6 +365,16 @@ class MainFrame(wx.Frame):
     def log_message(self, message):
         self.console_ctrl.AppendText(message)
 
+    def _on_progress(self, event):
+        # Called from the flashing thread
+        text = "%s %d%%" % (event.phase, event.percent)
+        if event.average:
+            text += ", %.1f KB/s" % (event.average / 1024)
+        if event.eta is not None and not event.final:
+            text += ", %ds left" % event.eta
+        wx.CallAfter(self.progress_gauge.SetValue, int(event.percent))
+        wx.CallAfter(self.progress_text.SetLabel, text)
+
 
 class App(wx.App, wx.lib.mixins.inspection.InspectionMixin):
     def OnInit(self):
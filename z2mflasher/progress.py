@@ -0,0 +1,160 @@
+"""
+Progress and throughput events of the flashing operations.
+
+The CC drivers, esp_flash and upload_spiffs report their progress through a
+ProgressTracker, which turns (bytes done, total) updates into ProgressEvent
+objects and hands them to the registered listeners. A listener is any
+callable taking the event, so a queue can be fed with add_listener(q.put).
+
+Events are rate-limited (see ProgressTracker.interval), the first and last
+events of an operation are always sent.
+"""
+from __future__ import print_function
+
+import json
+import sys
+import threading
+import time
+
+_listeners = []
+_lock = threading.Lock()
+
+
+def add_listener(listener):
+    """Register a callable that receives every ProgressEvent."""
+    with _lock:
+        _listeners.append(listener)
+    return listener
+
+
+def remove_listener(listener):
+    with _lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+
+def emit(event):
+    with _lock:
+        listeners = list(_listeners)
+    for listener in listeners:
+        listener(event)
+
+
+class ProgressEvent(object):
+    def __init__(self, phase, done, total, rate, average, eta, source=None, final=False,
+                 message=None):
+        self.phase = phase
+        self.done = done
+        self.total = total
+        # Instantaneous (since the previous event) and average throughput, in bytes/s
+        self.rate = rate
+        self.average = average
+        # Estimated seconds left, None if unknown
+        self.eta = eta
+        self.source = source
+        self.final = final
+        self.message = message
+
+    @property
+    def percent(self):
+        if not self.total:
+            return 100.0 if self.final else 0.0
+        return self.done * 100.0 / self.total
+
+    def as_dict(self):
+        return {
+            'phase': self.phase,
+            'done': self.done,
+            'total': self.total,
+            'rate': self.rate,
+            'average': self.average,
+            'eta': self.eta,
+            'source': self.source,
+            'final': self.final,
+            'message': self.message,
+        }
+
+
+class ProgressTracker(object):
+    """Progress of one operation (phase) of a known total size in bytes.
+
+    With show=True the progress is also rendered on stdout (see
+    print_progress), for the callers that used to print it themselves. With
+    show=None no events are sent at all, for operations that are part of
+    another one that already reports its progress.
+    """
+
+    # Minimum seconds between two events
+    interval = 0.25
+
+    def __init__(self, phase, total, source=None, show=False):
+        self.phase = phase
+        self.total = total
+        self.source = source
+        self.show = show
+        self.done = 0
+        self.start = time.time()
+        self._last_time = self.start
+        self._last_done = 0
+        self._send(self.start, False, None)
+
+    def update(self, done):
+        """Set the bytes done so far."""
+        self.done = done
+        now = time.time()
+        if now - self._last_time >= self.interval:
+            self._send(now, False, None)
+
+    def advance(self, count):
+        """Add to the bytes done so far."""
+        self.update(self.done + count)
+
+    def finish(self, message=None):
+        """Send the final event, with an optional summary message."""
+        self.done = max(self.done, self.total)
+        self._send(time.time(), True, message)
+
+    def _send(self, now, final, message):
+        elapsed = now - self.start
+        average = self.done / elapsed if elapsed > 0 else 0.0
+        if now > self._last_time:
+            rate = (self.done - self._last_done) / (now - self._last_time)
+        else:
+            rate = average
+        eta = (self.total - self.done) / average if average > 0 else None
+        self._last_time = now
+        self._last_done = self.done
+
+        if self.show is None:
+            return
+        event = ProgressEvent(self.phase, self.done, self.total, rate, average, eta,
+                              source=self.source, final=final, message=message)
+        if self.show:
+            print_progress(event)
+        emit(event)
+
+
+def print_progress(event, out=None):
+    """Render an event on the terminal, overwriting the previous one."""
+    out = out or sys.stdout
+    line = "\r    Progress %0.0f%%" % event.percent
+    if event.average:
+        line += " (%0.1f KB/s)" % (event.average / 1024)
+    if event.final:
+        line += "... OK"
+        if event.message:
+            line += " (%s)" % event.message
+        print(line, file=out)
+    else:
+        if event.eta is not None and event.done:
+            line += ", %is left" % event.eta
+        print(line + "... ", end=' ', file=out)
+        out.flush()
+
+
+def json_listener(stream):
+    """Return a listener that writes the events to a stream as JSON lines."""
+    def write_event(event):
+        stream.write(json.dumps(event.as_dict(), sort_keys=True) + "\n")
+        stream.flush()
+    return write_event